@@ -672,6 +672,74 @@ class BuildBundle(Bundle):
     def dependencies(self):
         return self.config.build.get('dependencies')
 
+    def prefetch_urls(self):
+        """Return the urls, or build.sources keys, of the files that the prefetch phase
+        downloads. The default is the build.sources that have remote urls. Override to
+        prefetch files that the bundle finds some other way. """
+        import urlparse
+
+        sources = (self.config.group('build') or {}).get('sources', None) or {}
+
+        urls = []
+        for key, source in sources.items():
+            url = source.get('url') if isinstance(source, dict) else source
+
+            if isinstance(url, basestring) and urlparse.urlparse(url).scheme in ('http', 'https', 'ftp'):
+                urls.append(key)
+
+        return urls
+
+    def prefetch(self, n=4):
+        """Download all of the files from prefetch_urls() into the downloads cache, on n threads.
+        Failures are logged, not raised, since the build will retry the download when it
+        uses the file. Returns the number of files that failed. """
+        from time import time
+        import os
+
+        urls = []
+        for url in self.prefetch_urls():
+            if url not in urls:
+                urls.append(url)
+
+        fetch = []
+
+        for url in urls:
+            path = self.filesystem.download_cached(url)
+
+            if path:
+                self.log("Prefetch: already cached: {}".format(url))
+            else:
+                fetch.append(url)
+
+        if not fetch:
+            self.log("Prefetch: all {} files are cached".format(len(urls)))
+            return 0
+
+        self.log("Prefetch: downloading {} of {} files on {} threads".format(len(fetch), len(urls), n))
+
+        start = time()
+
+        errors = {}
+        paths = self.filesystem.download_many(fetch, n=n, errors=errors)
+
+        elapsed = time() - start
+        total = 0
+
+        for url in fetch:
+            if url in errors:
+                self.error("Prefetch: failed to download {}: {}".format(url, errors[url]))
+            else:
+                size = os.path.getsize(paths[url])
+                total += size
+                self.log("Prefetch: downloaded {} ({:.1f} MB)".format(url, size / 1048576.0))
+
+        failures = len(errors)
+
+        self.log("Prefetch: downloaded {:.1f} MB in {:.1f}s ({:.2f} MB/s); {} failed"
+                 .format(total / 1048576.0, elapsed, total / 1048576.0 / elapsed if elapsed else 0, failures))
+
+        return failures
+
 
     def clean(self, clean_meta=False):
         """Remove all files generated by the build process"""
@@ -977,6 +1045,10 @@ class BuildBundle(Bundle):
         if python_dir and python_dir not in sys.path:
             sys.path.append(python_dir)
 
+        # Download the sources before the build, unless the bundle configuration turns it off
+        if (self.config.group('build') or {}).get('prefetch', True):
+            self.prefetch()
+
         return True
 
     def build(self):
@@ -1275,35 +1347,36 @@ class BuildBundle(Bundle):
 
         self.run_args = AttrDict(vars(args))
 
-    def run_mp(self, method, arg_sets):
-        from ..run import mp_run
-        from multiprocessing import Pool, cpu_count
+    def run_mp(self, method, arg_sets, costs=None, retries=0, max_writers=None):
+        """Run a method once for each of the argument sets, on the number of processes
+        given by the --multi option, with a BuildScheduler.
 
-        if len(arg_sets) == 0:
-            return
+        Args:
+            method. The bundle method to run
+            arg_sets. A list of argument tuples, or of scalars for one argument methods
+            costs. Optional list of the estimated costs of each task, to run the largest first
+            retries. Number of times to retry failed tasks. Only set it for methods that
+                are safe to run again after a partial failure
+            max_writers. If set, the maximum number of tasks that may write at the same time
 
-        # Argsets should be tuples, but for one ag functions, the
-        # caller may pass in a scalar, which we have to convert.
-        if not isinstance(arg_sets[0], (list, tuple)):
-            arg_sets = ((arg,) for arg in arg_sets)
+        Raises a ProcessError if any of the tasks failed after the retries.
+        """
+        from .scheduler import BuildScheduler
 
-        n = int(self.run_args.get('multi'))
+        if len(arg_sets) == 0:
+            return
 
-        if n == 0:
-            n = cpu_count()
+        scheduler = BuildScheduler(self, n=self.run_args.get('multi'), retries=retries,
+                                   max_writers=max_writers)
 
-        if n == 1:
-            self.log(
-                "Requested MP run, but for only 1 process; running in process instead")
-            for args in arg_sets:
-                method(*args)
-        else:
-            self.log("Multi processor run with {} processes".format(n))
+        for i, args in enumerate(arg_sets):
+            scheduler.add(method, args, cost=costs[i] if costs else 1)
 
-            pool = Pool(n)
+        failures = scheduler.run()
 
-            pool.map(mp_run, [(self.bundle_dir, dict(self.run_args), method.__name__, args)
-                              for args in arg_sets])
+        if failures:
+            raise ProcessError("{} of {} tasks for {} failed".format(
+                len(failures), len(scheduler.tasks), method.__name__))
 
     def _info(self, identity=None):
         """Return a nested, ordered dict  of information about the bundle. """
@@ -0,0 +1,227 @@
+"""A scheduler for running bundle build tasks, such as building partitions, on a
+pool of processes.
+
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import os
+
+# Per-process state for the pool workers, set by _init_worker
+_writer_semaphore = None
+_worker_bundles = {}
+
+
+class BuildTask(object):
+    '''A call of a bundle method, with its arguments and an estimated cost, which is used
+    to run the largest tasks first. Writer tasks are limited by the scheduler's max_writers'''
+
+    def __init__(self, method_name, args=(), cost=1, writer=True):
+
+        if not isinstance(args, (list, tuple)):
+            args = (args,)
+
+        self.method_name = method_name
+        self.args = tuple(args)
+        self.cost = cost
+        self.writer = writer
+
+        self.attempts = 0
+        self.time = None
+        self.error = None
+
+    def __str__(self):
+        return "{}{}".format(self.method_name, self.args)
+
+
+def _init_worker(semaphore):
+    global _writer_semaphore
+    _writer_semaphore = semaphore
+
+
+def _worker_bundle(bundle_dir, run_args):
+    '''Load the bundle for a worker, once per process'''
+    from ..run import import_file
+    from ..util import AttrDict
+
+    if bundle_dir not in _worker_bundles:
+        rp = os.path.realpath(os.path.join(bundle_dir, 'bundle.py'))
+        mod = import_file(rp)
+        _worker_bundles[bundle_dir] = mod.Bundle(os.path.dirname(rp))
+
+    b = _worker_bundles[bundle_dir]
+    b.run_args = AttrDict(run_args)
+
+    return b
+
+
+def run_task(task_args):
+    '''Run a build task in a pool worker. Errors are returned, rather than raised, so
+    the parent can retry the task and report all of the failures at the end. '''
+    import traceback
+    import time
+
+    i, bundle_dir, run_args, method_name, args, writer = task_args
+
+    start = time.time()
+
+    try:
+        b = _worker_bundle(bundle_dir, run_args)
+        method = getattr(b, method_name)
+
+        if writer and _writer_semaphore:
+            with _writer_semaphore:
+                method(*args)
+        else:
+            method(*args)
+
+        error = None
+
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except:
+        error = traceback.format_exc()
+
+    return i, os.getpid(), time.time() - start, error
+
+
+class BuildScheduler(object):
+    '''Run build tasks on a process pool, largest estimated cost first. Idle workers take the next
+    task as soon as they finish one, and the parent logs the progress and timing of each task.
+    The failures are collected and reported after all of the tasks have run, rather than
+    aborting the run. Failed tasks are retried only if retries is set, since a task that
+    failed part way through writing a partition may not be safe to run again. '''
+
+    def __init__(self, bundle, n=None, retries=0, max_writers=None):
+        from multiprocessing import cpu_count
+
+        self.bundle = bundle
+        self.n = int(n) if n else cpu_count()
+        self.retries = retries
+        self.max_writers = max_writers
+        self.tasks = []
+
+    def add(self, method, args=(), cost=1, writer=True):
+        '''Add a task. The method may be a bound method of the bundle or a method name'''
+
+        method_name = method if isinstance(method, basestring) else method.__name__
+
+        self.tasks.append(BuildTask(method_name, args, cost=cost, writer=writer))
+
+    @property
+    def failures(self):
+        return [t for t in self.tasks if t.error]
+
+    def _log_progress(self, task, done, pid):
+
+        total_cost = sum(t.cost for t in self.tasks)
+
+        if task.error:
+            self.bundle.error("Task {} failed on attempt {} after {:.1f}s (pid {})"
+                              .format(task, task.attempts, task.time, pid))
+        else:
+            self.bundle.log("Task {} done in {:.1f}s (pid {}); {}/{} tasks, {:.0f}% of cost"
+                            .format(task, task.time, pid, done, len(self.tasks),
+                                    100.0 * sum(t.cost for t in self.tasks if t.time and not t.error) / total_cost
+                                    if total_cost else 100.0))
+
+    def _run_serial(self, tasks):
+        import traceback
+        import time
+
+        for task in tasks:
+            task.attempts += 1
+            start = time.time()
+
+            try:
+                getattr(self.bundle, task.method_name)(*task.args)
+                task.error = None
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                task.error = traceback.format_exc()
+
+            task.time = time.time() - start
+
+            yield task, os.getpid()
+
+    def _run_pool(self, pool, tasks):
+
+        bundle_dir = self.bundle.bundle_dir
+        run_args = dict(self.bundle.run_args)
+
+        index = {id(t): t for t in tasks}
+
+        task_args = [(id(t), bundle_dir, run_args, t.method_name, t.args, t.writer) for t in tasks]
+
+        for t in tasks:
+            t.attempts += 1
+
+        # chunksize=1 hands out one task at a time, so the tasks run in the sorted order and
+        # idle workers pick up the remaining tasks.
+        for i, pid, elapsed, error in pool.imap_unordered(run_task, task_args, chunksize=1):
+            task = index[i]
+            task.time = elapsed
+            task.error = error
+
+            yield task, pid
+
+    def run(self):
+        '''Run all of the tasks, and return the tasks that failed after all of the retries. '''
+        from multiprocessing import Pool, Semaphore
+        import time
+
+        if not self.tasks:
+            return []
+
+        start = time.time()
+
+        pending = sorted(self.tasks, key=lambda t: t.cost, reverse=True)
+
+        if self.n == 1:
+            self.bundle.log("Running {} tasks in process".format(len(pending)))
+            pool = None
+        else:
+            self.bundle.log("Running {} tasks on {} processes".format(len(pending), self.n))
+
+            semaphore = Semaphore(self.max_writers) if self.max_writers else None
+            pool = Pool(self.n, initializer=_init_worker, initargs=(semaphore,))
+
+        try:
+            done = 0
+
+            for attempt in range(self.retries + 1):
+
+                if attempt > 0:
+                    self.bundle.log("Retrying {} failed tasks".format(len(pending)))
+
+                results = self._run_pool(pool, pending) if pool else self._run_serial(pending)
+
+                for task, pid in results:
+                    if not task.error:
+                        done += 1
+
+                    self._log_progress(task, done, pid)
+
+                pending = [t for t in pending if t.error]
+
+                if not pending:
+                    break
+
+            if pool:
+                pool.close()
+                pool.join()
+
+        except:
+            if pool:
+                pool.terminate()
+            raise
+
+        failures = self.failures
+
+        self.bundle.log("Ran {} tasks in {:.1f}s; {} failed".format(len(self.tasks), time.time() - start, len(failures)))
+
+        for task in failures:
+            self.bundle.error("Task {} failed after {} attempts:\n{}".format(task, task.attempts, task.error))
+
+        return failures
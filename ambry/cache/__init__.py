@@ -36,8 +36,13 @@ def new_cache(config):
             cc = config.to_dict()
 
             cc['options'] = [ i for i in config['options'] if i !=  'compress']
+
+            compress_args = { k.replace('compress_', ''): cc.pop(k) 
+                              for k in ('compress_codec', 'compress_level', 'compress_threads', 'compress_block_size')
+                              if k in cc }
+
             from filesystem import FsCompressionCache
-            return FsCompressionCache(upstream=cc)
+            return FsCompressionCache(upstream=cc, **compress_args)
         else:
             return  fsclass(**dict(config))
             
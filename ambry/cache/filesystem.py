@@ -310,30 +310,53 @@ class FsLimitedCache(FsCache):
     When files are written , they are written through to the upstream. If a file
     is requested that does not exist, it is fetched from the upstream. 
     
-    When a file is added that causes the disk usage to exceed `maxsize`, the oldest
-    files are deleted to free up space. 
+    When a file is added that causes the disk usage to exceed `maxsize`, files are deleted
+    until the usage is below the low water mark, a fraction of `maxsize`. With the 'lru'
+    policy, the least recently used files are deleted first, and with 'lfu', the least
+    frequently used. Gets update the access time and count of a file in memory, and they
+    are written to the database when a file is added or files are evicted.
     
      '''
 
-    def __init__(self, dir=dir, size=10000, upstream=None,**kwargs):
+    POLICIES = ('lru', 'lfu')
+
+    def __init__(self, dir=dir, size=10000, upstream=None, policy='lru', low_water=0.9,
+                 background=False, **kwargs):
         '''Init a new FileSystem Cache
         
         Args:
             cache_dir
-            maxsize. Maximum size of the cache, in GB
+            maxsize. Maximum size of the cache, in MB
+            policy. 'lru' or 'lfu'
+            low_water. Fraction of maxsize to free down to when the cache is full
+            background. If True, delete files in a background thread
         
         '''
-        
+        import threading
         from ambry.dbexceptions import ConfigurationError
 
         super(FsLimitedCache, self).__init__(dir, upstream=upstream,**kwargs)
         
         self.maxsize = int(size) * 1048578  # size in MB
 
+        if policy not in self.POLICIES:
+            raise ConfigurationError("Unknown cache policy '{}'; must be one of {}".format(policy, self.POLICIES))
+
+        self.policy = policy
+        self.low_water = float(low_water)
+        self.background = background
+
         self.readonly = False
         self.usreadonly = False
-        self._database = None
-        
+        self._local = threading.local() # The file database connection for each thread
+        self._db_updated = False
+        self._size = None
+        self._lock = threading.Lock()
+        self._evictor = None
+        self._accesses = {} # rel_path -> [time, hits] for gets not yet written to the database
+
+        self.stats = dict(hits=0, misses=0, evictions=0, evicted_bytes=0)
+
         self.use_db = True
    
         if not os.path.isdir(self.cache_dir):
@@ -348,78 +371,173 @@ class FsLimitedCache(FsCache):
         
     @property
     def database(self):
+        '''The connection to the file database for the current thread. A sqlite3 connection can
+        only be used in the thread that opened it, and the cache is used from download threads'''
         import sqlite3
         
         if not self.use_db:
             raise Exception("Shoundn't get here")
-        
-        if not self._database:
+
+        conn = getattr(self._local, 'database', None)
+
+        if conn is None:
             db_path = self.database_path
-            
-            if not os.path.exists(db_path):
-                create_sql = """
-                CREATE TABLE files(
-                path TEXT UNIQUE ON CONFLICT REPLACE, 
-                size INTEGER, 
-                time REAL)
-                """
-                conn = sqlite3.connect(db_path)
-                conn.execute(create_sql)
-                conn.close()
-                
-            # Long timeout to deal with contention during multiprocessing use
-            self._database = sqlite3.connect(db_path,60)
-            
-        return self._database
-            
+
+            with self._lock:
+                if not self._db_updated:
+                    if not os.path.exists(db_path):
+                        create_sql = """
+                        CREATE TABLE files(
+                        path TEXT UNIQUE ON CONFLICT REPLACE, 
+                        size INTEGER, 
+                        time REAL,
+                        hits INTEGER DEFAULT 0)
+                        """
+                        conn = sqlite3.connect(db_path)
+                        conn.execute(create_sql)
+                        conn.close()
+
+                    conn = sqlite3.connect(db_path, 60)
+
+                    # Update databases that were created before the access counts and indexes
+                    try:
+                        conn.execute("ALTER TABLE files ADD COLUMN hits INTEGER DEFAULT 0")
+                    except sqlite3.OperationalError:
+                        pass # Already exists
+
+                    conn.execute("CREATE INDEX IF NOT EXISTS files_time ON files(time)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS files_hits ON files(hits, time)")
+                    conn.commit()
+
+                    self._db_updated = True
+
+            if conn is None:
+                # Long timeout to deal with contention during multiprocessing use
+                conn = sqlite3.connect(db_path, 60)
+
+            self._local.database = conn
+
+        return conn
+
+    def _db_size(self, conn, exclude=None):
+        r = conn.execute("SELECT sum(size) FROM files WHERE path != ?", (exclude or '',)).fetchone()[0]
+
+        return int(r) if r else 0
+
     @property
     def size(self):
-        '''Return the size of all of the files referenced in the database'''
-        c = self.database.cursor()
-        r = c.execute("SELECT sum(size) FROM files")
-     
+        '''Return the size of all of the files referenced in the database. The total is
+        read from the database once, and then kept up to date as files are added and removed'''
+
+        if self._size is None:
+            size = self._db_size(self.database)
+
+            with self._lock:
+                if self._size is None:
+                    self._size = size
+
+        return self._size
+
+    def _evict(self, conn, target, this_rel_path=None, batch_size=100):
+        '''Delete files, in the order of the policy, until the size of the cache is below
+        target, reading the candidates in batches'''
+
+        # Other processes may be using the same cache, so start from the actual total. The
+        # current file is excluded, since it is accounted for in the target.
+        size = self._db_size(conn, exclude=this_rel_path)
+
+        self._flush_accesses(conn)
+        conn.commit()
+
+        if self.policy == 'lfu':
+            order = "hits ASC, time ASC"
+        else:
+            order = "time ASC"
+
+        while size > target:
+
+            removes = []
+
+            for path, file_size in conn.execute("SELECT path, size FROM files ORDER BY {} LIMIT ?"
+                                                        .format(order), (batch_size,)):
+                if size <= target:
+                    break
+
+                if path == this_rel_path:
+                    continue
+
+                removes.append((path, file_size))
+                size -= file_size or 0
+
+            if not removes:
+                break
+
+            conn.executemany("DELETE FROM files WHERE path = ?", [ (path,) for path, _ in removes ])
+            conn.commit()
+
+            for path, file_size in removes:
+                logger.debug("Deleting {}".format(path))
+
+                repo_path = os.path.join(self.cache_dir, path)
+
+                if os.path.exists(repo_path):
+                    os.remove(repo_path)
+
+            with self._lock:
+                if self._size is not None:
+                    self._size -= sum(file_size or 0 for _, file_size in removes)
+                self.stats['evictions'] += len(removes)
+                self.stats['evicted_bytes'] += sum(file_size or 0 for _, file_size in removes)
+
+    def _evict_background(self, target, this_rel_path):
+        import sqlite3
+
+        conn = sqlite3.connect(self.database_path, 60)
+
         try:
-            size = int(r.fetchone()[0])
-        except TypeError:
-            size = 0
-    
-        return size
+            self._evict(conn, target, this_rel_path)
+        except Exception as e:
+            logger.error("Failed to free space in cache {}: {}".format(self.cache_dir, e))
+        finally:
+            conn.close()
 
     def _free_up_space(self, size, this_rel_path=None):
         '''If there are not size bytes of space left, delete files
-        until there is 
+        until the cache is below the low water mark
         
         Args:
             size: size of the current file
             this_rel_path: rel_pat to the current file, so we don't delete it. 
         
         ''' 
-        
-        space = self.size + size - self.maxsize # Amount of space we are over ( bytes ) for next put
-        
-        if space <= 0:
+        import threading
+
+        if self.size + size <= self.maxsize:
             return
 
-        removes = []
+        target = self.maxsize * self.low_water - size
 
-        for row in self.database.execute("SELECT path, size, time FROM files ORDER BY time ASC"):
+        if not self.background:
+            self._evict(self.database, target, this_rel_path)
+            return
+
+        if self._evictor and self._evictor.is_alive():
+            return
+
+        self._evictor = threading.Thread(target=self._evict_background, args=(target, this_rel_path))
+        self._evictor.daemon = True
+        self._evictor.start()
 
-            if space > 0:
-                removes.append(row[0])
-                space -= row[1]
-            else:
-                break
-  
-        for rel_path in removes:
-            if rel_path != this_rel_path:
-                logger.debug("Deleting {}".format(rel_path)) 
-                self.remove(rel_path)
-            
     def add_record(self, rel_path, size):
         import time
         c = self.database.cursor()
+
+        self.size # Make sure the running total is loaded
+
         try:
-            c.execute("insert into files(path, size, time) values (?, ?, ?)", 
+            self._flush_accesses(c)
+            r = c.execute("SELECT size FROM files WHERE path = ?", (rel_path,)).fetchone()
+            c.execute("insert into files(path, size, time, hits) values (?, ?, ?, 0)", 
                         (rel_path, size, time.time()))
             self.database.commit()
         except Exception as e:
@@ -428,6 +546,35 @@ class FsLimitedCache(FsCache):
             raise FilesystemError("Failed to write to cache database '{}': {}"
                                                .format(self.database_path, e.message))
 
+        with self._lock:
+            self._size += size - ((r[0] or 0) if r else 0)
+
+    def _touch(self, rel_path):
+        '''Record an access to a file, for the eviction policy. Accesses are kept in memory
+        and written by _flush_accesses(), so cache hits don't write to the database'''
+        import time
+
+        now = time.time()
+
+        with self._lock:
+            access = self._accesses.get(rel_path)
+
+            if access:
+                access[0] = now
+                access[1] += 1
+            else:
+                self._accesses[rel_path] = [now, 1]
+
+    def _flush_accesses(self, conn):
+        '''Write the accesses recorded by _touch() to the database. The caller commits'''
+
+        with self._lock:
+            accesses, self._accesses = self._accesses, {}
+
+        if accesses:
+            conn.executemany("UPDATE files SET time = ?, hits = hits + ? WHERE path = ?",
+                             [ (t, hits, path) for path, (t, hits) in accesses.items() ])
+
     def verify(self):
         '''Check that the database accurately describes the state of the repository'''
         
@@ -500,8 +647,12 @@ class FsLimitedCache(FsCache):
                 raise ValueError("Path does not point to a file")
             
             logger.debug("LC {} get {} found ".format(self.repo_id, path))
+            self.stats['hits'] += 1
+            self._touch(rel_path)
             return path
-            
+
+        self.stats['misses'] += 1
+
         if not self.upstream:
             # If we don't have an upstream, then we are done. 
             return None
@@ -565,7 +716,7 @@ class FsLimitedCache(FsCache):
         if self.upstream:
             self.upstream.put(source, rel_path, metadata=metadata)
 
-        return self.get(rel_path)
+        return self.path(rel_path, propagate=False)
 
     def put_stream(self,rel_path, metadata=None):
         """return a file object to write into the cache. The caller
@@ -598,8 +749,8 @@ class FsLimitedCache(FsCache):
                 
                 size = os.path.getsize(self.repo_path)
                 
-                self.this.add_record(rel_path, size)
                 self.this._free_up_space(size, this_rel_path=rel_path)
+                self.this.add_record(rel_path, size)
                 
                 if self.upstream:
                     self.upstream.close()
@@ -631,13 +782,20 @@ class FsLimitedCache(FsCache):
         '''Delete the file from the cache, and from the upstream'''
         repo_path = os.path.join(self.cache_dir, rel_path)
         
+        self.size # Make sure the running total is loaded
+
         c = self.database.cursor()
+        r = c.execute("SELECT size FROM files WHERE path = ?", (rel_path,)).fetchone()
         c.execute("DELETE FROM  files WHERE path = ?", (rel_path,) )
         
         if os.path.exists(repo_path):
             os.remove(repo_path)
 
         self.database.commit()
+
+        if r:
+            with self._lock:
+                self._size -= r[0] or 0
             
         if self.upstream and propagate :
             self.upstream.remove(rel_path, propagate)    
@@ -656,19 +814,63 @@ class FsLimitedCache(FsCache):
 
 
     def __repr__(self):
-        return "FsLimitedCache: dir={} size={} upstream=({})".format(self.cache_dir, self.maxsize, self.upstream)
+        return "FsLimitedCache: dir={} size={} policy={} upstream=({})".format(self.cache_dir, self.maxsize,
+                                                                              self.policy, self.upstream)
     
 
 class FsCompressionCache(Cache):
     
     '''A Cache Adapter that compresses files before sending  them to
     another cache.
+
+    The codec, level and threads are set with the compress_codec, compress_level and
+    compress_threads keys of the filesystem config. With more than one thread, gzip files are
+    compressed in independent blocks on a pool of threads, and zstd files with the
+    compressor's own threads.
+
+    If compress_block_size is set, gzip files are written in blocks of that size, with a
+    sidecar block index, so get_seekable() can read ranges of the file without decompressing
+    it from the start.
      '''
 
-    def __init__(self, upstream=None,**kwargs):
-        
+    def __init__(self, upstream=None, codec='gzip', level=9, threads=1, block_size=None, **kwargs):
+        from ..util.compression import compressor
+
         super(FsCompressionCache, self).__init__(upstream)
 
+        self.codec = codec
+        self.level = int(level) if level is not None else None
+        self.threads = int(threads) if threads else 1
+        self.block_size = int(block_size) if block_size else None
+
+        compressor(self.codec, self.level) # Check that the codec is valid and installed
+
+    def _compressing_writer(self, sink, rel_path):
+        from ..util.compression import compressing_writer
+
+        writer = compressing_writer(sink, self.codec, self.level, self.threads, block_size=self.block_size)
+
+        if self.block_size and hasattr(writer, 'index'):
+            writer.close_cb = lambda w: self._put_index(rel_path, w.index)
+
+        return writer
+
+    def _put_index(self, rel_path, index):
+        sink = self.upstream.put_stream(self._index_path(rel_path))
+        index.dump(sink)
+        sink.close()
+
+    def _set_encoding(self, metadata, codec):
+        '''Record the codec in the metadata. Only codecs that are HTTP content codings go in the
+        Content-Encoding, since S3 serves it as a header; readers detect the others'''
+        from ..util.compression import HTTP_CODINGS
+
+        metadata['compression'] = codec
+
+        if codec in HTTP_CODINGS:
+            metadata['Content-Encoding'] = codec
+        else:
+            metadata.pop('Content-Encoding', None)
 
     ##
     ## Put
@@ -676,46 +878,49 @@ class FsCompressionCache(Cache):
 
 
     def put(self, source, rel_path, metadata=None):
-        from ambry.util import bundle_file_type
-        import gzip
-
-        # Pass through if the file is already compressed
-
+        from ..util.compression import detect_codec
 
         if not metadata:
             metadata = {}
 
-        metadata['Content-Encoding'] = 'gzip'
+        # Pass through if the file is already compressed
+        try:
+            codec = detect_codec(source)
+        except (AttributeError, IOError):
+            codec = None # Can't seek in the stream, so compress it
 
-        bft = bundle_file_type(source)
+        self._set_encoding(metadata, codec or self.codec)
 
         sink = self.upstream.put_stream(self._rename(rel_path), metadata = metadata)
 
-        if bft == 'gzip':
+        if codec:
             copy_file_or_flo(source,  sink)
+            sink.close()
         else:
-            copy_file_or_flo(source,  gzip.GzipFile(fileobj=sink,  mode='wb'))
-
-        sink.close()
+            # Closing the writer closes the sink
+            writer = self._compressing_writer(sink, rel_path)
+            try:
+                copy_file_or_flo(source,  writer)
+            finally:
+                writer.close()
 
         #self.put_metadata(rel_path, metadata)
 
         return self.path(self._rename(rel_path))
 
     def put_stream(self, rel_path,  metadata=None):
-        import gzip
 
         if not metadata:
             metadata = {}
 
-        metadata['Content-Encoding'] = 'gzip'
+        self._set_encoding(metadata, self.codec)
 
         sink = self.upstream.put_stream(self._rename(rel_path),  metadata=metadata)
 
 
         self.put_metadata(rel_path, metadata)
 
-        return gzip.GzipFile(fileobj=sink,  mode='wb')
+        return self._compressing_writer(sink, rel_path)
 
     ##
     ## Get
@@ -724,6 +929,7 @@ class FsCompressionCache(Cache):
     def get_stream(self, rel_path, cb=None):
         from ..util import bundle_file_type
         from ..util.flo import MetadataFlo
+        from ..util.compression import detect_codec, decompressing_reader
         import gzip
 
         source = self.upstream.get_stream(self._rename(rel_path))
@@ -732,12 +938,46 @@ class FsCompressionCache(Cache):
             return None
 
         if bundle_file_type(source) == 'gzip':
+            codec = 'gzip'
+        else:
+            try:
+                codec = detect_codec(source)
+            except (AttributeError, IOError):
+                codec = None # Can't seek in the stream
+
+        if codec == 'gzip':
             logger.debug("CC returning {} with decompression".format(rel_path))
             return MetadataFlo(gzip.GzipFile(fileobj=source), source.meta)
+        elif codec:
+            logger.debug("CC returning {} with {} decompression".format(rel_path, codec))
+            return MetadataFlo(decompressing_reader(source, codec), source.meta)
         else:
             logger.debug("CC returning {} with passthrough".format(rel_path))
             return source
 
+    def get_seekable(self, rel_path):
+        '''Return a seekable BlockGzipReader for a file that was written with a block index,
+        or None if there is no index. Remote files are read with HTTP range requests, for only
+        the blocks that are read. '''
+        from ..util.compression import BlockIndex, BlockGzipReader, http_fetcher
+
+        index_stream = self.upstream.get_stream(self._index_path(rel_path))
+
+        if not index_stream:
+            return None
+
+        try:
+            index = BlockIndex.load(index_stream)
+        finally:
+            index_stream.close()
+
+        path = self.upstream.path(self._rename(rel_path))
+
+        if path.startswith('http'):
+            return BlockGzipReader(http_fetcher(path), index)
+        else:
+            return BlockGzipReader(open(path, 'rb'), index)
+
     def get(self, rel_path, cb=None):
 
         source = self.get_stream(rel_path)
@@ -786,6 +1026,9 @@ class FsCompressionCache(Cache):
 
         self.upstream.remove(uc_rel_path)
 
+        if self.upstream.has(self._index_path(rel_path)):
+            self.upstream.remove(self._index_path(rel_path), propagate)
+
 
     ##
     ## Information
@@ -833,6 +1076,10 @@ class FsCompressionCache(Cache):
     def _rename( rel_path):
         return rel_path+".gz" if not rel_path.endswith('.gz') else rel_path
 
+    @classmethod
+    def _index_path(cls, rel_path):
+        return cls._rename(rel_path)+'.idx'
+
 
     @property
     def repo_id(self):
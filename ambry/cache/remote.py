@@ -35,6 +35,33 @@ class RestReadCache(RemoteInterface):
 
         return self.rl.get_stream(rel_path)
 
+    def get_seekable(self, rel_path):
+        '''Return a seekable BlockGzipReader that fetches blocks of the remote file with HTTP range
+        requests, or None if the file has no block index next to it.'''
+        from ..util.compression import BlockIndex, BlockGzipReader, http_fetcher
+        import requests
+        import urlparse
+
+        url = self.path(rel_path)
+
+        if not url:
+            return None
+
+        parts = urlparse.urlparse(url)
+        index_url = urlparse.urlunparse(parts._replace(path=parts.path+'.idx'))
+
+        r = requests.get(index_url, verify=False)
+
+        if r.status_code != 200:
+            return None
+
+        try:
+            index = BlockIndex(**r.json())
+        except ValueError:
+            return None
+
+        return BlockGzipReader(http_fetcher(url), index)
+
     def has(self, rel_path, md5=None, use_upstream=True):
         return bool(self.path(rel_path))
 
@@ -214,7 +214,18 @@ def bundle_parser(cmd):
     command_p.add_argument('-f', '--force', default=False, action="store_true", help='Force build. ( --clean is usually preferred ) ')
     
     command_p.add_argument('-o','--opt', action='append', help='Set options for the build phase')
+    command_p.add_argument('-m','--multi',  type = int,  nargs = '?',
+                        default = argparse.SUPPRESS,
+                        const = multiprocessing.cpu_count(),
+                        help='Build partitions on multiple processes, if the  bundle supports it')
     
+    #
+    # Prefetch Command
+    #
+    command_p = sub_cmd.add_parser('prefetch', help='Download the source files into the download cache')
+    command_p.set_defaults(subcommand='prefetch')
+    command_p.add_argument('-n','--threads', type = int, default = 4, help='Number of concurrent downloads')
+
     #
     # Update Command
     #
@@ -378,6 +389,10 @@ def bundle_build(args, b, st, rc):
     return b.do_build()
 
 
+def bundle_prefetch(args, b, st, rc):
+    return b.prefetch(n=args.threads) == 0
+
+
 def bundle_install(args, b, st, rc):
 
     force = args.force
@@ -81,6 +81,8 @@ def warehouse_parser(cmd):
     whsp = whp.add_parser('install', help='Install a bundle or partition to a warehouse')
     whsp.set_defaults(subcommand='install')
     whsp.add_argument('term', type=str,help='Name of bundle or partition')
+    whsp.add_argument('-j', '--jobs', type=int, default=4, help='Number of threads for downloading partitions')
+    whsp.add_argument('-l', '--loaders', type=int, help='Number of tables to load at once. Defaults to the warehouse setting')
 
     whsp = whp.add_parser('remove', help='Remove a bundle or partition from a warehouse')
     whsp.set_defaults(subcommand='remove')
@@ -89,6 +91,8 @@ def warehouse_parser(cmd):
     whsp = whp.add_parser('sync', help='Syncronize database to a list of names')
     whsp.set_defaults(subcommand='sync')
     whsp.add_argument('file', type=str,help='Name of file containing a list of names')
+    whsp.add_argument('-j', '--jobs', type=int, default=4, help='Number of threads for downloading partitions')
+    whsp.add_argument('-l', '--loaders', type=int, help='Number of tables to load at once. Defaults to the warehouse setting')
     
     whsp = whp.add_parser('connect', help='Test connection to a warehouse')
     whsp.set_defaults(subcommand='connect')
@@ -127,7 +131,6 @@ def warehouse_install(args, w,config):
     from ..library import new_library
     import os.path
     from ambry.util import init_log_rate
-    from ..dbexceptions import NotFoundError
     
     if not w.exists():
         w.create()
@@ -140,23 +143,44 @@ def warehouse_install(args, w,config):
         from ..warehouse.manifest import Manifest
         m  = Manifest(args.term)
 
-        partitions = m.partitions
+        partitions = list(m.partitions)
         views = m.views
+        sql = m.sql
     else:
         partitions = [args.term]
         views = []
-    for p in partitions:
-        try:
-            w.install(p)
-        except NotFoundError:
-            err("Partition {} not found in external library".format(p))
+        sql = {}
 
-    if m.sql:
-        w.run_sql(m.sql[w.database.driver])
+    for p in w.install_many(partitions, n=args.jobs, loaders=args.loaders):
+        err("Failed to install partition {}".format(p))
+
+    if w.database.driver in sql:
+        w.run_sql(sql[w.database.driver])
 
     for view in views:
         w.install_view(view)
 
+def warehouse_sync(args, w, config):
+    '''Install the partitions named in a file, one per line, and replace installed partitions
+    from other revisions, but only the ones whose content changed'''
+    from ambry.util import init_log_rate
+
+    if not w.exists():
+        w.create()
+
+    w.logger = Logger('Warehouse Sync',init_log_rate(prt,N=2000))
+
+    with open(args.file) as f:
+        names = [ line.split('#')[0].strip() for line in f ]
+
+    installed, replaced, unchanged, failed = w.sync([ n for n in names if n ], n=args.jobs, loaders=args.loaders)
+
+    prt("Installed {}, replaced {}, unchanged {}, failed {}",
+        len(installed), len(replaced), len(unchanged), len(failed))
+
+    for p in failed:
+        err("Failed to sync partition {}".format(p))
+
 def warehouse_remove(args, w,config):
     from functools import partial
     from ambry.util import init_log_rate
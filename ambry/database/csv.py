@@ -18,7 +18,8 @@ class ValueInserter(InserterInterface):
     '''Inserts arrays of values into  database table'''
     def __init__(self, path, bundle,  partition, table=None, header=None, delimiter = '|',
                  escapechar='\\', encoding='utf-8', 
-                 write_header = False,  buffer_size=2*1024*1024): 
+                 write_header = False,  buffer_size=2*1024*1024, compression=None,
+                 compression_level=None): 
      
         self.table = table
         self.header = header
@@ -30,6 +31,8 @@ class ValueInserter(InserterInterface):
         self.write_header = write_header
         self.bundle = bundle
         self.partition = partition
+        self.compression = compression
+        self.compression_level = compression_level
 
         if self.header:
             pass
@@ -81,6 +84,11 @@ class ValueInserter(InserterInterface):
                 os.makedirs(os.path.dirname(self.path))
 
         f = open(self.path, 'wb', buffering=self.buffer_size)
+
+        if self.compression:
+            # Compress on a background thread as the rows are written
+            from ..util.compression import CompressingWriter
+            f = CompressingWriter(f, self.compression, self.compression_level)
         
         self._f = f
 
@@ -180,7 +188,23 @@ class CsvDb(DatabaseInterface):
 
       
         self.delimiter = '|'
-    
+
+    @property
+    def _build_config(self):
+        try:
+            return self.bundle.config.group('build') or {}
+        except AttributeError:
+            return {}
+
+    @property
+    def compression(self):
+        '''The codec for writing the CSV file, from the build.csv_compression config, or None
+        to write plain text. Readers detect the codec, so the path is the same either way'''
+        return self._build_config.get('csv_compression')
+
+    @property
+    def compression_level(self):
+        return self._build_config.get('csv_compression_level')
       
     @property 
     def path(self):
@@ -221,17 +245,26 @@ class CsvDb(DatabaseInterface):
         if not skip_header and header is None and self.partition.table is not None:
             header = [c.name for c in self.partition.table.columns]
 
+        kwargs.setdefault('compression', self.compression)
+        kwargs.setdefault('compression_level', self.compression_level)
+
         return ValueInserter(self.path,  self.bundle, self.partition,  header=header, **kwargs)
+
+    def open(self):
+        '''Open the file for reading, decompressing it if it was written compressed'''
+        from ..util.compression import open_compressed
+
+        return open_compressed(self.path)
         
     def reader(self,  encoding='utf-8', *args, **kwargs):
 
-        f = open(self.path,'rb')
+        f = self.open()
 
         return unicodecsv.reader(f, *args, delimiter=self.delimiter, encoding='utf-8', **kwargs)
         
     def dict_reader(self, encoding='utf-8', *args, **kwargs):
 
-        f = open(self.path,'rb')
+        f = self.open()
 
         return unicodecsv.DictReader(f,*args, delimiter=self.delimiter, encoding='utf-8', **kwargs)
         
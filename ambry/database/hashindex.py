@@ -0,0 +1,156 @@
+"""
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+from . import DatabaseInterface
+import numpy as np
+import os
+
+
+class HashIndex(DatabaseInterface):
+    '''Translation of row hashes to primary keys, stored as a sorted array of uint64 hashes
+    and a parallel array of int32 keys in two .npy files. The reader memory-maps the
+    arrays, and lookup() translates a whole array of hashes with one searchsorted() '''
+
+    HASH_DTYPE = np.uint64
+    PK_DTYPE = np.int32
+
+    # Number of buffered pairs the writer collects before converting them to arrays
+    CHUNK_SIZE = 1000000
+
+    def __init__(self, bundle, base_path, suffix=None):
+
+        self.bundle = bundle
+
+        self.suffix = suffix
+
+        self._path = base_path
+
+        if suffix:
+            self._path += '-'+suffix
+
+        self._hashes = None
+        self._pks = None
+
+        self._buffer = None
+        self._chunks = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def hashes_path(self):
+        return self._path+'.hashes.npy'
+
+    @property
+    def pks_path(self):
+        return self._path+'.pks.npy'
+
+    @property
+    def exists(self):
+        return os.path.exists(self.hashes_path) and os.path.exists(self.pks_path)
+
+    @property
+    def reader(self):
+        self.close()
+        self._hashes = np.load(self.hashes_path, mmap_mode='r')
+        self._pks = np.load(self.pks_path, mmap_mode='r')
+        return self
+
+    @property
+    def writer(self):
+        """Return a new writer. The index is written when the writer is closed"""
+        self.close()
+        self._buffer = []
+        self._chunks = []
+        return self
+
+    def delete(self):
+
+        self.close()
+
+        for path in (self.hashes_path, self.pks_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _flush(self):
+
+        if self._buffer:
+            a = np.array(self._buffer, dtype=object)
+            self._chunks.append((a[:, 0].astype(self.HASH_DTYPE), a[:, 1].astype(self.PK_DTYPE)))
+            self._buffer = []
+
+    def write(self, hashes, pks):
+        '''Add arrays of hashes and keys to the writer'''
+        self._flush()
+        self._chunks.append((np.asarray(hashes, dtype=object).astype(self.HASH_DTYPE),
+                             np.asarray(pks, dtype=self.PK_DTYPE)))
+
+    def _save(self):
+        self._flush()
+
+        if self._chunks:
+            hashes = np.concatenate([c[0] for c in self._chunks])
+            pks = np.concatenate([c[1] for c in self._chunks])
+        else:
+            hashes = np.zeros(0, dtype=self.HASH_DTYPE)
+            pks = np.zeros(0, dtype=self.PK_DTYPE)
+
+        self._chunks = self._buffer = None
+
+        # Stable sort, then keep the last key set for each hash, the way a later
+        # assignment replaces an earlier one.
+        order = np.argsort(hashes, kind='mergesort')
+        hashes = hashes[order]
+        pks = pks[order]
+
+        last = np.append(hashes[1:] != hashes[:-1], True)
+
+        np.save(self.hashes_path, hashes[last])
+        np.save(self.pks_path, pks[last])
+
+    def close(self):
+        if self._chunks is not None:
+            self._save()
+
+        self._hashes = None
+        self._pks = None
+
+    def lookup(self, hashes):
+        '''Return an array of the primary keys for an array or list of hashes. Raises
+        KeyError if any of the hashes is not in the index'''
+
+        hashes = np.asarray(hashes, dtype=object).astype(self.HASH_DTYPE)
+
+        if len(self._hashes) == 0:
+            if len(hashes):
+                raise KeyError(hashes[0])
+            return np.zeros(0, dtype=self.PK_DTYPE)
+
+        idx = np.searchsorted(self._hashes, hashes)
+        idx[idx == len(self._hashes)] = 0
+
+        missing = self._hashes[idx] != hashes
+
+        if missing.any():
+            raise KeyError(hashes[missing][0])
+
+        return self._pks[idx]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __getitem__(self, key):
+        return int(self.lookup([key])[0])
+
+    def __setitem__(self, key, val):
+
+        self._buffer.append((int(key), int(val)))
+
+        if len(self._buffer) >= self.CHUNK_SIZE:
+            self._flush()
+
+    def keys(self):
+        return self._hashes
@@ -124,11 +124,15 @@ class ValueWriter(InserterInterface):
         self.session.commit()
         self.db.partition.set_state(Partitions.STATE.BUILDING)
  
+    def _write_cache(self):
+        '''Write the cached rows to the database'''
+        self.session.execute(self.statement, self.cache)
+
     def close(self):
 
         if len(self.cache) > 0 :       
             try:
-                self.session.execute(self.statement, self.cache)
+                self._write_cache()
                 self.commit_end()
                 self.cache = []
             except (KeyboardInterrupt, SystemExit):
@@ -188,12 +192,19 @@ class CodeCastErrorHandler(object):
 
 
 class ValueInserter(ValueWriter):
-    '''Inserts arrays of values into  database table'''
+    '''Inserts arrays of values into  database table. Rows are cached, then cast as a
+    batch when the cache is written, so cast errors are reported to the cast_error_handler
+    at that point, with the rows as they were passed to insert(), and insert() does not
+    return them; no caller in ambry or the bundles uses its return value.
+
+    With dbapi=True, for Sqlite databases, the cache is written with executemany() on the
+    DB-API connection, bypassing the compilation and bind processing of Sqlalchemy Core. '''
     def __init__(self, db,  bundle, table, 
                  orm_table = None,
+                 caster = None,
                  cast_error_handler = None,
                  cache_size=50000, text_factory = None, 
-                 replace=False,  skip_none=True, update_size = True):
+                 replace=False,  skip_none=True, update_size = True, dbapi = False):
 
         super(ValueInserter, self).__init__(db, bundle,  cache_size=cache_size, text_factory = text_factory)  
    
@@ -211,17 +222,26 @@ class ValueInserter(ValueWriter):
             self.orm_table = self.bundle.schema.table(table.name)
             self.caster = self.bundle.schema.caster(table.name)
 
+        if caster:
+            self.caster = caster
 
         self.null_row = self.orm_table.null_dict
 
         self.cast_error_handler = cast_error_handler(self) if cast_error_handler else None
 
+        # The rows as they were passed to insert(), for the cast_error_handler
+        self._original_rows = []
+
         self.header = [c.name for c in self.orm_table.columns]
 
+        # Null row values in header order, for filling in sequence rows by position
+        self.null_values = [self.null_row[c] for c in self.header]
+
         # Int is included b/c long integer values get a type of integer64
         self.sizable_fields = [c.name for c in self.orm_table.columns if c.type_is_text() or c.datatype == c.DATATYPE_INTEGER ]
 
         self._max_lengths = [ 0 for x in self.sizable_fields ]
+        self._sizable_indexes = [ self.header.index(c) for c in self.sizable_fields ]
    
         self.statement = self.table.insert()
  
@@ -233,62 +253,59 @@ class ValueInserter(ValueWriter):
         if replace:
             self.statement = self.statement.prefix_with('OR REPLACE')
 
+        self.dbapi = dbapi
+        self._dbapi_connection = None
+
+        if self.dbapi:
+            from ..dbexceptions import ConfigurationError
+
+            if not hasattr(self.db, 'dbapi_connection'):
+                raise ConfigurationError("DB-API inserts require a Sqlite database, got {}".format(type(self.db)))
+
+            self.dbapi_statement = 'INSERT {}INTO "{}" ({}) VALUES ({})'.format(
+                'OR REPLACE ' if replace else '', self.table.name,
+                ','.join('"{}"'.format(c) for c in self.header), ','.join('?' * len(self.header)))
+
+            # Only the types that sqlite3 can't store directly, like times, need to be converted,
+            # and they are converted to the same strings that Sqlalchemy would store.
+            dialect = self.db.engine.dialect
+            self._bind_processors = [ (i, self.table.c[c].type.dialect_impl(dialect).bind_processor(dialect))
+                                      for i, c in enumerate(self.header) ]
+            self._bind_processors = [ (i, p) for i, p in self._bind_processors if p ]
+
     def insert(self, values):
+        '''Cache a row, a dict or a sequence in header order. The cache is cast and written
+        when it holds cache_size rows, and cast errors go to the cast_error_handler then.
+        Returns None, since the row's cast errors aren't known yet. '''
         from sqlalchemy.engine.result import RowProxy
         
         if isinstance(values, RowProxy):
             values = dict(values)
 
-        code_dict = None
-
         try:
-            cast_errors =  None
 
-            if isinstance(values, dict):
+            # Rows aren't cast until the cache is written, so copy them; callers often reuse one row object
+            if not isinstance(values, dict):
+                values = list(values)
 
-                if self.caster:
-                    d, cast_errors = self.caster(values)
+            if self.cast_error_handler:
+                self._original_rows.append(dict(values) if isinstance(values, dict) else values)
 
-                else:
+            if isinstance(values, dict):
+                # Project dicts onto the header, so the cache can be cast by position
+                try:
+                    values = [ values[k] for k in self.header ]
+                except KeyError:
                     d = dict((k.lower(), v) for k,v in values.items())
+                    values = [ d.get(k) for k in self.header ]
 
-                if self.skip_none:
-
-                    d = { k: d[k] if k in d and d[k] is not None else v for k,v in self.null_row.items() }
-
-            else:
-                
-                if self.caster:
-                    d, cast_errors = self.caster(values)
-                else:
-                    d = values
-
-                d  = dict(zip(self.header, d))
-                
-                if self.skip_none:
-                    d = { k: d[k] if k in d and d[k] is not None else v for k,v in self.null_row.items() }
-                
-            if self.update_size:
-                for i,col_name in enumerate(self.sizable_fields):
-                    try:
-                        self._max_lengths[i] = max(len(str(d[col_name])) if d[col_name] else 0, self._max_lengths[i])
-                    except UnicodeEncodeError:
-                        # Unicode is a PITA
-                        pass
-
-            self.cache.append(d)
+            self.cache.append(values)
          
             if len(self.cache) >= self.cache_size: 
-                self.session.execute(self.statement, self.cache)
+                self._write_cache()
                 self.cache = []
                 self.commit_continue()
 
-
-            if cast_errors and self.cast_error_handler:
-                self.cast_error_handler.cast_error(values,cast_errors )
-
-            return cast_errors
-
         except (KeyboardInterrupt, SystemExit):
             if self.bundle:
                 self.bundle.log("Processing keyboard interrupt or system exist")
@@ -296,6 +313,7 @@ class ValueInserter(ValueWriter):
                 print "Processing keyboard interrupt or system exist" 
             self.rollback()
             self.cache = []
+            self._original_rows = []
             raise
         except Exception as e:
             if self.bundle:
@@ -305,10 +323,94 @@ class ValueInserter(ValueWriter):
                 print "ERROR: Exception during ValueInserter.insert: {}".format(e)
             self.rollback()
             self.cache = []
+            self._original_rows = []
             raise
 
-        return True
-   
+        return None
+
+    def _cast_cache(self):
+        '''Cast the cached rows as a batch, fill in defaults, track the column sizes
+        and return the rows as lists, in header order'''
+        from itertools import izip_longest
+
+        if self.caster:
+            rows, cast_errors = self.caster.cast_batch(self.cache)
+        else:
+            rows, cast_errors = self.cache, {}
+
+        if self.skip_none:
+            null_values = self.null_values
+            rows = [ [ n if v is None else v for v, n in izip_longest(row, null_values) ] for row in rows ]
+
+        if self.update_size:
+            self._update_max_lengths(rows)
+
+        if cast_errors and self.cast_error_handler:
+            for r, errors in cast_errors.items():
+                self.cast_error_handler.cast_error(self._original_rows[r], errors)
+
+        self._original_rows = []
+
+        return rows
+
+    def _update_max_lengths(self, rows):
+        '''Update the maximum lengths of the sizable fields from a batch of rows. Each column is
+        measured in a single pass of iterators, which keeps the loop out of Python code. '''
+        from itertools import imap, ifilter, chain
+        from operator import itemgetter
+
+        for i, index in enumerate(self._sizable_indexes):
+
+            try:
+                length = max(chain((0,), imap(len, imap(str, ifilter(None, imap(itemgetter(index), rows))))))
+            except UnicodeEncodeError:
+                # Non-ASCII unicode values can't go through str(), and the column may also hold
+                # UTF-8 str values, which unicode() can't decode, so measure strings as they are.
+                length = max(chain((0,), ( len(v) if isinstance(v, basestring) else len(str(v))
+                                           for v in ifilter(None, imap(itemgetter(index), rows)) )))
+
+            if length > self._max_lengths[i]:
+                self._max_lengths[i] = length
+
+    def _write_cache(self):
+
+        rows = self._cast_cache()
+
+        if self.dbapi:
+            if self._bind_processors:
+                # Without a caster, these are the caller's rows, so convert copies of them
+                rows = [ list(row) for row in rows ]
+
+            for i, p in self._bind_processors:
+                for row in rows:
+                    row[i] = p(row[i])
+
+            if not self._dbapi_connection:
+                self._dbapi_connection = self.db.dbapi_connection
+
+            self._dbapi_connection.cursor().executemany(self.dbapi_statement, rows)
+            self._dbapi_connection.commit()
+
+        else:
+            header = self.header
+            self.session.execute(self.statement, [ dict(zip(header, row)) for row in rows ])
+
+    def rollback(self):
+
+        if self._dbapi_connection:
+            self._dbapi_connection.rollback()
+
+        super(ValueInserter, self).rollback()
+
+    def close(self):
+
+        try:
+            super(ValueInserter, self).close()
+        finally:
+            if self._dbapi_connection:
+                self._dbapi_connection.close()
+                self._dbapi_connection = None
+
     @property
     def max_lengths(self):
         return dict(zip(self.sizable_fields, self._max_lengths))
@@ -25,40 +25,127 @@ class RowSelector(object):
 
 
 
+    def _dtypes(self, names):
+        '''Return the numpy dtype names for the selected columns, from the datatypes of the
+        partition's table. Columns that aren't in the table are 'object' '''
+
+        table = self.partition.get_table()
+
+        types = { c.name: c.numpy_dtype for c in table.columns } if table else {}
+
+        return [ types.get(name, 'object') for name in names ]
+
+    @staticmethod
+    def _promote(dtype):
+        '''Return the dtype to use when values don't fit in a column. Integers with nulls
+        become floats, and anything else becomes object'''
+        import numpy as np
+
+        return np.dtype('float64') if np.dtype(dtype).kind == 'i' else np.dtype('object')
+
+    def _fill(self, a, name, start, values):
+        '''Copy a column of values into field name of the structured array a, starting at
+        row start. Returns the array, which is copied with a wider dtype for the field if
+        the values don't fit. '''
+
+        while True:
+            try:
+                a[name][start:start+len(values)] = values
+                return a
+            except (TypeError, ValueError):
+                if a.dtype[name].kind == 'O':
+                    raise
+
+                a = a.astype([ (n, self._promote(a.dtype[n]) if n == name else a.dtype[n])
+                               for n in a.dtype.names ])
+
+    def _result(self):
+        '''Run the query, and return the result and the column names. Repeated names, as
+        from a join, get a numeric suffix, since the fields of an array must be unique '''
+
+        r = self.partition.query(self.sql, *self.args, **self.kwargs)
+
+        names = []
+        for k in r.keys():
+            name, i = str(k), 1
+            while name in names:
+                name, i = "{}_{}".format(k, i), i + 1
+            names.append(name)
+
+        return r, names
+
+    def iter_numpy(self, chunksize=50000):
+        '''Yield the selected rows as numpy structured arrays of up to chunksize rows. The
+        rows are fetched with fetchmany(), so only one chunk is held in memory. Integer
+        columns are float64 in chunks that have nulls. '''
+        import numpy as np
+
+        r, names = self._result()
+        dtype = zip(names, self._dtypes(names))
+
+        while True:
+            rows = r.fetchmany(chunksize)
+
+            if not rows:
+                break
+
+            a = np.empty(len(rows), dtype=dtype)
+
+            for name, values in zip(names, zip(*rows)):
+                a = self._fill(a, name, 0, values)
+
+            yield a
+
     @property
     def numpy(self):
-        pass
+        '''Return the selected rows as a numpy structured array, with field types from the
+        datatypes of the partition's table. The array is allocated for the row count of the
+        query, and filled in chunks. '''
+        import numpy as np
 
-    @property
-    def pandas(self):
-        import pandas as pd
+        count = self.partition.query("SELECT count(*) FROM ({})".format(self.sql),
+                                     *self.args, **self.kwargs).scalar()
 
-        if self.index_col:
-            def gen():
-                header = None
-                for i, row in enumerate(self.partition.query(self.sql, *self.args, **self.kwargs)):
-                    if i == 0:
-                        yield [ k for k,v in row.items() ]
+        r, names = self._result()
 
-                    yield (row[self.index_col], list(row))
-        else:
-            def gen():
-                for i, row in enumerate(self.partition.query(self.sql, *self.args, **self.kwargs)):
-                    if i == 0:
-                        yield [k for k, v in row.items()]
-                    yield (i, list(row))
+        a = np.empty(count, dtype=zip(names, self._dtypes(names)))
 
+        start = 0
+        while True:
+            rows = r.fetchmany(50000)
 
-        g = gen()
-        header = g.next()
+            if not rows:
+                break
 
-        df =  pd.DataFrame.from_items(g,orient = 'index',columns = header)
+            for name, values in zip(names, zip(*rows)):
+                a = self._fill(a, name, start, values)
 
+            start += len(rows)
 
-        df.convert_objects(convert_dates=True, convert_numeric=True, convert_timedeltas=True, copy=False)
+        return a[:start]
+
+    def _dataframe(self, a):
+        import pandas as pd
+
+        df = pd.DataFrame.from_records(a)
+
+        if self.index_col:
+            df.index = df[self.index_col].values
 
         return df
 
+    def iter_pandas(self, chunksize=50000):
+        '''Yield the selected rows as pandas DataFrames of up to chunksize rows'''
+
+        for a in self.iter_numpy(chunksize):
+            yield self._dataframe(a)
+
+    @property
+    def pandas(self):
+        '''Return the selected rows as a pandas DataFrame, indexed by index_col if it was
+        given. Built from the numpy structured array. '''
+
+        return self._dataframe(self.numpy)
 
     @property
     def petl(self):
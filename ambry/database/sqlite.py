@@ -144,10 +144,88 @@ class SqliteAttachmentMixin(object):
                 conn.execute(q)
 
 
+def load_csv_rows(conn, csv_path, table_name, columns, caster=None, processors=None,
+                  encoding='utf-8', chunk_size=50000, logger=None):
+    '''Load a pipe-delimited CSV file into a table with a DB-API connection, reading
+    with the C csv reader and inserting chunks of rows with executemany(). The rows are
+    cast with the caster's cast_batch(), and processors is a list of (index, function) for
+    values that the DB-API can't store directly. The caller is responsible for committing.
+
+    Returns the number of rows and the number of rows with cast errors. '''
+    import csv
+    from itertools import islice
+    from ..util.compression import open_compressed
+
+    reader = csv.reader(open_compressed(csv_path), delimiter='|', escapechar='\\')
+
+    sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+        table_name, ','.join('"{}"'.format(c) for c in columns), ','.join('?' * len(columns)))
+
+    cursor = conn.cursor()
+    count = 0
+    error_count = 0
+
+    while True:
+        rows = list(islice(reader, chunk_size))
+
+        if not rows:
+            break
+
+        rows = [ [ v.decode(encoding) for v in row ] for row in rows ]
+
+        if caster:
+            rows, cast_errors = caster.cast_batch(rows)
+            error_count += len(cast_errors)
+
+        for i, p in processors or []:
+            for row in rows:
+                row[i] = p(row[i])
+
+        cursor.executemany(sql, rows)
+
+        count += len(rows)
+
+        if logger:
+            logger("Load row {}:".format(count))
+
+    return count, error_count
+
+def _bind_processors(types, dialect):
+    '''Return (index, function) for the Sqlalchemy types that need conversion before
+    they are written with the DB-API'''
+
+    processors = [ (i, t.dialect_impl(dialect).bind_processor(dialect)) for i, t in enumerate(types) ]
+
+    return [ (i, p) for i, p in processors if p ]
+
+def _load_csv_segment(args):
+    '''Pool worker for SqliteDatabase.load_many(). Loads one CSV file into a new
+    database with a single table'''
+    import sqlite3
+    from sqlalchemy.dialects.sqlite import dialect
+
+    csv_path, db_path, create_sql, table_name, columns, types, caster, encoding = args
+
+    conn = sqlite3.connect(db_path)
+
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute(create_sql)
+
+        count, error_count = load_csv_rows(conn, csv_path, table_name, columns, caster=caster,
+                                           processors=_bind_processors(types, dialect()),
+                                           encoding=encoding)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return db_path, count, error_count
+
 class SqliteDatabase(RelationalDatabase):
 
     EXTENSION = '.db'
-    SCHEMA_VERSION = 16
+    SCHEMA_VERSION = 17
 
     def __init__(self, dbname, memory = False,  **kwargs):   
         ''' '''
@@ -320,7 +398,181 @@ class SqliteDatabase(RelationalDatabase):
         ''' Load the database from a CSV file '''
         
         #return self.load_insert(a,table, encoding=encoding, caster=caster, logger=logger)
-        return self.load_shell(a,table, encoding=encoding, caster=caster, logger=logger)
+        #return self.load_shell(a,table, encoding=encoding, caster=caster, logger=logger)
+        return self.load_bulk(a,table, encoding=encoding, caster=caster, logger=logger)
+
+    def _load_source(self, a):
+        '''Return the CsvDb for a CSV partition or database'''
+        from ..partition import PartitionInterface
+        from ..database.csv import CsvDb
+        from ..dbexceptions import ConfigurationError
+
+        if isinstance(a,PartitionInterface):
+            return a.database
+        elif isinstance(a,CsvDb):
+            return a
+        else:
+            raise ConfigurationError("Can't use this type: {}".format(type(a)))
+
+    def _load_setup(self, table, caster):
+        '''Return the table name, column names, column types and caster for a CSV load'''
+
+        try: table_name = table.name
+        except AttributeError: table_name = table
+
+        sa_table = self.table(table_name)
+
+        if caster is None and getattr(self, 'bundle', None):
+            caster = self.bundle.schema.caster(table_name)
+
+        return (table_name, [ c.name for c in sa_table.columns ],
+                [ c.type for c in sa_table.columns ], caster)
+
+    def _set_load_pragmas(self, conn):
+        '''Turn off the journal and syncs while loading. Returns the previous settings,
+        for _restore_load_pragmas(). A WAL database keeps its journal, because leaving WAL
+        mode needs the only connection to the database. '''
+
+        saved = (conn.execute('PRAGMA journal_mode').fetchone()[0],
+                 conn.execute('PRAGMA synchronous').fetchone()[0])
+
+        if saved[0].lower() != 'wal':
+            conn.execute('PRAGMA journal_mode = OFF')
+
+        conn.execute('PRAGMA synchronous = OFF')
+
+        return saved
+
+    def _restore_load_pragmas(self, conn, saved):
+        '''Restore the journal and sync settings that _set_load_pragmas() returned'''
+
+        journal_mode, synchronous = saved
+
+        if journal_mode.lower() != 'wal':
+            conn.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+
+        conn.execute('PRAGMA synchronous = {}'.format(synchronous))
+
+    def load_bulk(self,a, table, encoding='utf-8', caster=None, logger=None, chunk_size=50000):
+        '''Load a CSV file in process, casting chunks of rows and inserting them with
+        executemany(), and commit once at the end. Unless the database is in WAL mode, the
+        journal is off during the load, so a failed load can leave some of its rows in the
+        table. Returns the number of rows and the time. '''
+        import time
+
+        db = self._load_source(a)
+
+        table_name, columns, types, caster = self._load_setup(table, caster)
+
+        start = time.time()
+
+        conn = self.dbapi_connection
+
+        saved = self._set_load_pragmas(conn)
+
+        try:
+            count, error_count = load_csv_rows(conn, db.path, table_name, columns, caster=caster,
+                                               processors=_bind_processors(types, self.engine.dialect),
+                                               encoding=encoding, chunk_size=chunk_size, logger=logger)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            self._restore_load_pragmas(conn, saved)
+            conn.close()
+
+        diff = time.time() - start
+
+        if error_count:
+            get_logger(__name__).warn("Load of {} had cast errors in {} rows".format(db.path, error_count))
+
+        return count, diff
+
+    def load_many(self, sources, table, n=None, encoding='utf-8', caster=None, logger=None):
+        '''Load a set of CSV files in parallel, each into its own temporary database on a pool of
+        n processes, then merge the temporary databases into this one with ATTACH, in the order
+        of the sources. Each source is committed as it is merged, so a failed load can leave
+        the earlier sources in the table. Returns the number of rows
+        and the time. '''
+        from multiprocessing import Pool, cpu_count
+        import pickle
+        import time
+        from ..util import temp_file_name
+
+        dbs = [ self._load_source(a) for a in sources ]
+
+        table_name, columns, types, caster = self._load_setup(table, caster)
+
+        try:
+            pickle.dumps((caster, types))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            get_logger(__name__).warn("Caster for {} can't be sent to a process pool; loading serially".format(table_name))
+            n = 1
+
+        if not n:
+            n = cpu_count()
+
+        if n == 1 or len(dbs) < 2:
+            count, diff = 0, 0
+            for db in dbs:
+                c, d = self.load_bulk(db, table_name, encoding=encoding, caster=caster, logger=logger)
+                count += c
+                diff += d
+            return count, diff
+
+        start = time.time()
+
+        create_sql = self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", table_name).scalar()
+
+        tmp_paths = []
+        for db in dbs:
+            tmp_path = temp_file_name()
+            os.remove(tmp_path) # sqlite3 will create it
+            tmp_paths.append(tmp_path)
+
+        pool = Pool(min(n, len(dbs)))
+
+        try:
+            results = pool.map(_load_csv_segment,
+                               [ (db.path, tmp_path, create_sql, table_name, columns, types, caster, encoding)
+                                 for db, tmp_path in zip(dbs, tmp_paths) ])
+            pool.close()
+            pool.join()
+
+            count = 0
+            conn = self.dbapi_connection
+
+            saved = self._set_load_pragmas(conn)
+
+            try:
+                for db, (tmp_path, c, error_count) in zip(dbs, results):
+
+                    conn.execute("ATTACH DATABASE '{}' AS load_segment".format(tmp_path))
+                    conn.execute('INSERT INTO "{0}" SELECT * FROM load_segment."{0}"'.format(table_name))
+                    conn.commit()
+                    conn.execute("DETACH DATABASE load_segment")
+
+                    count += c
+
+                    if error_count:
+                        get_logger(__name__).warn("Load of {} had cast errors in {} rows".format(db.path, error_count))
+
+                    if logger:
+                        logger("Load row {}:".format(count))
+            finally:
+                self._restore_load_pragmas(conn, saved)
+                conn.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        return count, time.time() - start
 
     def load_insert(self,a, table=None, encoding='utf-8', caster=None, logger=None):
         from ..partition import PartitionInterface
@@ -339,10 +591,11 @@ class SqliteDatabase(RelationalDatabase):
         start = time.clock()
         count = 0
         with self.inserter(table,  caster=caster) as ins:
+            # The inserter casts and writes the rows in chunks of cache_size
             for row in db.reader(encoding=encoding):
                 count+=1
              
-                if logger:
+                if logger and count % ins.cache_size == 0:
                     logger("Load row {}:".format(count))
              
                 ins.insert(row)
@@ -638,6 +891,19 @@ def _on_connect_update_sqlite_schema(conn, con_record):
             except Exception as e:
                 pass
 
+        if version < 17:
+            # Indexes for the Resolver, defined on the Dataset and Partition ORM classes
+            for sql in ('CREATE INDEX IF NOT EXISTS ix_datasets_id ON datasets (d_id)',
+                        'CREATE INDEX IF NOT EXISTS ix_datasets_name ON datasets (d_name)',
+                        'CREATE INDEX IF NOT EXISTS ix_datasets_vname ON datasets (d_vname)',
+                        'CREATE INDEX IF NOT EXISTS ix_partitions_id ON partitions (p_id)',
+                        'CREATE INDEX IF NOT EXISTS ix_partitions_name ON partitions (p_name)',
+                        'CREATE INDEX IF NOT EXISTS ix_partitions_d_vid ON partitions (p_d_vid)'):
+                try:
+                    conn.execute(sql)
+                except Exception as e:
+                    pass
+
 
     conn.execute('PRAGMA user_version = {}'.format(SqliteDatabase.SCHEMA_VERSION))
 
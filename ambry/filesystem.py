@@ -13,6 +13,7 @@ import zipfile
 
 import urllib
 import ambry.util
+from ambry.util import copy_file_or_flo
 
 logger = ambry.util.get_logger(__name__)
 #import logging; logger.setLevel(logging.DEBUG) 
@@ -44,6 +45,192 @@ zipfile.ZipFile.testzip = testzip
 class DownloadFailedError(Exception):
     pass
 
+class RangedDownload(object):
+    '''Download a URL to a file, fetching parts of the file in parallel threads with HTTP
+    Range requests. Each part is written to its own file next to the download path, so an
+    interrupted download resumes from the parts that were already fetched. If the server
+    doesn't accept ranges, the file is fetched with a single request.
+
+    The downloaded file is checked against the expected size and md5, if they are given,
+    and the size that the server reported. '''
+
+    def __init__(self, url, path, n=4, part_size=8*1024*1024, size=None, md5=None,
+                 timeout=60, retries=3):
+
+        self.url = url
+        self.path = path
+        self.n = n
+        self.part_size = part_size
+        self.size = int(size) if size else None
+        self.md5 = md5
+        self.timeout = timeout
+        self.retries = retries
+
+    def _open(self, start=None, end=None):
+        import urllib2
+
+        req = urllib2.Request(self.url)
+
+        if start is not None:
+            req.add_header('Range', 'bytes={}-{}'.format(start, '' if end is None else end))
+
+        return urllib2.urlopen(req, timeout=self.timeout)
+
+    def _probe(self):
+        '''Return the size of the file, or None if it is not known, and whether the
+        server accepts range requests '''
+        import urlparse
+        import urllib2
+
+        if urlparse.urlparse(self.url).scheme not in ('http', 'https'):
+            return self.size, False
+
+        try:
+            resp = self._open(0, 0)
+        except urllib2.HTTPError as e:
+            if e.code != 416:
+                raise
+
+            # An empty file has no byte 0. Content-Range: bytes */0
+            total = (e.info().getheader('Content-Range', '') if e.info() else '').split('/')[-1]
+            e.close()
+            return (int(total) if total.isdigit() else self.size), False
+
+        try:
+            if resp.getcode() == 206:
+                # Content-Range: bytes 0-0/12345
+                total = resp.info().getheader('Content-Range', '').split('/')[-1]
+                return (int(total) if total.isdigit() else self.size), True
+            elif resp.getcode() == 200:
+                length = resp.info().getheader('Content-Length')
+                return (int(length) if length else self.size), False
+            else:
+                raise DownloadFailedError("Failed to download {}: code: {} ".format(self.url, resp.getcode()))
+        finally:
+            resp.close()
+
+    def part_path(self, i):
+        return "{}.part{}".format(self.path, i)
+
+    def _fetch_part(self, part):
+        '''Fetch the bytes of a part that are not already in its file'''
+        import httplib
+        import shutil
+        import urllib2
+
+        i, start, end = part
+        part_path = self.part_path(i)
+        length = end - start + 1
+        error = None
+
+        for attempt in range(self.retries + 1):
+
+            have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+            if have == length:
+                return
+
+            if have > length:
+                os.remove(part_path)
+                have = 0
+
+            try:
+                resp = self._open(start + have, end)
+
+                if resp.getcode() != 206:
+                    raise DownloadFailedError("Server didn't return a range for {}: code: {}"
+                                              .format(self.url, resp.getcode()))
+
+                with open(part_path, 'ab') as f:
+                    shutil.copyfileobj(resp, f, 1024*1024)
+
+                resp.close()
+
+            except (IOError, httplib.HTTPException) as e: # URLError is an IOError
+                logger.debug("Retrying part {} of {}: {}".format(i, self.url, e))
+                error = e
+
+        if os.path.exists(part_path) and os.path.getsize(part_path) == length:
+            return
+
+        raise DownloadFailedError("Failed to download part {} of {}: {}".format(i, self.url, error))
+
+    def _fetch_ranges(self, size):
+        from multiprocessing.pool import ThreadPool
+
+        parts = [ (i, start, min(start + self.part_size, size) - 1)
+                  for i, start in enumerate(xrange(0, size, self.part_size)) ]
+
+        pool = ThreadPool(max(1, min(self.n, len(parts))))
+
+        try:
+            pool.map(self._fetch_part, parts)
+        finally:
+            pool.close()
+            pool.join()
+
+        with open(self.path, 'wb') as f:
+            for i, _, _ in parts:
+                with open(self.part_path(i), 'rb') as pf:
+                    copy_file_or_flo(pf, f, buffer_size=1024*1024)
+
+        for i, _, _ in parts:
+            os.remove(self.part_path(i))
+
+    def _fetch_single(self):
+        resp = self._open()
+
+        try:
+            if resp.getcode() is not None and resp.getcode() != 200:
+                raise DownloadFailedError("Failed to download {}: code: {} ".format(self.url, resp.getcode()))
+
+            with open(self.path, 'wb') as f:
+                copy_file_or_flo(resp, f, buffer_size=1024*1024)
+        finally:
+            resp.close()
+
+    def verify(self, size=None):
+        '''Check the downloaded file against the expected size and md5. The file is removed
+        if it doesn't match'''
+        from ambry.util import md5_for_file
+
+        size = size or self.size
+
+        error = None
+
+        if not os.path.exists(self.path):
+            error = "No file"
+        elif size and os.path.getsize(self.path) != size:
+            error = "Expected {} bytes, got {}".format(size, os.path.getsize(self.path))
+        elif self.md5 and md5_for_file(self.path) != self.md5:
+            error = "md5 doesn't match {}".format(self.md5)
+
+        if error:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            raise DownloadFailedError("Download of {} failed verification: {}".format(self.url, error))
+
+    def run(self):
+        '''Download the file, and return its path'''
+
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        size, ranges = self._probe()
+
+        if self.size and size and size != self.size:
+            raise DownloadFailedError("Expected {} to have {} bytes, server reports {}"
+                                      .format(self.url, self.size, size))
+
+        if ranges and size:
+            self._fetch_ranges(size)
+        else:
+            self._fetch_single()
+
+        self.verify(size)
+
+        return self.path
+
 class FileRef(File):
     '''Extends the File orm class with awareness of the filsystem'''
     def __init__(self, bundle):
@@ -327,32 +514,59 @@ class BundleFilesystem(Filesystem):
             self.rm_rf(tmpdir)
     
         
-    def download(self,url, test_f=None):
+    def download_source(self, url):
+        '''Resolve a url, or a key for the build.sources configuration, to the url, the path
+        of the file in the downloads cache, and the expected size and md5, which may be None'''
+        import urlparse
+
+        parsed = urlparse.urlparse(url)
+
+        size = md5 = None
+
+        if ( not parsed.scheme and
+                self.bundle.config.build.get('sources') and
+                url in self.bundle.config.build.sources):
+            url = self.bundle.config.build.sources.get(url)
+
+            if isinstance(url, dict):
+                size, md5 = url.get('size'), url.get('md5')
+                url = url['url']
+
+            parsed = urlparse.urlparse(url)
+
+        file_path = parsed.netloc+'/'+urllib.quote_plus(parsed.path.replace('/','_'),'_')
+
+        return url, file_path, size, md5
+
+    def download_cached(self, url):
+        '''Return the path to the downloaded file for a url or source key, if it is
+        already in the downloads cache, or None'''
+
+        cache = self.get_cache_by_name('downloads')
+
+        _, file_path, _, _ = self.download_source(url)
+
+        return cache.has(file_path, use_upstream=False) or None
+
+    def download(self,url, test_f=None, n=4):
         '''Context manager to download a file, return it for us, 
         and delete it when done.
 
-        url may also be a key for the build.sources configuration
+        url may also be a key for the build.sources configuration. The value of
+        the key may be a URL, or a dict with a url and the expected size and md5 of the file. 
 
         
         Will store the downloaded file into the cache defined
-        by filesystem.download
+        by filesystem.download. HTTP downloads are fetched in parts on n threads, and
+        partial downloads are resumed. 
         '''
 
         import tempfile
-        import urlparse
-        import urllib2
         import stat
       
         cache = self.get_cache_by_name('downloads')
-        parsed = urlparse.urlparse(url)
-
-        if ( not parsed.scheme and
-                self.bundle.config.build.get('sources') and
-                url in self.bundle.config.build.sources):
-            url = self.bundle.config.build.sources.get(url)
-            parsed = urlparse.urlparse(url)
 
-        file_path = parsed.netloc+'/'+urllib.quote_plus(parsed.path.replace('/','_'),'_')
+        url, file_path, size, md5 = self.download_source(url)
 
         # We download to a temp file, then move it into place when 
         # done. This allows the code to detect and correct partial
@@ -384,9 +598,9 @@ class BundleFilesystem(Filesystem):
             try:                  
 
                 cached_file = cache.get(file_path)
-                size = os.stat(cached_file).st_size if cached_file else None
+                cached_size = os.stat(cached_file).st_size if cached_file else None
    
-                if cached_file and size:
+                if cached_file and cached_size:
 
                     out_file = cached_file
                     
@@ -399,14 +613,10 @@ class BundleFilesystem(Filesystem):
                     self.bundle.log("Downloading "+url)
                     self.bundle.log("  --> "+file_path)
                     
-                    resp = urllib2.urlopen(url)
-                    headers = resp.info() #@UnusedVariable
-    
-                    if resp.getcode() is not None  and resp.getcode() != 200:
-                        raise DownloadFailedError("Failed to download {}: code: {} ".format(url, resp.getcode()))
-                    
+                    RangedDownload(url, download_path, n=n, size=size, md5=md5).run()
+
                     try:
-                        out_file = cache.put(resp, file_path)
+                        out_file = cache.put(download_path, file_path)
                     except:
                         self.bundle.error("Caught exception, deleting download file")
                         cache.remove(file_path, propagate = True)
@@ -453,6 +663,46 @@ class BundleFilesystem(Filesystem):
 
         return out_file
 
+    def download_many(self, urls, test_f=None, n=4, threads=4, errors=None):
+        '''Download a set of urls, or build.sources keys, on a pool of n threads, each of
+        which downloads with the given number of threads. Returns a dict of the downloaded
+        file paths, keyed by the urls.
+
+        If errors is a dict, a failed download is stored in it, keyed by the url, and left
+        out of the result, rather than raised. '''
+        from multiprocessing.pool import ThreadPool
+
+        urls = list(urls)
+
+        if not urls:
+            return {}
+
+        def download(url):
+            try:
+                return url, self.download(url, test_f=test_f, n=threads), None
+            except Exception as e:
+                if errors is None:
+                    raise
+                return url, None, e
+
+        pool = ThreadPool(max(1, min(n, len(urls))))
+
+        try:
+            results = pool.map(download, urls)
+        finally:
+            pool.close()
+            pool.join()
+
+        paths = {}
+
+        for url, path, e in results:
+            if e is None:
+                paths[url] = path
+            else:
+                errors[url] = e
+
+        return paths
+
     def read_csv(self, f, key = None):
         """Read a CSV into a dictionary of dicts or list of dicts
         
@@ -547,6 +547,24 @@ class Library(object):
         return ident
 
 
+    def resolve_many(self, refs, location = [Dataset.LOCATION.LIBRARY,Dataset.LOCATION.REMOTE]):
+        '''Resolve a list of references in the local library, with a fixed number of queries
+        rather than one or two for each reference. Returns an OrderedDict of the references, with
+        Identities converted to their vids, and the identity each one resolves to, or None. '''
+
+        refs = [ ref.vid if isinstance(ref, Identity) else ref for ref in refs ]
+
+        out = self.resolver.resolve_many(refs, location)
+
+        for ident in out.values():
+            try:
+                if ident and self.source:
+                    ident.bundle_path = self.source.source_path(ident=ident)
+            except ConfigurationError:
+                pass  # Warehouse libraries don't have source directories.
+
+        return out
+
     ##
     ## Dependencies
     ##
@@ -748,13 +766,14 @@ class Library(object):
     # Synchronize
     #
 
-    def sync_library(self, clean=False):
+    def sync_library(self, clean=False, n=None):
         '''Rebuild the database from the bundles that are already installed
-        in the repository cache'''
-
-
+        in the repository cache. The database files are read on a pool of n processes, and the
+        records for all of the bundles are installed with bulk inserts in one transaction. '''
+        from multiprocessing import Pool, cpu_count
         from .files import Files
-        from database import ROOT_CONFIG_NAME_V
+        from .database import ROOT_CONFIG_NAME_V, read_bundle_records
+        from ..orm import File
 
         assert Files.TYPE.BUNDLE == Dataset.LOCATION.LIBRARY
         assert Files.TYPE.PARTITION == Dataset.LOCATION.PARTITION
@@ -767,10 +786,13 @@ class Library(object):
             self.files.query.type(Files.TYPE.BUNDLE).delete()
             self.files.query.type(Files.TYPE.PARTITION).delete()
 
-        bundles = []
-
         self.logger.info("Rebuilding from dir {}".format(self.cache.cache_dir))
 
+        installed = set(path for path, in self.database.session.query(File.path)
+                                .filter(File.type_.in_([Files.TYPE.BUNDLE, Files.TYPE.PARTITION])))
+
+        paths = []
+
         for r, d, f in os.walk(self.cache.cache_dir, topdown=True): #@UnusedVariable
 
             # Exclude all of the directories which have the same basename as a database file. These
@@ -785,46 +807,61 @@ class Library(object):
                 if file_.endswith(".db"):
                     path_ = os.path.join(r, file_)
 
-                    extant_bundle = self.files.query.type(Files.TYPE.BUNDLE).path(path_).one_maybe
-                    extant_partition = self.files.query.type(Files.TYPE.PARTITION).path(path_).one_maybe
-                    if (extant_bundle or extant_partition):
-                        continue
+                    if path_ not in installed:
+                        paths.append(path_)
 
-                    try:
+        if not n:
+            n = cpu_count()
 
-                        b = self._create_bundle( path_)
-                        # This is a fragile hack -- there should be a flag in the database
-                        # that differentiates a partition from a bundle.
-                        f = os.path.splitext(file_)[0]
+        self.logger.info("Reading {} database files".format(len(paths)))
 
-                        if b.db_config.get_value('info', 'type') == 'bundle':
-                            self.logger.info("Queing: {} from {}".format(b.identity.vname, file_))
-                            bundles.append(b)
-                    except NotFoundError:
-                        # Probably a partition, not a bundle.
-                        pass
-                    except Exception as e:
-                        raise
-                        self.logger.error('Failed to process {}, {} : {} '.format(file_, path_, e))
+        if n > 1 and len(paths) > 1:
+            pool = Pool(n)
+            try:
+                results = pool.map(read_bundle_records, paths)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            results = map(read_bundle_records, paths)
 
-        bundles = sorted(bundles, key = lambda b: b.partitions.count)
+        # Non-bundle files are partitions
+        bundles = sorted([ (path, records) for path, records in results if records ],
+                         key = lambda (path, records): len(records['partitions']))
 
-        for bundle in bundles:
-            self.logger.info('Installing: {} '.format(bundle.identity.vname))
+        files = []
 
-            try:
-                self.sync_library_dataset(bundle, install_partitions=False)
-            except Exception as e:
-                self.logger.error('Failed to install bundle {}: {}'.format(bundle.identity.vname, e.message))
-                continue
+        for path, records in bundles:
 
-            for p in bundle.partitions:
-                if self.cache.has(p.identity.cache_key, use_upstream=False):
-                    self.logger.info('            {} '.format(p.identity.vname))
-                    self.sync_library_partition(bundle, p.identity, commit = False)
+            records['partitions'] = [ p for p in records['partitions']
+                                      if self.cache.has(p['p_cache_key'], use_upstream=False) ]
+
+            for d in records['datasets']:
+                self.logger.info('Installing: {} '.format(d['d_vname']))
+
+                files.append(dict(path=path, group=self.cache.repo_id, ref=d['d_vid'], state='rebuilt',
+                                  type_=Files.TYPE.BUNDLE, data=None, source_url=None))
 
+            for p in records['partitions']:
+                self.logger.info('            {} '.format(p['p_vname']))
+
+                files.append(dict(path=p['p_fqname'], group=None, ref=p['p_vid'], state='rebuilt',
+                                  type_=Files.TYPE.PARTITION, data=None, source_url=None))
+
+        try:
+            self.database.install_bundle_records([ records for path, records in bundles ])
+            self.files.insert_many(files, commit=False)
             self.database.commit()
-        return bundles
+        except:
+            self.database.rollback()
+            raise
+
+        self.database._mark_update()
+
+        return [ path for path, records in bundles ]
 
     def sync_library_dataset(self, bundle, install_partitions=True):
 
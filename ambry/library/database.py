@@ -57,6 +57,7 @@ class LibraryDb(object):
         self._session = None
         self._engine = None
         self._connection  = None
+        self._resolver_cache = None
 
         if self.driver in ['postgres','postgis']:
             self._schema = 'library'
@@ -103,8 +104,30 @@ class LibraryDb(object):
                 #event.listen(self._engine, 'connect', _on_connect_update_schema)
                 _on_connect_update_sqlite_schema(self.connection, None)
 
+            elif self.driver in ('postgres', 'postgis'):
+                self._update_postgres_schema()
+
         return self._engine
 
+    def _update_postgres_schema(self):
+        '''Create the indexes that were added to the ORM classes after a Postgres library was
+        created. Sqlite libraries are updated by _on_connect_update_sqlite_schema()'''
+
+        inspector = self.inspector
+        tables = inspector.get_table_names(schema=self._schema)
+
+        for it in (Dataset.__table__, Partition.__table__):
+
+            if it.name not in tables:
+                continue # create_tables() will make it with all of its indexes
+
+            existing = set(ix['name'] for ix in inspector.get_indexes(it.name, schema=self._schema))
+
+            for ix in it.indexes:
+                if ix.name not in existing:
+                    self.connection.execute('CREATE INDEX "{}" ON {}."{}" ({})'.format(
+                        ix.name, self._schema, it.name, ', '.join('"{}"'.format(c.name) for c in ix.columns)))
+
     @property
     def connection(self):
         '''Return an SqlAlchemy connection'''
@@ -122,12 +145,16 @@ class LibraryDb(object):
     def session(self):
         '''Return a SqlAlchemy session'''
         from sqlalchemy.orm import sessionmaker
+        from sqlalchemy import event
 
         if not self.Session:
             # expire_on_commit=False prevents DetatchedInstanceErrors when
             # using database object outside the database.
             self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
 
+            # Any write through the session may change what refs resolve to.
+            event.listen(self.Session, 'after_flush', self._clear_resolver_cache)
+
         if not self._session:
             self._session = self.Session()
             # set the search path
@@ -503,6 +530,55 @@ class LibraryDb(object):
 
             self.install_bundle(bundle)
 
+    def install_bundle_records(self, records, batch_size=500):
+        '''Install the dataset, config, table, column and partition records for a set of bundles,
+        as read by read_bundle_records(), with bulk deletes and inserts in the session's
+        transaction. Like install_bundle(), existing records for the datasets are replaced.
+        The caller must commit. '''
+
+        s = self.session
+
+        def batches(l):
+            for i in range(0, len(l), batch_size):
+                yield l[i:i+batch_size]
+
+        rows = {}
+        for r in records:
+            for table_name, table_rows in r.items():
+                rows.setdefault(table_name, []).extend(table_rows)
+
+        for d in rows.get('datasets', []):
+            d['d_location'] = Dataset.LOCATION.LIBRARY
+
+        for p in rows.get('partitions', []):
+            p['p_d_location'] = Dataset.LOCATION.LIBRARY
+
+        # Delete the extant records, children first
+        deletes = [
+            (Column.__table__.c.c_t_vid, [ t['t_vid'] for t in rows.get('tables', []) ]),
+            (Partition.__table__.c.p_d_vid, [ d['d_vid'] for d in rows.get('datasets', []) ]),
+            (Table.__table__.c.t_d_vid, [ d['d_vid'] for d in rows.get('datasets', []) ]),
+            (Config.__table__.c.co_d_vid, list(set(c['co_d_vid'] for c in rows.get('config', [])))),
+        ]
+
+        for c, vids in deletes:
+            for batch in batches(vids):
+                s.execute(c.table.delete().where(c.in_(batch)))
+
+        for batch in batches([ d['d_vid'] for d in rows.get('datasets', []) ]):
+            t = Dataset.__table__
+            s.execute(t.delete().where(t.c.d_vid.in_(batch)).where(t.c.d_location == Dataset.LOCATION.LIBRARY))
+
+        for orm_class in (Dataset, Config, Table, Column, Partition):
+            t = orm_class.__table__
+
+            # executemany() takes its columns from the first row, so every row must have all of
+            # the columns, in case the records came from bundles with different schema versions.
+            defaults = _column_defaults(t)
+
+            for batch in batches(rows.get(t.name, [])):
+                s.execute(t.insert(), [ dict(defaults, **row) for row in batch ])
+
     def install_dataset(self, bundle):
         """Install only the most basic parts of the bundle, excluding the
         partitions and tables. Use install_bundle to install everything.
@@ -745,7 +821,7 @@ class LibraryDb(object):
 
         s = self.session
 
-        s.query(Partition).filter(Partition.t_vid  == p_vid).delete()
+        s.query(Partition).filter(Partition.vid == p_vid).delete()
 
         self.commit()
 
@@ -870,7 +946,30 @@ class LibraryDb(object):
     @property
     def resolver(self):
         from .query import Resolver
-        return  Resolver(self.session)
+        return  Resolver(self.session, cache=self.resolver_cache)
+
+    @property
+    def resolver_cache(self):
+        '''The cache of Resolver results, which is shared by all of the resolvers for this
+        database, and cleared when the database changes'''
+        from .query import ResolverCache
+
+        if self._resolver_cache is None:
+            self._resolver_cache = ResolverCache(self._change_stamp)
+
+        return self._resolver_cache
+
+    def _change_stamp(self):
+        '''The time of the last change, set by _mark_update()'''
+
+        c = self.get_config_value('activity', 'change')
+
+        return c.value if c else None
+
+    def _clear_resolver_cache(self, session, flush_context):
+
+        if self._resolver_cache is not None:
+            self._resolver_cache.clear()
 
     def find(self, query_command):
         '''Find a bundle or partition record by a QueryCommand or Identity
@@ -1125,6 +1224,59 @@ class LibraryDb(object):
 
 
 
+def read_bundle_records(path):
+    '''Read the records that the library installs for a bundle from a bundle database file, as
+    dicts keyed by table name, with lists of rows keyed by column name. Only the columns that
+    are in the file are read, so older files don't have to be updated, and the others get their
+    defaults. Returns the path and the records, which are None if the file is not a bundle.
+
+    Opens its own engine, so it can run in a pool worker. '''
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.pool import NullPool
+    from sqlalchemy.exc import DatabaseError
+
+    engine = create_engine('sqlite:///{}'.format(path), poolclass=NullPool)
+
+    try:
+        conn = engine.connect()
+
+        c = Config.__table__.c
+
+        try:
+            type_ = conn.execute(select([c.co_value])
+                                 .where(c.co_group == 'info').where(c.co_key == 'type')).scalar()
+        except DatabaseError:
+            return path, None
+
+        if type_ != 'bundle':
+            return path, None
+
+        records = {}
+
+        for orm_class in (Dataset, Config, Table, Column, Partition):
+            t = orm_class.__table__
+
+            extant = set(row[1] for row in conn.execute('PRAGMA table_info({})'.format(t.name)))
+            columns = [ c for c in t.columns if c.name in extant ]
+            names = [ c.name for c in columns ]
+
+            defaults = _column_defaults(t)
+
+            records[t.name] = [ dict(defaults, **dict(zip(names, row))) for row in conn.execute(select(columns)) ]
+
+        conn.close()
+
+        return path, records
+
+    finally:
+        engine.dispose()
+
+def _column_defaults(table):
+    '''A dict of the names of the columns of a table and their scalar defaults, or None'''
+
+    return { c.name: c.default.arg if c.default is not None and c.default.is_scalar else None
+             for c in table.columns }
+
 def _pragma_on_connect(dbapi_con, con_record):
     '''ISSUE some Sqlite pragmas when the connection is created'''
 
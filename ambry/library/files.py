@@ -124,6 +124,42 @@ class Files(object):
             return File(**kwargs)
 
 
+    def insert_many(self, files, commit=True):
+        '''Insert records for a list of dicts of File arguments with bulk inserts, replacing
+        extant records with the same path or ref and type. '''
+
+        t = File.__table__
+        s = self.db.session
+
+        columns = [ (prop.key, prop.columns[0].name) for prop in File.__mapper__.column_attrs
+                    if prop.columns[0].name != 'f_id' ]
+
+        rows = []
+        for kwargs in files:
+            f = File(**kwargs)
+
+            if os.path.exists(f.path):
+                stat = os.stat(f.path)
+                f.modified = int(stat.st_mtime)
+                f.size = stat.st_size
+
+            rows.append({ name: getattr(f, key) for key, name in columns })
+
+        for i in range(0, len(rows), 500):
+            batch = rows[i:i+500]
+
+            for type_ in set(r['f_type'] for r in batch):
+                s.execute(t.delete().where(t.c.f_type == type_)
+                          .where(t.c.f_path.in_([ r['f_path'] for r in batch if r['f_type'] == type_ ])))
+                s.execute(t.delete().where(t.c.f_type == type_)
+                          .where(t.c.f_ref.in_([ r['f_ref'] for r in batch if r['f_type'] == type_ ])))
+
+            s.execute(t.insert(), batch)
+
+        if commit:
+            self.db.commit()
+            self.db._mark_update()
+
     def merge(self, f, commit = True):
         from sqlalchemy.exc import IntegrityError
 
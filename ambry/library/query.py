@@ -270,86 +270,168 @@ class QueryCommand(object):
 
 
 
+class ResolverCache(object):
+    '''Resolution results of a library database, keyed by the ref string. The results are
+    dropped when the library's activity change timestamp, which LibraryDb._mark_update() sets,
+    is different from the one they were cached under, and when the library's session writes.
+
+    The timestamp is read at most once every check_interval seconds, so other processes'
+    changes to the library may take that long to be seen. '''
+
+    def __init__(self, stamp_f, max_size=20000, check_interval=2):
+        self._stamp_f = stamp_f
+        self._stamp = None
+        self._checked = None
+        self._results = {}
+        self.max_size = max_size
+        self.check_interval = check_interval
+
+    def validate(self):
+        '''Clear the cache if the library has changed since the results were cached'''
+        import time
+
+        now = time.time()
+
+        if self._checked is not None and now - self._checked < self.check_interval:
+            return
+
+        self._checked = now
+
+        stamp = self._stamp_f()
+
+        if stamp != self._stamp:
+            self._results = {}
+            self._stamp = stamp
+
+    def clear(self):
+        self._results = {}
+
+    def get(self, ref):
+        return self._results.get(ref)
+
+    def put(self, ref, result):
+
+        if len(self._results) >= self.max_size:
+            self._results = {}
+
+        self._results[ref] = result
+
+    def __len__(self):
+        return len(self._results)
+
+
 class Resolver(object):
     '''Find a reference to a dataset or partition based on a string,
     which may be a name or object number '''
 
-    def __init__(self, session):
-
-        self.session = session # a Sqlalchemy connection
+    # Maximum number of values in an IN clause in resolve_many(), to stay under Sqlite's
+    # limit on query parameters
+    max_in_values = 500
 
-    def _resolve_ref_orm(self, ref):
-        import semantic_version
+    def __init__(self, session, cache=None):
 
-        ip = Identity.classify(ref)
+        self.session = session # a Sqlalchemy connection
+        self.cache = cache
 
-        dqp = None # Dataset query parts
-        pqp = None # Partition query parts
+    @staticmethod
+    def _query_parts(ip):
+        '''Return the (attribute, value) that the datasets and the partitions for a classified
+        ref are selected by. Either may be None. '''
 
         if ip.isa == PartitionNumber:
-            if ip.on.revision:
-                pqp = Partition.vid == str(ip.on)
-            else:
-                pqp = Partition.id_ == str(ip.on)
+            return None, ('vid' if ip.on.revision else 'id_', str(ip.on))
 
         elif ip.isa == DatasetNumber:
-            if ip.on.revision:
-                dqp = Dataset.vid == str(ip.on)
-            else:
-                dqp = Dataset.id_ == str(ip.on)
+            return ('vid' if ip.on.revision else 'id_', str(ip.on)), None
 
         elif ip.vname:
-            dqp = Dataset.vname == ip.vname
-            pqp = Partition.vname == ip.vname
+            return ('vname', ip.vname), ('vname', ip.vname)
 
         elif ip.cache_key:
-            dqp = Dataset.cache_key == ip.cache_key
-            pqp = Partition.cache_key == ip.cache_key
+            return ('cache_key', ip.cache_key), ('cache_key', ip.cache_key)
 
         else:
-            dqp = Dataset.name == ip.sname
-            pqp = Partition.name == ip.sname
+            return ('name', ip.sname), ('name', ip.sname)
+
+    def _resolve_ref_orm(self, ref):
+
+        ip = Identity.classify(ref)
+
+        dqp, pqp = self._query_parts(ip) # Dataset and partition query parts
 
         out = []
         if dqp is not None:
 
-            for dataset in (self.session.query(Dataset).filter(dqp).order_by(Dataset.revision.desc()).all()):
+            for dataset in (self.session.query(Dataset).filter(getattr(Dataset, dqp[0]) == dqp[1])
+                            .order_by(Dataset.revision.desc()).all()):
                 out.append((dataset, None))
 
         if pqp is not None:
 
-            for row in (self.session.query(Dataset, Partition).join(Partition).filter(pqp)
+            for row in (self.session.query(Dataset, Partition).join(Partition)
+                        .filter(getattr(Partition, pqp[0]) == pqp[1])
                         .order_by(Dataset.revision.desc()).all()):
                 out.append((row.Dataset, row.Partition))
 
         return ip, out
 
-    def _resolve_ref(self, ref, location = Dataset.LOCATION.LIBRARY):
-        '''Convert the output from _resolve_ref to nested identities'''
-        ip, results = self._resolve_ref_orm(ref)
+    @staticmethod
+    def _to_records(results):
+        '''Convert the ORM results from _resolve_ref_orm() to (dataset dict, location, partition
+        dict) records, which don't refer to the session, so they can be cached'''
+
+        return [ (d.dict, d.location, dict(d.dict.items() + p.dict.items()) if p else None)
+                 for d, p in results ]
+
+    def _resolve_ref_records(self, ref):
+
+        r = self.cache.get(ref) if self.cache is not None else None
+
+        if r is None:
+            ip, results = self._resolve_ref_orm(ref)
+            r = ip, self._to_records(results)
+
+            if self.cache is not None:
+                self.cache.put(ref, r)
+
+        return r
+
+    def _to_identities(self, records, location):
+        '''Convert records to nested identities. New identities are made for each call, since
+        the callers modify them. '''
         from collections import OrderedDict
+        from ..identity import PartitionIdentity
 
         if location and not isinstance(location,(list, tuple)):
             location = [location]
 
-        # Convert the ORM results to identities
         out = OrderedDict()
-        for d,p in results:
+        for d, d_location, p in records:
 
-            if location and  d.location not in location:
+            if location and d_location not in location:
                 continue
 
-            if not d.vid in out:
-                out[d.vid] = d.identity
+            if not d['vid'] in out:
+                out[d['vid']] = Identity.from_dict(d)
 
-            out[d.vid].locations.set(d.location)
+            out[d['vid']].locations.set(d_location)
 
             # Partitions are only added for the LOCATION.LIBRARY location, so
             # we don't have to deal with duplicate  partitions
             if p:
-                out[d.vid].add_partition(p.identity)
+                out[d['vid']].add_partition(PartitionIdentity.from_dict(p))
 
-        return ip, out
+        return out
+
+    def _resolve_ref(self, ref, location = Dataset.LOCATION.LIBRARY):
+        '''Convert the output from _resolve_ref to nested identities'''
+
+        if self.cache is not None:
+            self.cache.validate()
+
+        ip, records = self._resolve_ref_records(ref)
+
+        return ip, self._to_identities(records, location)
 
 
     def resolve_ref_all(self, ref, location = Dataset.LOCATION.LIBRARY):
@@ -360,14 +442,17 @@ class Resolver(object):
         '''Return the "best" result for an object specification
 
         '''
-        import semantic_version
-
 
         ip, refs = self._resolve_ref(ref, location)
 
+        return ip, self._best(ip, refs)
+
+    @staticmethod
+    def _best(ip, refs):
+        import semantic_version
 
         if not isinstance(ip.version, semantic_version.Spec):
-            return ip, refs.values().pop(0) if refs and len(refs.values()) else None
+            return refs.values().pop(0) if refs and len(refs.values()) else None
         else:
 
             versions = {semantic_version.Version(d.name.version):d for d in refs.values()}
@@ -375,13 +460,86 @@ class Resolver(object):
             best = ip.version.select(versions.keys())
 
             if not best:
-                return ip, None
+                return None
             else:
-                return ip, versions[best]
+                return versions[best]
 
     def resolve(self, ref, location = Dataset.LOCATION.LIBRARY):
         return self.resolve_ref_one(ref, location)[1]
 
+    def resolve_many(self, refs, location = Dataset.LOCATION.LIBRARY):
+        '''Resolve a list of refs. The refs that aren't cached are looked up with one query
+        for each kind of reference, such as vid or name, for every max_in_values refs, rather than
+        one or two queries for each ref. Returns an OrderedDict of each ref and the result
+        that resolve() would return for it. '''
+        from collections import OrderedDict, defaultdict
+
+        if self.cache is not None:
+            self.cache.validate()
+
+        records = {}
+        pending = {}
+
+        for ref in refs:
+            if ref in records or ref in pending:
+                continue
+
+            r = self.cache.get(ref) if self.cache is not None else None
+
+            if r is not None:
+                records[ref] = r
+            else:
+                ip = Identity.classify(ref)
+                pending[ref] = (ip,) + self._query_parts(ip)
+
+        if pending:
+            d_values = defaultdict(set)
+            p_values = defaultdict(set)
+
+            for ip, dqp, pqp in pending.values():
+                if dqp:
+                    d_values[dqp[0]].add(dqp[1])
+                if pqp:
+                    p_values[pqp[0]].add(pqp[1])
+
+            def chunks(values):
+                values = sorted(values)
+                for i in range(0, len(values), self.max_in_values):
+                    yield values[i:i+self.max_in_values]
+
+            # Results by the query part that selected them, in revision order
+            found = defaultdict(list)
+
+            for attr, values in d_values.items():
+                for chunk in chunks(values):
+                    for dataset in (self.session.query(Dataset).filter(getattr(Dataset, attr).in_(chunk))
+                                    .order_by(Dataset.revision.desc()).all()):
+                        found[('d', attr, getattr(dataset, attr))].append((dataset, None))
+
+            for attr, values in p_values.items():
+                for chunk in chunks(values):
+                    for row in (self.session.query(Dataset, Partition).join(Partition)
+                                .filter(getattr(Partition, attr).in_(chunk))
+                                .order_by(Dataset.revision.desc()).all()):
+                        found[('p', attr, getattr(row.Partition, attr))].append((row.Dataset, row.Partition))
+
+            for ref, (ip, dqp, pqp) in pending.items():
+                results = ((found.get(('d',) + dqp, []) if dqp else []) +
+                           (found.get(('p',) + pqp, []) if pqp else []))
+
+                records[ref] = ip, self._to_records(results)
+
+                if self.cache is not None:
+                    self.cache.put(ref, records[ref])
+
+        out = OrderedDict()
+
+        for ref in refs:
+            ip, recs = records[ref]
+            out[ref] = self._best(ip, self._to_identities(recs, location))
+
+        return out
+
     def find(self, query_command):
         '''Find a bundle or partition record by a QueryCommand or Identity
 
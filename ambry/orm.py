@@ -8,7 +8,7 @@ import datetime
 import sqlalchemy
 from sqlalchemy import orm
 from sqlalchemy import event
-from sqlalchemy import Column as SAColumn, Integer, BigInteger, Boolean, UniqueConstraint, ForeignKeyConstraint
+from sqlalchemy import Column as SAColumn, Integer, BigInteger, Boolean, UniqueConstraint, ForeignKeyConstraint, Index
 from sqlalchemy import Float as Real,  Text, String, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import TypeDecorator, TEXT, PickleType
@@ -243,6 +243,10 @@ class Dataset(Base):
         UniqueConstraint('d_vid', 'd_location', name='u_vid_location'),
         UniqueConstraint('d_fqname', 'd_location', name='u_fqname_location'),
         UniqueConstraint('d_cache_key', 'd_location', name='u_cache_location'),
+        # For the Resolver, which looks up datasets by all of these
+        Index('ix_datasets_id', id_),
+        Index('ix_datasets_name', name),
+        Index('ix_datasets_vname', vname),
     )
 
 
@@ -399,6 +403,19 @@ class Column(Base):
         }
 
 
+    # Numpy dtypes for the datatypes, as names to decouple from numpy. The reverse of
+    # convert_numpy_type(). Integers that have nulls are promoted to float64
+    numpy_types = {
+        DATATYPE_INTEGER: 'int64',
+        DATATYPE_INTEGER64: 'int64',
+        DATATYPE_REAL: 'float64',
+        DATATYPE_FLOAT: 'float64',
+        DATATYPE_NUMERIC: 'float64',
+        DATATYPE_DATE: 'datetime64[D]',
+        DATATYPE_TIMESTAMP: 'datetime64[us]',
+        DATATYPE_DATETIME: 'datetime64[us]',
+    }
+
     def type_is_text(self):
         return self.datatype in (Column.DATATYPE_TEXT, Column.DATATYPE_CHAR, Column.DATATYPE_VARCHAR)
 
@@ -430,6 +447,12 @@ class Column(Base):
     def schema_type(self):
         return self.types[self.datatype][2]
 
+    @property
+    def numpy_dtype(self):
+        '''The name of the numpy dtype for the column's datatype. Text, time and binary
+        columns are 'object' '''
+        return self.numpy_types.get(self.datatype, 'object')
+
     @classmethod
     def convert_numpy_type(cls,dtype):
         '''Convert a numpy dtype into a Column datatype. Only handles common types.
@@ -658,6 +681,8 @@ Columns:
     def init_on_load(self):
         self._or_validator = None
         self._and_validator = None
+        self._or_batch_validator = None
+        self._and_batch_validator = None
         self._null_row = None
         self._row_hasher = None
         
@@ -865,39 +890,90 @@ Columns:
 
 
 
+    # Types for which equal values always have equal str() values, so a validator can
+    # compare a value of the same type as the default directly
+    _validator_exact_types = (int, long, str, bool, type(None))
+
+    def _validator_source(self, and_join=True):
+        '''Return the body expression of a validator, as a string, and the environment of
+        precomputed defaults it refers to. A row is valid if the str() value of its mandatory
+        columns differs from the str() of their defaults, for all columns with an AND join,
+        or for any of them with an OR join. '''
+
+        env = {}
+        exprs = []
+
+        for i,col in  enumerate(self.columns):
+
+            if not col.data.get('mandatory', False):
+                continue
+
+            default_value = col.default
+
+            env['d{}'.format(i)] = default_value
+
+            try:
+                env['s{}'.format(i)] = str(default_value)
+            except UnicodeError:
+                # Let str() raise when the validator is called, the way it always has
+                exprs.append("str(row[{i}]) != str(d{i})".format(i=i))
+                continue
+
+            if type(default_value) in self._validator_exact_types:
+                env['t{}'.format(i)] = type(default_value)
+                exprs.append("(row[{i}] != d{i} if row[{i}].__class__ is t{i} else str(row[{i}]) != s{i})"
+                             .format(i=i))
+            else:
+                exprs.append("str(row[{i}]) != s{i}".format(i=i))
+
+        if not exprs:
+            return 'True', env
+
+        return (' and ' if and_join else ' or ').join(exprs), env
+
     def _get_validator(self, and_join=True):
-        '''Return a lambda function that, when given a row to this table, 
-        returns true or false to indicate the validitity of the row
+        '''Return a function that, when given a row to this table, 
+        returns true or false to indicate the validitity of the row. The checks for
+        all of the mandatory columns are compiled into a single expression. 
         
         :param and_join: If true, join multiple column validators with AND, other
         wise, OR
         :type and_join: Bool
         
-        :rtype: a `LibraryDb` object
+        :rtype: a function
     
             
         '''
 
-        f = prior = lambda row : True
-        first = True
-        for i,col in  enumerate(self.columns):
+        expr, env = self._validator_source(and_join)
 
-            if col.data.get('mandatory', False):
-                default_value = col.default
-                index = i
-                
-                if and_join:
-                    f = lambda row, default_value=default_value, index=index, prior=prior: prior(row) and str(row[index]) != str(default_value)
-                elif first:
-                    # OR joins would either need the initial F to be 'false', or just don't use it
-                    f = lambda row, default_value=default_value, index=index:  str(row[index]) != str(default_value)  
-                else:
-                    f = lambda row, default_value=default_value, index=index, prior=prior: prior(row) or str(row[index]) != str(default_value)
-                            
-                prior = f
-                first = False
-            
-        return f
+        exec "def validator(row):\n    return bool({})".format(expr) in env
+
+        return env['validator']
+
+    def _get_batch_validator(self, and_join=True):
+        '''Return a function that validates a list of rows, returning a list of booleans'''
+
+        expr, env = self._validator_source(and_join)
+
+        exec "def batch_validator(rows):\n    return [ bool({}) for row in rows ]".format(expr) in env
+
+        return env['batch_validator']
+
+    def validate_mask(self, rows, and_join=False):
+        '''Validate a chunk of rows, returning a numpy boolean array that is True for
+        the valid rows. Uses an OR join, like validate_or(), unless and_join is True'''
+        import numpy as np
+
+        key = '_and_batch_validator' if and_join else '_or_batch_validator'
+
+        f = getattr(self, key, None)
+
+        if f is None:
+            f = self._get_batch_validator(and_join=and_join)
+            setattr(self, key, f)
+
+        return np.array(f(rows), dtype=bool)
     
     def validate_or(self, values):
 
@@ -913,10 +989,25 @@ Columns:
         
         return self._and_validator(values)
     
-    def _get_hasher(self):
-        '''Return a  function to generate a hash for the row'''
-        import hashlib
- 
+    # Row hash modes, set per table with the 'hash_mode' data value. 'md5' is the original
+    # hash, the first 56 bits of an MD5 digest. 'xxhash' is the first 63 bits of an xxHash64
+    # digest, which requires the xxhash package.
+    HASH_MODES = ('md5', 'xxhash')
+
+    @property
+    def hash_mode(self):
+        from dbexceptions import ConfigurationError
+
+        mode = (self.data or {}).get('hash_mode', 'md5')
+
+        if mode not in self.HASH_MODES:
+            raise ConfigurationError("Unknown hash_mode '{}' for table {}; must be one of {}"
+                                     .format(mode, self.name, self.HASH_MODES))
+
+        return mode
+
+    def _hash_indexes(self):
+
         # Try making the hash set from the columns marked 'hash'
         indexes = [ i for i,c in enumerate(self.columns) if  
                    c.data.get('hash',False) and  not c.is_primary_key  ]
@@ -925,16 +1016,57 @@ Columns:
         if len(indexes) == 0:
             indexes = [ i for i,c in enumerate(self.columns) if not c.is_primary_key ]
 
-        def hasher(values):
-            m = hashlib.md5()
-            for index in indexes: 
-                x = values[index]
-                try:
-                    m.update(x.encode('utf-8')+'|') # '|' is so 1,23,4 and 12,3,4 aren't the same  
-                except:
-                    m.update(str(x)+'|') 
-            return int(m.hexdigest()[:14], 16)
-        
+        return indexes
+
+    def _get_row_string(self):
+        '''Return a function that joins the hashed values of a row into a string. Unicode
+        values are encoded as utf-8, and other values are converted with str(). Each value
+        is followed by a '|' so 1,23,4 and 12,3,4 aren't the same '''
+
+        from operator import itemgetter
+
+        indexes = self._hash_indexes()
+
+        if len(indexes) == 0:
+            return lambda values: ''
+        elif len(indexes) == 1:
+            index = indexes[0]
+            getter = lambda values: (values[index],)
+        else:
+            getter = itemgetter(*indexes)
+
+        def row_string(values):
+            return '|'.join([ x.encode('utf-8') if isinstance(x, unicode) else str(x) 
+                              for x in getter(values) ]) + '|'
+
+        return row_string
+
+    def _get_hasher(self):
+        '''Return a  function to generate a hash for the row'''
+        import hashlib
+        import struct
+        from dbexceptions import DependencyError
+
+        row_string = self._get_row_string()
+
+        if self.hash_mode == 'xxhash':
+            try:
+                from xxhash import xxh64
+            except ImportError:
+                raise DependencyError("The xxhash hash_mode for table {} requires the xxhash package"
+                                      .format(self.name))
+
+            def hasher(values):
+                return xxh64(row_string(values)).intdigest() & 0x7fffffffffffffff
+
+        else:
+            # The integer value of the first 14 hex digits of the MD5 digest
+            unpack = struct.Struct('>Q').unpack
+            md5 = hashlib.md5
+
+            def hasher(values):
+                return unpack('\0'+md5(row_string(values)).digest()[:7])[0]
+
         return hasher
     
     def row_hash(self, values):
@@ -944,6 +1076,15 @@ Columns:
             self._row_hasher = self._get_hasher()
             
         return self._row_hasher(values)
+
+    def row_hashes(self, rows):
+        '''Calculate the hashes for a list of rows. Returns the same values as row_hash(), as a
+        list, without the per-row method call. '''
+
+        if self._row_hasher is None:
+            self._row_hasher = self._get_hasher()
+
+        return map(self._row_hasher, rows)
          
     @property
     def caster(self):
@@ -1071,7 +1212,11 @@ class Partition(Base):
 
     __table_args__ = (
         ForeignKeyConstraint( [d_vid, d_location], ['datasets.d_vid','datasets.d_location']),
-        UniqueConstraint('p_sequence_id', 'p_t_vid', name='_uc_partitions_1'))
+        UniqueConstraint('p_sequence_id', 'p_t_vid', name='_uc_partitions_1'),
+        # For the Resolver. The vname and cache_key are already unique, so they are indexed
+        Index('ix_partitions_id', id_),
+        Index('ix_partitions_name', name),
+        Index('ix_partitions_d_vid', d_vid))
 
     table = relationship('Table', backref='partitions', lazy='subquery')
     # Already have a 'partitions' replationship on Dataset
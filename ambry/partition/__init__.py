@@ -313,6 +313,14 @@ class PartitionBase(PartitionInterface):
 
         return Dbm(self.bundle, base_path=self.path, suffix=suffix)
 
+    def hash_index(self, suffix=None):
+        """Return a HashIndex, a sorted array translation of row hashes to primary keys,
+        related to this partition"""
+
+        from ..database.hashindex import HashIndex
+
+        return HashIndex(self.bundle, base_path=self.path, suffix=suffix)
+
     @classmethod
     def format_name(cls):
         return cls._id_class._name_class.FORMAT
@@ -14,6 +14,67 @@ class SqlitePartitionName(PartitionName):
 class SqlitePartitionIdentity(PartitionIdentity):
     _name_class = SqlitePartitionName
 
+def _csv_segment_bounds(path, table_name, pk, rows_per_seg):
+    '''Scan the primary key of a table and return a list of (min_key, max_key, count)
+    for segments of rows_per_seg rows'''
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+
+    try:
+        bounds = []
+        min_key = max_key = None
+        count = 0
+
+        for (key,) in conn.execute('SELECT "{0}" FROM "{1}" ORDER BY "{0}"'.format(pk, table_name)):
+            if count == rows_per_seg:
+                bounds.append((min_key, max_key, count))
+                count = 0
+
+            if count == 0:
+                min_key = key
+
+            max_key = key
+            count += 1
+
+        if count:
+            bounds.append((min_key, max_key, count))
+
+        return bounds
+
+    finally:
+        conn.close()
+
+def _write_csv_segment(args):
+    '''Write the rows in a range of primary keys to a CSV file. Runs in a pool worker
+    for SqlitePartition.csvize()'''
+    import sqlite3
+    from ..database.csv import ValueInserter
+
+    (i, db_path, table_name, pk, min_key, max_key, csv_path, header, write_header,
+     compression, compression_level) = args
+
+    # Convert the declared types like the partition's engine does, so dates are written the
+    # same way as they are when the rows are read through SqlAlchemy
+    conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+
+    try:
+        ins = ValueInserter(csv_path, None, None, header=header, write_header=write_header,
+                            compression=compression, compression_level=compression_level)
+
+        count = 0
+        for row in conn.execute('SELECT * FROM "{1}" WHERE "{0}" >= ? AND "{0}" <= ? ORDER BY "{0}"'
+                                        .format(pk, table_name), (min_key, max_key)):
+            ins.insert(row)
+            count += 1
+
+        ins.close()
+
+    finally:
+        conn.close()
+
+    return i, count
+
 class SqlitePartition(PartitionBase):
     '''Represents a bundle partition, part of the bundle data broken out in
     time, space, or by table. '''
@@ -159,79 +220,85 @@ class SqlitePartition(PartitionBase):
         return rows_per_seg
         
 
-    def csvize(self, logger=None, store_library=False, write_header=False, rows_per_seg=None):
-        '''Convert this partition to CSV files that are linked to the partition'''
-        
-        self.table = self.get_table()
-        
+    def csvize(self, logger=None, store_library=False, write_header=False, rows_per_seg=None, n=1,
+               compression=None, compression_level=None):
+        '''Convert this partition to CSV files that are linked to the partition. The segment
+        boundaries are computed from the primary key, then each segment is written with its own
+        range query. With n greater than 1, the segments are written on a pool of n processes,
+        and stored to the library as they are finished, while the others are still being
+        written. The segments are compressed with the compression codec, which defaults to the
+        build.csv_compression config. '''
+        from multiprocessing import Pool
+        from itertools import imap
+
+        table = self.get_table()
+
         if self.record_count:
             self.write_stats()
 
         if not rows_per_seg:
             rows_per_seg = self.optimal_rows_per_segment()
-  
-        
+
         if logger:
             logger.always("Csvize: {} rows per segment".format(rows_per_seg))
-        
-        ins  =  None
-        p = None
-        seg = 0
-        ident = None
-        count = 0
-        min_key = max_key = None
 
-        pk = self.table.primary_key.name
+        pk = table.primary_key.name
+        header = [c.name for c in table.columns]
 
-        def _store_library(p):
-            if store_library:
-                if logger:
-                    logger.always("Storing {} to Library".format(p.identity.name), now=True)
-                    
-                dst, _,_ = self.bundle.library.put(p)
-                p.database.delete()
-                
-                if logger:
-                    logger.always("Stored at {}".format(dst), now=True)            
+        bounds = _csv_segment_bounds(self.database.path, table.name, pk, int(rows_per_seg))
+
+        # The CSV partitions are created here, since the workers can't write to the bundle
+        parts = []
+        for seg, (min_key, max_key, count) in enumerate(bounds, 1):
+            ident = self.identity
+            ident.segment = seg
 
-        for i,row in enumerate(self.rows):
+            p = self.bundle.partitions.find_or_new_csv(**vars(ident.name.as_partialname()))
+            p.write_stats(min_key, max_key, count)
+            parts.append(p)
 
-            if not min_key:
-                min_key = row[pk]
+            if logger:
+                logger.always("New CSV Segment: {}".format(p.identity.name), now=True)
 
-            if i % rows_per_seg == 0:
-                      
-                if p: # Don't do it on the first record. 
-                    p.write_stats(min_key, max_key, count)
-                    count = 0
-                    min_key = row[pk]
-                    ins.close()
+        if parts and not compression:
+            compression = parts[0].database.compression
+            compression_level = compression_level or parts[0].database.compression_level
 
-                    _store_library(p)
+        tasks = [ (i, self.database.path, table.name, pk, min_key, max_key,
+                   p.database.path, header, write_header, compression, compression_level)
+                  for i, (p, (min_key, max_key, _)) in enumerate(zip(parts, bounds)) ]
 
-                seg += 1
-                ident = self.identity
-                ident.segment = seg
+        pool = Pool(min(n, len(tasks))) if n and n > 1 and len(tasks) > 1 else None
 
-                p = self.bundle.partitions.find_or_new_csv(**vars(ident.name.as_partialname()))
+        try:
+            results = pool.imap_unordered(_write_csv_segment, tasks) if pool else imap(_write_csv_segment, tasks)
 
-                ins = p.inserter( write_header=write_header)
+            for i, count in results:
+                p = parts[i]
 
                 if logger:
-                    logger.always("New CSV Segment: {}".format(p.identity.name), now=True)
-                
-            count += 1
-            ins.insert(dict(row))
-            max_key = row[pk]
-       
-            if logger:
-                logger("CSVing for {}".format(ident.name))
+                    logger.always("Wrote {} rows to CSV Segment: {}".format(count, p.identity.name), now=True)
 
-        # make sure we get the last partition
-        if p:
-            p.write_stats(min_key, max_key, count)
-            ins.close()
-            _store_library(p)
+                if store_library:
+                    if logger:
+                        logger.always("Storing {} to Library".format(p.identity.name), now=True)
+
+                    dst, _,_ = self.bundle.library.put(p)
+                    p.database.delete()
+
+                    if logger:
+                        logger.always("Stored at {}".format(dst), now=True)
+
+            if pool:
+                pool.close()
+                pool.join()
+
+        except:
+            if pool:
+                pool.terminate()
+            raise
+
+        return parts
 
     def get_csv_parts(self):
         from ..identity import PartitionNameQuery
@@ -241,9 +308,10 @@ class SqlitePartition(PartitionBase):
 
         return self.bundle.partitions.find_all(PartitionNameQuery(id_=ident))
 
-    def load_csv(self, table=None, parts=None):
+    def load_csv(self, table=None, parts=None, n=1):
         '''Loads the database from a collection of CSV files that have the same identity, 
-        except for a format of 'csv' and possible segments. '''
+        except for a format of 'csv' and possible segments. With n > 1, the segments are
+        loaded on a pool of n processes and merged in order. '''
 
         if not parts:
             parts = self.get_csv_parts()
@@ -255,11 +323,19 @@ class SqlitePartition(PartitionBase):
       
         if table is None:
             table = self.table
-      
-        for p in parts:
-            self.bundle.log("Loading CSV partition: {}".format(p.identity.vname))
-            self.database.load(p.database, table, logger=lr )
-        
+
+        if n != 1 and len(parts) > 1:
+            self.bundle.log("Loading {} CSV partitions for: {}".format(len(parts), self.identity.vname))
+            count, diff = self.database.load_many([p.database for p in parts], table, n=n, logger=lr)
+        else:
+            count, diff = 0, 0
+            for p in parts:
+                self.bundle.log("Loading CSV partition: {}".format(p.identity.vname))
+                c, d = self.database.load(p.database, table, logger=lr )
+                count += c
+                diff += d
+
+        self.bundle.log("Loaded {} rows in {:.1f}s ({:.0f} rows/s)".format(count, diff, count / diff if diff else 0))
 
     @property
     def rows(self):
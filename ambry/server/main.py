@@ -14,6 +14,7 @@ import ambry.util
 
 import logging
 import os
+import types
 
 import ambry.client.exceptions as exc
 
@@ -134,6 +135,9 @@ class AllJSONPlugin(object):
             if isinstance(rv, basestring ):
                 return rv
 
+            if isinstance(rv, types.GeneratorType):
+                return rv # Streaming responses
+
             #Attempt to serialize, raises exception on failure
             try:
                 json_response = dumps(rv)
@@ -231,26 +235,74 @@ def _get_ct(typ):
 
     return ct
 
+@ambry.util.lru_cache(maxsize=1024, maxtime=None)
+def _table_count(path, mtime, table_name):
+    '''Return the number of rows in a table of a partition database. The mtime of the
+    database file is part of the cache key, so the count is recomputed if the file changes'''
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+
+    try:
+        return conn.execute('SELECT count(*) FROM "{}"'.format(table_name)).fetchone()[0]
+    finally:
+        conn.close()
+
+@ambry.util.lru_cache(maxsize=1024, maxtime=None)
+def _table_segments(path, mtime, table_name, pk_name, n):
+    '''Return the (min, max) primary key range of each of n segments of a table, or None for
+    empty segments. All segments have count/n rows, except the last, which also has the
+    remainder. The ranges are found with one pass over the primary key index. The keys are
+    the stored values, without type conversion, so they compare exactly in the segment query. '''
+    import sqlite3
+    from collections import deque
+    from itertools import islice
+
+    count = _table_count(path, mtime, table_name)
+
+    base_seg_size, rem = divmod(count, n)
+
+    conn = sqlite3.connect(path)
+
+    try:
+        keys = conn.execute('SELECT "{0}" FROM "{1}" ORDER BY "{0}"'.format(pk_name, table_name))
+
+        segments = []
+
+        for i in range(1, n+1):
+            seg_size = base_seg_size + rem if i == n else base_seg_size
+
+            if seg_size == 0:
+                segments.append(None)
+                continue
+
+            first = keys.fetchone()[0]
+            last = deque(islice(keys, seg_size - 1), maxlen=1)
+
+            segments.append((first, last[0][0] if last else first))
+
+        return segments
+
+    finally:
+        conn.close()
+
+def _partition_table_count(p, table):
+    path = p.database.path
+    return _table_count(path, os.path.getmtime(path), table.name)
+
 def _table_csv_parts(library,b,pid,table=None):
     # This partition does not have CSV parts, so we'll have to make them.
     parts = []
 
     TARGET_ROW_COUNT = 50000
 
-    # For large partitions, this could be really slow, and
-    # can cause the server to run out of disk space.
     p = library.get(pid).partition
 
     if not table:
         table = p.table # Use the default table
 
-
-    count = p.query("SELECT count(*) FROM {}".format(table.name)).fetchone()
-
-    if count:
-        count = count[0]
-    else:
-        raise exc.BadRequest("Failed to get count of number of rows")
+    # The count is cached, so this is cheap after the first request.
+    count = _partition_table_count(p, table)
 
     part_count, rem = divmod(count, TARGET_ROW_COUNT)
 
@@ -344,15 +396,11 @@ def _send_csv_if(did, pid, table, library):
     return _send_csv(library, did, pid, table, i, n, where, sep)
 
 def _send_csv(library, did, pid, table, i, n, where, sep=',' ):
-    '''Send a CSV file to the client. '''
-    import unicodecsv
-    import csv
-    from StringIO import StringIO
-    from sqlalchemy import text
+    '''Send a CSV file to the client, as a stream. Without a where clause, the segment is
+    selected by a range of the primary key, otherwise with LIMIT and OFFSET'''
 
     p = library.get(pid).partition # p_orm is a database entry, not a partition
 
-
     if not table:
         table = p.table
 
@@ -362,44 +410,105 @@ def _send_csv(library, did, pid, table, i, n, where, sep=',' ):
     if i < 1:
         raise exc.BadRequest("Segment number starts at 1")
 
+    path = p.database.path
+    mtime = os.path.getmtime(path)
 
-    count = p.query("SELECT count(*) FROM {}".format(table.name)).fetchone()
+    pks = [ c.name for c in table.columns if c.is_primary_key ]
 
-    if count:
-        count = count[0]
-    else:
-        raise exc.BadRequest("Failed to get count of number of rows")
+    if not where and len(pks) == 1:
+
+        segment = _table_segments(path, mtime, table.name, pks[0], n)[i-1]
 
-    base_seg_size, rem = divmod(count, int(n))
+        if segment:
+            q = 'SELECT * FROM "{0}" WHERE "{1}" >= :min_pk AND "{1}" <= :max_pk ORDER BY "{1}"'.format(table.name, pks[0])
+            params = dict(min_pk = segment[0], max_pk = segment[1])
+        else:
+            q = None
+            params = {}
 
-    if i == n:
-        seg_size = base_seg_size + rem
     else:
-        seg_size = base_seg_size
+        count = _table_count(path, mtime, table.name)
 
-    out = StringIO()
-    #writer = unicodecsv.writer(out, delimiter=sep, escapechar='\\',quoting=csv.QUOTE_NONNUMERIC)
-    writer = unicodecsv.writer(out, delimiter=sep)
+        base_seg_size, rem = divmod(count, int(n))
 
-    if request.query.header:
-        writer.writerow(tuple([c.name for c in p.table.columns]))
+        if i == n:
+            seg_size = base_seg_size + rem
+        else:
+            seg_size = base_seg_size
 
-    if where:
-        q = "SELECT * FROM {} WHERE {} LIMIT {} OFFSET {} ".format(table.name, where, seg_size, base_seg_size*(i-1))
+        if where:
+            q = "SELECT * FROM {} WHERE {} LIMIT {} OFFSET {} ".format(table.name, where, seg_size, base_seg_size*(i-1))
+            params = dict(request.query.items())
+        else:
+            q = "SELECT * FROM {} LIMIT {} OFFSET {} ".format(table.name, seg_size, base_seg_size*(i-1))
+            params = {}
 
-        params = dict(request.query.items())
-    else:
-        q = "SELECT * FROM {} LIMIT {} OFFSET {} ".format(table.name, seg_size, base_seg_size*(i-1))
-        params = {}
+    header = [c.name for c in table.columns] if request.query.header else None
 
-    for row in p.query(text(q), params):
-        writer.writerow(tuple(row))
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
 
     response.content_type = 'text/csv'
 
     response.headers["content-disposition"] = "attachment; filename='{}-{}-{}-{}.csv'".format(p.identity.vname,table.name,i,n)
 
-    return out.getvalue()
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+
+    return _stream_csv(path, q, params, header, sep, compress)
+
+def _stream_csv(path, q, params, header, sep, compress, chunk_rows=5000):
+    '''Generate the CSV for a query, in chunks of rows, optionally gzip compressed. This uses its
+    own database connection, since the library is closed when the request handler returns. '''
+    import sqlite3
+    import unicodecsv
+    import zlib
+    from StringIO import StringIO
+
+    out = StringIO()
+    writer = unicodecsv.writer(out, delimiter=sep)
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16+zlib.MAX_WBITS) if compress else None
+
+    def flush():
+        data = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return compressor.compress(data) if compressor else data
+
+    if header:
+        writer.writerow(tuple(header))
+
+    # Convert the declared types like the partition's engine does, so dates are written the
+    # same way as they were when the CSV was made through SqlAlchemy
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+
+    try:
+        if q:
+            cursor = conn.execute(q, params)
+
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+
+                if not rows:
+                    break
+
+                writer.writerows(rows)
+
+                data = flush()
+
+                if data:
+                    yield data
+
+        data = flush()
+
+        if compressor:
+            data += compressor.flush()
+
+        if data:
+            yield data
+
+    finally:
+        conn.close()
 
 
 @get('/')
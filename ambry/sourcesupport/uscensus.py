@@ -11,11 +11,65 @@ import os.path
 import yaml
 
 
+class TempfileWriters(object):
+    '''CSV writers for the per-state tempfiles, with at most max_open files open at once.
+    A state writes to one tempfile per geo dim or fact table, so when the limit is reached
+    the least recently used file is closed, and re-opened for appending on its next write. '''
+
+    def __init__(self, max_open=64):
+        from collections import OrderedDict
+
+        self.max_open = max_open
+        self._open = OrderedDict() # path -> (file, writer), oldest first
+        self._created = set()
+        self.reopens = 0
+
+    def writer(self, path, header=None):
+        '''Return the writer for path. The first open truncates the file and writes the header'''
+        import csv
+
+        try:
+            f, w = self._open.pop(path)
+        except KeyError:
+            while len(self._open) >= self.max_open:
+                self._open.popitem(last=False)[1][0].close()
+
+            if path in self._created:
+                self.reopens += 1
+                f = open(path, 'ab')
+                w = csv.writer(f)
+            else:
+                f = open(path, 'wb')
+                w = csv.writer(f)
+                self._created.add(path)
+
+                if header:
+                    w.writerow(header)
+
+        self._open[path] = (f, w)
+
+        return w
+
+    def writerow(self, path, row, header=None):
+        self.writer(path, header).writerow(row)
+
+    def close(self):
+        '''Close all of the open files. Later writes to a path append to it'''
+        while self._open:
+            self._open.popitem(last=False)[1][0].close()
+
+
 class UsCensusBundle(BuildBundle):
     '''
     Bundle code for US 2000 Census, Summary File 1
     '''
 
+    # Maximum number of tempfiles each build process keeps open while splitting a state
+    max_open_files = 64
+
+    # Number of geo rows that run_geo_dim hashes at once, for each geo dim table
+    geo_batch_size = 10000
+
     def __init__(self,directory=None):
         self.super_ = super(UsCensusBundle, self)
         self.super_.__init__(directory)
@@ -48,7 +102,16 @@ class UsCensusBundle(BuildBundle):
     
         self._geo_dim_locks = {} 
 
+        self._writers = None
+
     
+    @property
+    def writers(self):
+        '''The bounded set of tempfile writers for this process'''
+        if self._writers is None:
+            self._writers = TempfileWriters(self.max_open_files)
+        return self._writers
+
     def configure_arg_parser(self, argv):
     
         def csv(value):
@@ -76,6 +139,21 @@ class UsCensusBundle(BuildBundle):
             
         return self.urls
 
+    def prefetch_urls(self):
+        '''Prefetch the geo and segment table files for all of the states in the urls file'''
+
+        urls_file = getattr(self, 'urls_file', None)
+
+        if not urls_file or not os.path.exists(urls_file):
+            return []
+
+        urls = list(self.urls['geos'].values())
+
+        for state_tables in self.urls.get('tables', {}).values():
+            urls.extend(state_tables.values())
+
+        return urls
+
     #############################################
     # Generate rows from multiple files?
 
@@ -102,6 +180,10 @@ class UsCensusBundle(BuildBundle):
             if self.run_args.test:
                 x = self._urls_cache['geos'].iteritems().next()
                 self._urls_cache['geos'] = dict([x])
+
+                if 'tables' in self._urls_cache:
+                    self._urls_cache['tables'] = dict((state, tables)
+                        for state, tables in self._urls_cache['tables'].items() if state == x[0])
  
         return self._urls_cache
       
@@ -254,6 +336,10 @@ class UsCensusDimBundle(UsCensusBundle):
           
                 result = pool.map_async(run_geo_dim_f, enumerate(self.urls['geos'].keys()))
                 print result.get()
+            elif self.run_args.multi:
+                # Each state is split in its own process. The tasks only write to the
+                # tempfiles for their state, so no writer limit is needed.
+                self.run_mp(self.run_geo_dim, self.states)
             else:
                 for state in self.states:
                     self.run_geo_dim(state)
@@ -397,112 +483,177 @@ class UsCensusDimBundle(UsCensusBundle):
                 pass
 
 
-        # Iterate over all of the geo rows for this state. 
-        for geo in self.build_generate_rows(state): #@UnusedVariable
-         
-            if row_i == 0: # HEre b/c opening the files in build_generate_rows is slow. 
-                self.log("Starting loop for state: "+state+' ')
-                t_start = time.time()
-            row_i += 1
-            
-            if row_i % 10000 == 0:
-                # Prints the processing rate in 1,000 records per sec.
-                self.log("GEO "+state+" "+str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
+        record_code_header = [c.name for c in record_code_partition.table.columns]
 
-            geo['abbrev'] = state
+        def split(geos):
+            '''Write the geo dim rows and the record_code rows for a batch of geo rows. The rows
+            for each geo dim table are hashed together'''
 
-            # Iterate over all of the geo dimension tables, taking part of this
+            hash_keys = [ [] for geo in geos ]
+
+            # Iterate over all of the geo dimension tables, taking part of each
             # geo row and putting it into the temp file for that geo dim table. 
-      
-            hash_keys = []
             for table_id, cp in geo_processors.items():
 
                 table,  columns, processors = cp #@UnusedVariable
             
                 partition = geo_partitions[table_id]
+                tf = partition.tempfile( suffix=state)
+                header = [c.name for c in table.columns]
+                th = row_hash_map[table.id_]
 
-                # Extract a subset form the geo row for this geo dim table. 
-                values = [ f(geo) for f in processors ]
-                         
-                # If the row does not have all of the required fields, 
-                # map it to the empyt row
-                if not table.validate_or(values):
-                    # Substitute the empty row
-                    values = copy.copy( table.null_row)
+                rows = []
 
+                for geo in geos:
+                    # Extract a subset form the geo row for this geo dim table. 
+                    values = [ f(geo) for f in processors ]
+                         
+                    # If the row does not have all of the required fields, 
+                    # map it to the empyt row
+                    if not table.validate_or(values):
+                        # Substitute the empty row
+                        values = copy.copy( table.null_row)
 
+                    rows.append(values)
 
-                row_hash = table.row_hash(values)
-                th = row_hash_map[table.id_]
+                for keys, values, row_hash in zip(hash_keys, rows, table.row_hashes(rows)):
              
-                # The local row_hash check reduces the number of calls to writerow, but
-                # since we are operating on states independently, it does not
-                # guarantee uniqueness across states. 
-                if row_hash not in th:  
-                    th.add(row_hash)
-                    
-                    values[-1] = row_hash
+                    # The local row_hash check reduces the number of calls to writerow, but
+                    # since we are operating on states independently, it does not
+                    # guarantee uniqueness across states. 
+                    if row_hash not in th:  
+                        th.add(row_hash)
                     
-                    tf = partition.tempfile( suffix=state)
+                        values[-1] = row_hash
 
-                    tf.writer.writerow(values)
+                        self.writers.writerow(tf.path, values, header)
 
-                hash_keys.append(row_hash)
+                    keys.append(row_hash)
 
             # The first None is for the primary id, the last is for the 
             # row_hash, which was added automatically to geo_dim tables.           
             # The fileid comes from the bundle.yaml configuration b/c it is the same for all records
             # in the bundle. 
-         
-            values = [None, int(geo['logrecno']),int(geo['sumlev']),int(geo['geocomp'])]  + hash_keys
             tf = record_code_partition.tempfile(suffix=state)
-            tf.writer.writerow(values)
+
+            for geo, keys in zip(geos, hash_keys):
+                values = [None, int(geo['logrecno']),int(geo['sumlev']),int(geo['geocomp'])]  + keys
+                self.writers.writerow(tf.path, values, record_code_header)
+
+        geos = []
+
+        # Iterate over all of the geo rows for this state. 
+        for geo in self.build_generate_rows(state): #@UnusedVariable
+         
+            if row_i == 0: # HEre b/c opening the files in build_generate_rows is slow. 
+                self.log("Starting loop for state: "+state+' ')
+                t_start = time.time()
+            row_i += 1
+            
+            if row_i % 10000 == 0:
+                # Prints the processing rate in 1,000 records per sec.
+                self.log("GEO "+state+" "+str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
+
+            geo['abbrev'] = state
+
+            geos.append(geo)
+
+            if len(geos) >= self.geo_batch_size:
+                split(geos)
+                geos = []
+
+        split(geos)
 
         # Close all of the tempfiles. 
-        for table_id, cp in geo_processors.items():
-            partition = geo_partitions[table_id]
-            partition.database.tempfile(partition.table, suffix=state).close()
- 
-        record_code_partition.database.tempfile(record_code_partition.table, suffix=state).close()  
+        self.writers.close()
+
+        # Save the hashes for the state, for merge_state_hashes to combine after all of
+        # the states are split.
+        self.save_state_hashes(state, { geo_processors[table_id][0].name: th
+                                        for table_id, th in row_hash_map.items() })
             
         with open(marker_f, 'w') as f:
             f.write(str(time.time()))
 
-    def rebuild_hash_translations(self):
-        '''Rebuild the DBM files that link the hash values to primary keys
+    def state_hashes_path(self, state):
+        return self.filesystem.build_path('hashes', "geo_dim_"+state+".pkl")
+
+    def save_state_hashes(self, state, hashes):
+        '''Save the row hashes for the geo dim rows of one state, a dict of
+        table name to set of hashes. '''
+        import cPickle
+
+        with open(self.state_hashes_path(state), 'wb') as f:
+            cPickle.dump(hashes, f, cPickle.HIGHEST_PROTOCOL)
+
+    def merge_state_hashes(self, table_name):
+        '''Merge the per-state row hashes for a geo dim table. The states are
+        split independently, so the same row can be written by several states; the merged
+        set holds each hash once, and is the number of rows that load_geo_dim should
+        produce for the table. Returns None if any state has no saved hashes. '''
+        import cPickle
+
+        merged = set()
+        total = 0
+
+        for state in self.states:
+            path = self.state_hashes_path(state)
+
+            if not os.path.exists(path):
+                return None
+
+            with open(path, 'rb') as f:
+                hashes = cPickle.load(f).get(table_name, set())
+
+            total += len(hashes)
+            merged.update(hashes)
+
+        self.log("Merged hashes for {}: {} unique of {} state rows, {} duplicated across states"
+                 .format(table_name, len(merged), total, total - len(merged)))
+
+        return merged
+
+    def rebuild_hash_translations(self, chunk_size=100000):
+        '''Rebuild the hash indexes that link the hash values to primary keys
         '''
         import time
-        import struct
         t_start = time.time()
         row_i = 0
         for partition in  self.geo_partition_map().values(): 
             
-            # Get a handle on the dmb database that translated hash values to 
-            # primary keeys
-            partition.database.dbm(partition.table).delete()
-            dbm = partition.database.dbm(partition.table).writer
-            
-            for row in partition.database.session.execute("SELECT * FROM {}".format(partition.table.name)):
-                row_i += 1
+            # Get a handle on the index that translates hash values to 
+            # primary keys
+            index = partition.hash_index()
+            index.delete()
+            index = index.writer
 
-                if not row['hash']:
-                    print partition.table.name, row
-                    continue
+            r = partition.database.session.execute("SELECT {}, hash FROM {} WHERE hash IS NOT NULL"
+                                                   .format(partition.table.columns[0].name, partition.table.name))
 
-                dbm[str(row['hash'])] = str(row[0])
-                if row_i % 1000 == 0:
-                    self.log("Rehash "+partition.table.name+" "+
-                             str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
+            while True:
+                rows = r.fetchmany(chunk_size)
+
+                if not rows:
+                    break
+
+                row_i += len(rows)
+
+                index.write([ row[1] for row in rows ], [ row[0] for row in rows ])
+
+                self.log("Rehash "+partition.table.name+" "+
+                         str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
                     
-            dbm.close()
+            index.close()
 
-    def reindex_record_code(self):
+    def reindex_record_code(self, chunk_size=50000):
         '''Translate the hash values in the foreign keys point to the geo dim tables
         with the primary keys for the corresponding records.
         
-        After translating the rows, inserts the row into the main database. 
+        After translating the rows, inserts the row into the main database. The rows are
+        translated in chunks, one searchsorted() lookup per geo dim column per chunk. 
         '''
         import time
+        import numpy as np
         rcp = self.get_record_code_partition()
 
         translators = []
@@ -514,14 +665,13 @@ class UsCensusDimBundle(UsCensusBundle):
                 self.error("MISSING PARTITION! for table: "+name)
                 continue
 
-            # Get a handle on the dmb database that translated hash values to 
-            # primary keeys
+            # Get a handle on the index that translates hash values to 
+            # primary keys
          
             try:
-                dbm = partition.database.dbm(partition.table).reader      
-                translators.append(dbm)
+                translators.append(partition.hash_index().reader)
             except: 
-                self.error("Failed to get DBM file for partition {}".format(partition.identity.name))
+                self.error("Failed to get hash index for partition {}".format(partition.identity.name))
 
         row_i = 0
      
@@ -534,24 +684,37 @@ class UsCensusDimBundle(UsCensusBundle):
         with self.database.inserter(rcp.table) as ins:
             try:
                 self.log("Getting record_code rows from "+rcp.database.path)
-                for row in rcp.database.session.execute("SELECT * FROM record_code"):
-                    
+
+                r = rcp.database.session.execute("SELECT * FROM record_code")
+
+                t_start = time.time() # Here b/c query take a long time, so low reported rate at start. 
+
+                while True:
+                    rows = r.fetchmany(chunk_size)
+
+                    if not rows:
+                        break
+
                     if row_i == 0:
-                        t_start = time.time() # Here b/c query take a long time, so low reported rate at start. 
-                    
-                    row_i += 1
-                
-                    new_row = list(row[0:4]) + [ int(translators[i][str(v)]) for i,v in enumerate(row[4: ])]
-        
-                    ins.insert(new_row)
-        
-                    if row_i % 10000 == 0:
-                           
-                            self.log("Reindex record_code "+
-                                     str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
+                        t_start = time.time()
+
+                    row_i += len(rows)
+
+                    hashes = np.array([ row[4:] for row in rows ], dtype=object)
+
+                    pks = np.column_stack([ t.lookup(hashes[:, i]) for i, t in enumerate(translators) ])
+
+                    for row, keys in zip(rows, pks.tolist()):
+                        ins.insert(list(row[0:4]) + keys)
+
+                    self.log("Reindex record_code "+
+                             str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
             except Exception as e:
                 self.error("Reindex error for table {} : {} ".format(rcp.table.name, str(e)))
              
+        for t in translators:
+            t.close()
+
         self.database.session.commit()   
 
     def join_partitions(self):
@@ -584,7 +747,7 @@ class UsCensusDimBundle(UsCensusBundle):
         recno.
         
         The output is one database partition for each of the geodim table, and
-        one dbm file for each geodim that maps hash to primary key. 
+        one hash index for each geodim that maps hash to primary key. 
         """
         import time
 
@@ -613,8 +776,9 @@ class UsCensusDimBundle(UsCensusBundle):
         row_i = 0
         primary_key = 0
 
-        partition.database.dbm(partition.table).delete()
-        dbm = partition.database.dbm(partition.table).writer
+        index = partition.hash_index()
+        index.delete()
+        index = index.writer
         
         with partition.database.inserter(partition.table) as ins:
             try:
@@ -650,14 +814,14 @@ class UsCensusDimBundle(UsCensusBundle):
                             ins.insert(row) # Insert into the partition database. 
                        
                             hash_set.add(row[-1])
-                            dbm[row[-1]] = primary_key # Map the hash to the pkey, to update record_code later. 
+                            index[row[-1]] = primary_key # Map the hash to the pkey, to update record_code later. 
                             
                     tf.close()     
             except Exception as e:
                 self.error("Error: "+str(e))
                 raise
 
-            dbm.close()
+            index.close()
 
         self.log("Hash "+table_name+" "+str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
                     
@@ -665,6 +829,13 @@ class UsCensusDimBundle(UsCensusBundle):
             self.error("{}: hash map doesn't match number of input rows: {} != {}"
                        .format(partition.table.name, len(hash_set), row_i))
 
+        if not force:
+            merged = self.merge_state_hashes(table_name)
+
+            if merged is not None and len(merged) != len(hash_set):
+                self.error("{}: loaded rows don't match the merged state hashes: {} != {}"
+                           .format(table_name, len(hash_set), len(merged)))
+
         with open(marker_f, 'w') as f:
             f.write(str(time.time()))
 
@@ -989,6 +1160,8 @@ class UsCensusFactBundle(UsCensusBundle):
           
                 result = pool.map_async(run_state_tables_f, enumerate(self.urls['geos'].keys()))
                 print result.get()
+            elif self.run_args.multi:
+                self.run_mp(self.build_run_state_tables, self.states)
             else:
                 for state in self.states:
                     self.log("Building fact tables for {}".format(state))
@@ -1130,21 +1303,16 @@ class UsCensusFactBundle(UsCensusBundle):
                             print "Values : ",len(values), values
                             print "Range  : ",seg_number, range
                         
-                        tf.writer.writerow(values)
+                        self.writers.writerow(tf.path, values, tf.header)
                     
                     else:
                         self.log("{} {} Seg {}, table {}  is empty".format(state, logrecno,  seg_number, table_id))
 
-        #
-        # Write the values to tempfiles. 
-        # 
+        # Close the tempfiles. There are more fact tables than max_open_files, so
+        # most of them were closed and re-opened while the state was written. 
+        self.writers.close()
 
-        for table_id, partition in fact_partitions.items():
-            
-            table = self.get_table_by_table_id(table_id)
-            tf = partition.database.tempfile(table, suffix=state)
-                            
-            tf.close()
+        self.log("Fact tables for {} done; {} tempfile reopens".format(state, self.writers.reopens))
 
         with open(marker_f, 'w') as f:
             f.write(str(time.time()))
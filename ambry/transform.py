@@ -352,6 +352,59 @@ def parse_datetime(name, v):
     else:
         raise CastingError(name, v, "Expected datetime.datetime or basestring, got {{}}".format(type(v)))
 
+def vector_cast(type_, values):
+    '''Cast a whole column of values to int, float or datetime.date with NumPy. Returns a list
+    of cast values, with None for None, or None if the column can't be cast as a whole and must
+    be cast value by value. '''
+    import datetime
+
+    if type_ not in (int, float, datetime.date) or len(values) == 0:
+        return None
+
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+
+    if type_ == datetime.date:
+        # NumPy only parses ISO dates, and also accepts words like 'today', so anything
+        # else is left to dateutil
+        if not all(v is None or (isinstance(v, basestring) and len(v) == 10) for v in values):
+            return None
+
+        try:
+            a = np.array(values, dtype='datetime64[D]')
+        except (ValueError, TypeError):
+            return None
+
+        return a.tolist() if a.ndim == 1 else None
+
+    try:
+        o = np.empty(len(values), dtype=object)
+        o[:] = values
+        nulls = np.equal(o, None)
+        o[nulls] = np.nan
+        a = o.astype(np.float64)
+    except (ValueError, TypeError):
+        return None
+
+    if type_ == int:
+        a[nulls] = 0
+
+        # Leave overflows to parse_int, which will report them
+        if not np.isfinite(a).all() or np.abs(a).max() >= 2**62:
+            return None
+
+        # Round half away from zero, like round()
+        out = (np.sign(a) * np.floor(np.abs(a) + 0.5)).astype(np.int64).tolist()
+    else:
+        out = a.tolist()
+
+    for j in np.flatnonzero(nulls):
+        out[j] = None
+
+    return out
+
 class CasterTransformBuilder(object):
     
     def __init__(self, env = None):
@@ -367,50 +420,47 @@ class CasterTransformBuilder(object):
     def add_type(self, t):
         self.custom_types[t.__name__] = t
 
+    def __getstate__(self):
+        # The compiled functions can't be pickled; they are rebuilt on the first call
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
     def makeListTransform(self):
+        """Generate the code for a function that casts a row that is indexed by position, in
+        the same order as the types were appended. Returns the function name and the code. """
         import uuid
         import datetime
-        f_name = "row_transform_"+str(uuid.uuid4()).replace('-','')
-        
-        raise NotImplementedError("Needs to be fixed")
-        
-        o = """
-def {}(row):
 
-    raise NotImplementedError()
+        f_name = "list_transform_"+str(uuid.uuid4()).replace('-','')
 
-    stripped_num = lambda x: x.strip() if isinstance(x, basestring) else x
-    is_not_nothing = lambda x: True if x!='' and x != None else False
-    
-    try:
-        return [
+        o = """def {}(row):
+
+    return [
 """.format(f_name)
-    
+
         for i,(name,type_) in enumerate(self.types):
             if i != 0:
                 o += ',\n'
-                
-            if type_ == float or type_ == int:
-                o += "{type}(row[{i}]) if is_not_nothing(stripped_num(row[{i}])) else None".format(type=type_.__name__,i=i)
+
+            if type_ == str:
+                type_ = unicode
+
+            if type_ == datetime.date:
+                o += "parse_date('{name}', row[{i}])".format(name=name, i=i)
+            elif type_ == datetime.time:
+                o += "parse_time('{name}', row[{i}])".format(name=name, i=i)
+            elif type_ == datetime.datetime:
+                o += "parse_datetime('{name}', row[{i}])".format(name=name, i=i)
+            elif type_ == int:
+                o += "parse_int('{name}', row[{i}])".format(name=name, i=i)
             else:
-                o += "{type}(row[{i}].strip()) if is_not_nothing(row[{i}]) else None".format(type=type_.__name__,i=i)
-            
-            
-        names = ','.join([ "('{}',{})".format(name, type_.__name__) for name,type_ in self.types])
-            
-        o+="""
-        ]
-    except ValueError as e:
-        for i,(name,type_) in  enumerate( [{names}] ):
-            try:
-                type_(row[i].strip()) if row[i] else None
-            except ValueError:
-                raise ValueError("Failed to convert value '{{}}' in field '{{}}' to '{{}}'".format(row[i], name,type_.__name__))
-        raise
-""".format(names=names)
- 
+                o += "parse_type({type},'{name}', row[{i}])".format(type=type_.__name__,name=name, i=i)
+
+        o += """]"""
+
         return f_name, o
-         
+
     def makeDictTransform(self):
         import uuid
         import datetime
@@ -461,24 +511,36 @@ def {}(row):
         import uuid
 
         if not self._compiled:
-                    
-            #lfn, lf = self.makeListTransform()
-            #exec(lf)
-            #lf = locals()[lfn]
 
-            lf = None
+            # The transforms and the per-column casters are compiled into their own
+            # namespace, with the custom types, so they don't have to be copied into
+            # globals() on every call.
+            env = dict(globals())
+            env.update(self.custom_types)
+
+            lfn, lf = self.makeListTransform()
+            exec lf in env
+            lf = env[lfn]
 
             # Get the code in string form.
             dfn, df, cf = self.makeDictTransform()
 
-            exec(df)
-
-            df = locals()[dfn]
+            exec df in env
+            df = env[dfn]
             
-            exec(cf)
-            cf = locals()['caster_funcs']
-
-            self._compiled  = (lf,df, cf)
+            exec cf in env
+            cf = env['caster_funcs']
+
+            # Per-position casters and the positions of '_code' columns, for re-casting
+            # a list row one value at a time after a casting error.
+            names = [ name for name, type_ in self.types ]
+            lcf = [ cf[name] for name in names ]
+            code_index = {}
+            for i, name in enumerate(names):
+                if name+'_code' in names:
+                    code_index[i] = names.index(name+'_code')
+
+            self._compiled  = (lf,df, cf, lcf, code_index)
         
         return self._compiled
             
@@ -488,9 +550,6 @@ def {}(row):
         codify_cast_errors, in which case move the value with the casting
         error to a field that is suffixed with '_code' '''
 
-        for k,v in self.custom_types.items():
-            globals()[k] = v
-
         if codify_cast_errors:
         
             d = {k.lower():v for k,v in row.items()}
@@ -514,6 +573,100 @@ def {}(row):
         else:
             return  f[1]({k.lower():v for k,v in row.items()}),{}
             
+    def _call_list(self, f, row, codify_cast_errors):
+        '''Call the caster to cast all of the values in a row that is indexed by position.
+        Returns a list of cast values, in the same order as the types. If there are casting
+        errors and codify_cast_errors is True, the value is set to None and the original
+        value is moved to the column suffixed with '_code', if the caster has one. '''
+
+        n_types = len(self.types)
+
+        if len(row) < n_types:
+            row = list(row) + [None] * (n_types - len(row))
+
+        try:
+            return f[0](row), {}
+        except CastingError:
+            if not codify_cast_errors:
+                raise
+
+            lcf, code_index = f[3], f[4]
+            do = [None] * n_types
+            cast_errors = {}
+            bad = []
+
+            for i, (name, type_) in enumerate(self.types):
+                v = row[i]
+                try:
+                    do[i] = lcf[i](v)
+                except CastingError:
+                    cast_errors[name] = v
+                    bad.append((i, v))
+
+            for i, v in bad:
+                if i in code_index:
+                    do[code_index[i]] = v
+
+            return do, cast_errors
+
+    def cast_batch(self, rows, codify_cast_errors=True):
+        '''Cast a chunk of rows at once, column by column. The rows may be a list of lists,
+        indexed by position in the same order as the types, or a dict of column lists, keyed
+        by column name. Int, float and date columns are cast with NumPy when the whole column
+        can be, and the other columns are cast value by value.
+
+        Returns the cast chunk, in the same form as the input, and a sparse map of cast errors,
+        from the row index to a dict of the column names and values that could not be cast.
+        If codify_cast_errors, those values are set to None and moved to the column suffixed
+        with '_code', if the caster has one; otherwise the first error is raised. '''
+        from itertools import izip_longest
+
+        f = self.compile()
+        lcf, code_index = f[3], f[4]
+        names = [ name for name, type_ in self.types ]
+
+        if isinstance(rows, dict):
+            d = {k.lower():v for k,v in rows.items()}
+            n_rows = max(len(v) for v in d.values()) if d else 0
+            columns = [ d[name] if name in d else [None] * n_rows for name in names ]
+        else:
+            n_rows = len(rows)
+            columns = list(izip_longest(*rows))[:len(names)]
+            columns += [ [None] * n_rows ] * (len(names) - len(columns))
+
+        cast_columns = []
+        bad = []
+
+        for i, (name, type_) in enumerate(self.types):
+            col = columns[i]
+            values = vector_cast(type_, col)
+
+            if values is None:
+                caster = lcf[i]
+                values = [None] * n_rows
+
+                for r, v in enumerate(col):
+                    try:
+                        values[r] = caster(v)
+                    except CastingError:
+                        if not codify_cast_errors:
+                            raise
+                        bad.append((r, i, v))
+
+            cast_columns.append(values)
+
+        cast_errors = {}
+
+        for r, i, v in bad:
+            cast_errors.setdefault(r, {})[names[i]] = v
+            if i in code_index:
+                cast_columns[code_index[i]][r] = v
+
+        if isinstance(rows, dict):
+            return dict(zip(names, cast_columns)), cast_errors
+        else:
+            return [ list(row) for row in zip(*cast_columns) ], cast_errors
+
     def __call__(self, row, codify_cast_errors=True):
         from sqlalchemy.engine.result import RowProxy  # @UnresolvedImport
         
@@ -523,11 +676,10 @@ def {}(row):
             return self._call_dict(f,row, codify_cast_errors)
 
         elif isinstance(row, (list,tuple)):
-            raise Exception("Casters are not implemented for lists and tuples, use zip() to create a dict: dict(zip(headers,row))")
-            return f[0](row) 
+            return self._call_list(f, row, codify_cast_errors)
           
         elif isinstance(row, RowProxy):
-            return self._call_dict(f,row. codify_cast_errors)
+            return self._call_dict(f,row, codify_cast_errors)
         else:
             raise Exception("Unknown row type: {} ".format(type(row)))
         
@@ -164,21 +164,38 @@ def lru_cache(maxsize=128, maxtime=60):
     Clear the cache with f.clear().
     http://en.wikipedia.org/wiki/Cache_algorithms#Least_Recently_Used
 
+    The cache can be shared by threads. The function is called outside of the cache's
+    lock, so two threads that miss on the same key may both call it.
+
     '''
     maxqueue = maxsize * 10
     def decorating_function(user_function,
             len=len, iter=iter, tuple=tuple, sorted=sorted, KeyError=KeyError): #@ReservedAssignment
         from time import time
+        import threading
         cache = {}                  # mapping of args to results
         queue = collections.deque() # order that keys have been used
         refcount = Counter()        # times each key is in the queue
         sentinel = object()         # marker for looping around the queue
         kwd_mark = object()         # separate positional and keyword args
+        lock = threading.Lock()     # guards the cache, queue and refcount
+        generation = [0]            # incremented by clear(), to drop results computed before it
 
         # lookup optimizations (ugly but fast)
         queue_append, queue_popleft = queue.append, queue.popleft
         queue_appendleft, queue_pop = queue.appendleft, queue.pop
 
+        def compact():
+            # periodically compact the queue by eliminating duplicate keys
+            # while preserving order of most recent access
+            if len(queue) > maxqueue:
+                refcount.clear()
+                queue_appendleft(sentinel)
+                for key in ifilterfalse(refcount.__contains__,
+                                        iter(queue_pop, sentinel)):
+                    queue_appendleft(key)
+                    refcount[key] = 1
+
         @functools.wraps(user_function)
         def wrapper(*args, **kwds):
             # cache key records both positional and keyword args
@@ -186,55 +203,66 @@ def lru_cache(maxsize=128, maxtime=60):
             if kwds:
                 key += (kwd_mark,) + tuple(sorted(kwds.items()))
 
-            # record recent use of this key
-            queue_append(key)
-            refcount[key] += 1
+            with lock:
+                gen = generation[0]
 
-            # get cache entry or compute if not found
-            try:
-                result, expire_time = cache[key]
+                # record recent use of this key
+                queue_append(key)
+                refcount[key] += 1
 
-                if expire_time and time() > expire_time:
-                    raise KeyError('Expired')
+                # get cache entry
+                try:
+                    result, expire_time = cache[key]
 
-                wrapper.hits += 1
-            except KeyError:
-                result = user_function(*args, **kwds)
-                if maxtime:
-                    expire_time = time() + maxtime
-                else:
-                    expire_time = None
+                    if expire_time and time() > expire_time:
+                        raise KeyError('Expired')
+
+                    wrapper.hits += 1
+                    compact()
+
+                    return result
+                except KeyError:
+                    pass
+
+            # compute it if not found
+            result = user_function(*args, **kwds)
+
+            if maxtime:
+                expire_time = time() + maxtime
+            else:
+                expire_time = None
+
+            with lock:
+                if gen != generation[0]:
+                    # The cache was cleared while computing, which also removed this key
+                    # from the queue, so the result can't be stored
+                    return result
 
                 cache[key] = result, expire_time
                 wrapper.misses += 1
 
-                # purge least recently used cache entry
-                if len(cache) > maxsize:
-                    key = queue_popleft()
-                    refcount[key] -= 1
-                    while refcount[key]:
-                        key = queue_popleft()
-                        refcount[key] -= 1
-                    del cache[key], refcount[key]
-
-            # periodically compact the queue by eliminating duplicate keys
-            # while preserving order of most recent access
-            if len(queue) > maxqueue:
-                refcount.clear()
-                queue_appendleft(sentinel)
-                for key in ifilterfalse(refcount.__contains__,
-                                        iter(queue_pop, sentinel)):
-                    queue_appendleft(key)
-                    refcount[key] = 1
+                # purge least recently used cache entries. Another thread's key may
+                # still be computing, so it may not be in the cache yet.
+                while len(cache) > maxsize:
+                    old_key = queue_popleft()
+                    refcount[old_key] -= 1
+                    while refcount[old_key]:
+                        old_key = queue_popleft()
+                        refcount[old_key] -= 1
+                    cache.pop(old_key, None)
+                    del refcount[old_key]
 
+                compact()
 
             return result
 
         def clear():
-            cache.clear()
-            queue.clear()
-            refcount.clear()
-            wrapper.hits = wrapper.misses = 0
+            with lock:
+                generation[0] += 1
+                cache.clear()
+                queue.clear()
+                refcount.clear()
+                wrapper.hits = wrapper.misses = 0
 
         wrapper.hits = wrapper.misses = 0
         wrapper.clear = clear
@@ -0,0 +1,683 @@
+# Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+# Revised BSD License, included in this distribution as LICENSE.txt
+
+"""Streaming compression codecs for data files. Files are written through a
+background compression thread, and readers detect the codec from the magic
+bytes at the start of the file. gzip is always available; zstd and lz4 are used
+if the zstandard or lz4 packages are installed. """
+
+import io
+import zlib
+
+MAGIC = {
+    'gzip': '\x1f\x8b',
+    'zstd': '\x28\xb5\x2f\xfd',
+    'lz4': '\x04\x22\x4d\x18'
+}
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'zstd': 3,
+    'lz4': 0
+}
+
+# Codecs that are also HTTP content codings, so they can be sent in a Content-Encoding header
+HTTP_CODINGS = ('gzip', 'zstd')
+
+
+def _import_codec(codec):
+    from ..dbexceptions import ConfigurationError, DependencyError
+
+    if codec not in MAGIC:
+        raise ConfigurationError("Unknown compression codec '{}'; must be one of {}"
+                                 .format(codec, sorted(MAGIC.keys())))
+
+    try:
+        if codec == 'zstd':
+            import zstandard
+            return zstandard
+        elif codec == 'lz4':
+            import lz4.frame
+            return lz4.frame
+    except ImportError:
+        raise DependencyError("The {} codec requires the {} package"
+                              .format(codec, 'zstandard' if codec == 'zstd' else 'lz4'))
+
+    return zlib
+
+
+def available_codecs():
+    '''Return the names of the codecs that can be used in this installation'''
+    from ..dbexceptions import DependencyError
+
+    codecs = []
+
+    for codec in sorted(MAGIC.keys()):
+        try:
+            _import_codec(codec)
+            codecs.append(codec)
+        except DependencyError:
+            pass
+
+    return codecs
+
+
+class _Lz4Compressor(object):
+    '''Adapt the lz4 frame compressor to the compress() / flush() interface'''
+
+    def __init__(self, mod, level):
+        self._c = mod.LZ4FrameCompressor(compression_level=level)
+        self._header = self._c.begin()
+
+    def compress(self, data):
+        out = self._header + self._c.compress(data)
+        self._header = ''
+        return out
+
+    def flush(self):
+        return self._header + self._c.flush()
+
+
+def compressor(codec, level=None, threads=None):
+    '''Return an object with compress(data) and flush() methods for the codec. The zstd
+    compressor uses threads to compress in parallel; the other codecs ignore it. '''
+
+    mod = _import_codec(codec)
+
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+
+    if codec == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif codec == 'zstd':
+        return mod.ZstdCompressor(level=level, threads=threads or 0).compressobj()
+    else:
+        return _Lz4Compressor(mod, level)
+
+
+def decompressor(codec):
+    '''Return an object with a decompress(data) method for the codec'''
+
+    mod = _import_codec(codec)
+
+    if codec == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif codec == 'zstd':
+        return mod.ZstdDecompressor().decompressobj()
+    else:
+        return mod.LZ4FrameDecompressor()
+
+
+def detect_codec(f_or_path):
+    '''Return the name of the codec of a file or path, or None if it is not compressed.
+    The position of a file object is not changed. '''
+
+    if isinstance(f_or_path, basestring):
+        with open(f_or_path, 'rb') as f:
+            head = f.read(4)
+    else:
+        pos = f_or_path.tell()
+        head = f_or_path.read(4)
+        f_or_path.seek(pos)
+
+    for codec, magic in MAGIC.items():
+        if head.startswith(magic):
+            return codec
+
+    return None
+
+
+class CompressingWriter(object):
+    '''A write-only file-like object that compresses into another file. Writes are
+    collected into chunks of chunk_size bytes, which a background thread compresses and
+    writes, so the caller isn't blocked by the compression. zlib, zstandard and lz4 all release
+    the GIL while compressing. '''
+
+    def __init__(self, f, codec='gzip', level=None, chunk_size=1024*1024, background=True, queue_size=4,
+                 threads=None):
+        import Queue
+        import threading
+
+        self._f = f
+        self._compressor = compressor(codec, level, threads)
+        self.codec = codec
+        self.chunk_size = chunk_size
+
+        self._buffer = []
+        self._buffered = 0
+        self._error = None
+        self.closed = False
+
+        if background:
+            self._queue = Queue.Queue(queue_size)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._queue = None
+            self._thread = None
+
+    def _run(self):
+
+        while True:
+            data = self._queue.get()
+
+            if data is None:
+                break
+
+            if self._error is None:
+                try:
+                    self._f.write(self._compressor.compress(data))
+                except Exception as e:
+                    self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _send(self):
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        if self._queue:
+            self._check()
+            self._queue.put(data)
+        else:
+            self._f.write(self._compressor.compress(data))
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+
+        if self._buffered >= self.chunk_size:
+            self._send()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        '''Only flushes the buffered data on close, since flushing the compressor
+        would reduce the compression'''
+        pass
+
+    def close(self):
+
+        if self.closed:
+            return
+
+        self.closed = True
+
+        try:
+            if self._buffer:
+                self._send()
+
+            if self._thread:
+                self._queue.put(None)
+                self._thread.join()
+                self._check()
+
+            self._f.write(self._compressor.flush())
+        finally:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+
+def _gzip_member(args):
+    '''Compress a block of data into a complete gzip member'''
+    data, level = args
+
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    return c.compress(data) + c.flush()
+
+
+class BlockIndex(object):
+    '''The offsets of the independent gzip members of a block compressed file. Each
+    block is (uncompressed offset, compressed offset, lines before the block), so a reader can
+    decompress only the blocks that cover a byte range or a range of lines. The index is stored
+    as JSON in a sidecar file. '''
+
+    def __init__(self, blocks=None, size=0, compressed_size=0, lines=0):
+        self.blocks = [ tuple(b) for b in blocks ] if blocks else []
+        self.size = size
+        self.compressed_size = compressed_size
+        self.lines = lines
+
+        # The columns of the blocks, for bisecting
+        self._offsets = [ b[0] for b in self.blocks ]
+        self._line_starts = [ b[2] for b in self.blocks ]
+
+    def add(self, size, compressed_size, lines):
+        '''Add the next block, with its uncompressed and compressed sizes and number of lines'''
+        self.blocks.append((self.size, self.compressed_size, self.lines))
+        self._offsets.append(self.size)
+        self._line_starts.append(self.lines)
+        self.size += size
+        self.compressed_size += compressed_size
+        self.lines += lines
+
+    def block_range(self, k):
+        '''Return the start and end of the compressed data for block k'''
+        start = self.blocks[k][1]
+        end = self.blocks[k+1][1] if k + 1 < len(self.blocks) else self.compressed_size
+        return start, end
+
+    def block_contains(self, k, offset):
+        '''Return True if block k holds an uncompressed offset'''
+        end = self._offsets[k+1] if k + 1 < len(self._offsets) else self.size
+        return self._offsets[k] <= offset < end
+
+    def block_for_offset(self, offset):
+        '''Return the number of the block that holds an uncompressed offset'''
+        from bisect import bisect_right
+        return max(0, bisect_right(self._offsets, offset) - 1)
+
+    def block_for_line(self, line):
+        '''Return the number of the last block that starts at or before the start of a line, where
+        the first line is 0'''
+        from bisect import bisect_left
+        return max(0, bisect_left(self._line_starts, line) - 1)
+
+    def to_dict(self):
+        return dict(blocks=self.blocks, size=self.size, compressed_size=self.compressed_size,
+                    lines=self.lines)
+
+    def dump(self, f):
+        import json
+        json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, f):
+        import json
+        return cls(**json.loads(f.read(-1))) # Cache streams don't read all with read()
+
+    def __len__(self):
+        return len(self.blocks)
+
+
+class ParallelGzipWriter(CompressingWriter):
+    '''A CompressingWriter that compresses blocks of block_size bytes into independent
+    gzip members on a pool of threads, like pigz. zlib releases the GIL while compressing,
+    so the threads use multiple cores. The members are written in order, and the
+    concatenated members are a valid gzip file for gunzip, gzip.GzipFile and sgzip.
+
+    The offsets of the members are recorded in the BlockIndex in the index attribute,
+    for random access with a BlockGzipReader. '''
+
+    def __init__(self, f, level=None, threads=4, block_size=4*1024*1024):
+        from multiprocessing.pool import ThreadPool
+        from collections import deque
+
+        self._f = f
+        self.codec = 'gzip'
+        self.level = DEFAULT_LEVELS['gzip'] if level is None else level
+        self.chunk_size = block_size
+        self.threads = threads
+        self.index = BlockIndex()
+        self.close_cb = None # Called with the writer after it is closed
+
+        self._buffer = []
+        self._buffered = 0
+        self._error = None
+        self.closed = False
+
+        self._pool = ThreadPool(threads)
+        self._pending = deque()
+
+    def write(self, data):
+        # Split the data so every block but the last is exactly block_size
+        pos = 0
+
+        while pos < len(data):
+            n = min(len(data) - pos, self.chunk_size - self._buffered)
+            self._buffer.append(data[pos:pos+n])
+            self._buffered += n
+            pos += n
+
+            if self._buffered >= self.chunk_size:
+                self._send()
+
+    def _write_done(self, max_pending):
+        while len(self._pending) > max_pending:
+            r, size, lines = self._pending.popleft()
+            data = r.get()
+            self._f.write(data)
+            self.index.add(size, len(data), lines)
+
+    def _send(self):
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        self._pending.append((self._pool.apply_async(_gzip_member, ((data, self.level),)),
+                              len(data), data.count('\n')))
+
+        # Bound the memory use by waiting for the oldest blocks
+        self._write_done(2 * self.threads)
+
+    def close(self):
+
+        if self.closed:
+            return
+
+        self.closed = True
+
+        try:
+            if self._buffer or (not self._pending and not self.index.blocks):
+                # An empty file still gets one member, so it is a valid gzip file
+                self._send()
+
+            self._write_done(0)
+        finally:
+            self._pool.terminate()
+            self._f.close()
+
+        if self.close_cb:
+            self.close_cb(self)
+
+
+class BlockGzipReader(object):
+    '''A seekable, read-only file-like object for a file written by a ParallelGzipWriter. Seeking
+    only decompresses the block that holds the new position, and reads decompress only the
+    blocks they cover, so a remote file can be read in ranges. 
+
+    Args:
+        fetch. A function that takes a start and end offset in the compressed file and
+            returns those bytes, or a seekable file object
+        index. The BlockIndex for the file
+    '''
+
+    def __init__(self, fetch, index):
+
+        if not callable(fetch):
+            fetch = file_fetcher(fetch)
+
+        self._fetch = fetch
+        self.index = index
+        self._pos = 0
+
+        self._block = None # Number of the decompressed block
+        self._data = ''
+
+        self.closed = False
+
+    def _block_for_pos(self):
+        '''Return the number of the block that holds the position, checking the loaded
+        block first, since reads are usually sequential'''
+        if self._block is not None and self.index.block_contains(self._block, self._pos):
+            return self._block
+
+        return self.index.block_for_offset(self._pos)
+
+    def _load(self, k):
+        if self._block != k:
+            start, end = self.index.block_range(k)
+            self._data = zlib.decompress(self._fetch(start, end), 16 + zlib.MAX_WBITS)
+            self._block = k
+
+        return self._data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.index.size
+
+        self._pos = max(0, offset)
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+
+        if size is None or size < 0:
+            size = self.index.size - self._pos
+
+        parts = []
+
+        while size > 0 and self._pos < self.index.size:
+            k = self._block_for_pos()
+            data = self._load(k)
+            start = self._pos - self.index.blocks[k][0]
+
+            part = data[start:start+size]
+            parts.append(part)
+            self._pos += len(part)
+            size -= len(part)
+
+        return ''.join(parts)
+
+    def readline(self, size=-1):
+
+        parts = []
+
+        while self._pos < self.index.size:
+            k = self._block_for_pos()
+            data = self._load(k)
+            start = self._pos - self.index.blocks[k][0]
+
+            end = data.find('\n', start)
+            end = len(data) if end < 0 else end + 1
+
+            parts.append(data[start:end])
+            self._pos += end - start
+
+            if end < len(data) or data[end-1:end] == '\n':
+                break
+
+        line = ''.join(parts)
+
+        if size is not None and size >= 0 and len(line) > size:
+            self._pos -= len(line) - size
+            line = line[:size]
+
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def seek_line(self, line):
+        '''Seek to the start of a line, where the first line is 0'''
+
+        k = self.index.block_for_line(line)
+        self._pos = self.index.blocks[k][0] if len(self.index) else 0
+
+        for i in range(line - (self.index.blocks[k][2] if len(self.index) else 0)):
+            if not self.readline():
+                break
+
+    def read_lines(self, start, count):
+        '''Return count lines, starting with line start'''
+        from itertools import islice
+
+        self.seek_line(start)
+
+        return list(islice(self, count))
+
+    def close(self):
+        self.closed = True
+        self._data = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+
+def file_fetcher(f):
+    '''Return a fetch function for a BlockGzipReader that reads ranges from a seekable file'''
+
+    def fetch(start, end):
+        f.seek(start)
+        return f.read(end - start)
+
+    return fetch
+
+
+def http_fetcher(url, timeout=60):
+    '''Return a fetch function for a BlockGzipReader that gets ranges of a URL with HTTP range
+    requests. If the server ignores the range and returns the whole file, the file is kept and
+    later ranges are read from it, rather than downloading the whole file for every block. '''
+    import requests
+
+    whole = []
+
+    def fetch(start, end):
+        if whole:
+            return whole[0][start:end]
+
+        r = requests.get(url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)},
+                         verify=False, timeout=timeout)
+        r.raise_for_status()
+
+        if r.status_code == 206:
+            return r.content
+
+        # The server ignored the range
+        whole.append(r.content)
+
+        return whole[0][start:end]
+
+    return fetch
+
+
+def compressing_writer(f, codec='gzip', level=None, threads=1, block_size=None, **kwargs):
+    '''Return a writer that compresses into the file f. With more than one thread, or a
+    block_size, gzip uses a ParallelGzipWriter, and zstd uses the compressor's own threads. '''
+
+    if codec == 'gzip' and ((threads and threads > 1) or block_size):
+        return ParallelGzipWriter(f, level, threads or 1, block_size or 4*1024*1024)
+
+    return CompressingWriter(f, codec, level, threads=threads if threads > 1 else None, **kwargs)
+
+
+def decompressing_reader(f, codec):
+    '''Return a buffered reader that decompresses the file f'''
+    return io.BufferedReader(_DecompressingRaw(f, codec), buffer_size=1024*1024)
+
+
+def decompress_chunks(chunks):
+    '''Iterate over chunks of data that may be compressed, such as the body of an HTTP response,
+    and yield the decompressed data. The codec is detected from the first chunk. '''
+    from itertools import chain
+
+    chunks = iter(chunks)
+    first = next(chunks, '')
+
+    codec = next((codec for codec, magic in MAGIC.items() if first.startswith(magic)), None)
+
+    if codec is None:
+        for chunk in chain([first], chunks):
+            yield chunk
+        return
+
+    d = decompressor(codec)
+
+    for chunk in chain([first], chunks):
+        data = d.decompress(chunk)
+
+        # Concatenated gzip members
+        unused = d.unused_data if codec == 'gzip' else ''
+        while unused:
+            d = decompressor(codec)
+            data += d.decompress(unused)
+            unused = d.unused_data
+
+        if data:
+            yield data
+
+    data = d.flush() if hasattr(d, 'flush') else ''
+
+    if data:
+        yield data
+
+
+class _DecompressingRaw(io.RawIOBase):
+    '''Raw stream that decompresses another file, for wrapping in an io.BufferedReader. '''
+
+    def __init__(self, f, codec, read_size=1024*1024):
+        self._f = f
+        self._codec = codec
+        self._d = decompressor(codec)
+        self._read_size = read_size
+        self._pending = ''
+        self._pos = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _more(self):
+
+        while self._pos >= len(self._pending):
+
+            if self._eof:
+                return False
+
+            data = self._f.read(self._read_size)
+
+            if not data:
+                self._eof = True
+                self._pending = self._d.flush() if hasattr(self._d, 'flush') else ''
+            else:
+                self._pending = self._d.decompress(data)
+
+                # Concatenated gzip members, as written by appending
+                unused = self._d.unused_data if self._codec == 'gzip' else ''
+                while unused:
+                    self._d = decompressor(self._codec)
+                    self._pending += self._d.decompress(unused)
+                    unused = self._d.unused_data
+
+            self._pos = 0
+
+        return True
+
+    def readinto(self, b):
+
+        if not self._more():
+            return 0
+
+        n = min(len(b), len(self._pending) - self._pos)
+        b[:n] = self._pending[self._pos:self._pos + n]
+        self._pos += n
+
+        return n
+
+    def close(self):
+        self._f.close()
+        super(_DecompressingRaw, self).close()
+
+
+def open_compressed(path, mode='rb', codec=None, level=None, **kwargs):
+    '''Open a file that may be compressed. For reading, the codec is detected from
+    the file, and uncompressed files are opened normally. For writing, returns a
+    CompressingWriter if a codec is given, or a plain file. '''
+
+    if 'r' in mode:
+        f = open(path, 'rb')
+        codec = detect_codec(f)
+
+        if codec is None:
+            return f
+
+        return decompressing_reader(f, codec)
+
+    f = open(path, mode)
+
+    if codec is None:
+        return f
+
+    return CompressingWriter(f, codec, level, **kwargs)
@@ -20,6 +20,9 @@ class NullLogger(object):
     def log(self, message):
         pass
 
+    def info(self, message):
+        pass
+
     def error(self, message):
         pass
 
@@ -77,6 +80,23 @@ def new_warehouse(config, elibrary):
 class ResolutionError(Exception):
     pass
 
+class SyncPlan(object):
+    '''What WarehouseInterface.sync() does for a list of partitions. new and changed partitions
+    are loaded, and changed maps the vid of a changed partition to the installed partition record
+    it replaces and its table signatures. reassigned partitions are unchanged from an installed
+    partition, whose tables they take over. targets maps (dataset vid, table name) to the installed
+    tables of the partitions being replaced. '''
+
+    def __init__(self):
+        from collections import defaultdict
+
+        self.new = []
+        self.changed = {}
+        self.reassigned = [] # (installed partition record, dataset, signatures)
+        self.unchanged = []
+        self.failed = []
+        self.targets = defaultdict(set)
+
 class WarehouseInterface(object):
     def __init__(self,
                  database,
@@ -118,40 +138,196 @@ class WarehouseInterface(object):
     ## Installation
     ##
 
+    # Number of tables that install_many() loads at the same time. Backends that can run
+    # several bulk loads at once override it.
+    loaders = 1
+
     def install(self, partition):
-        from ..orm import Partition
 
         p_vid = self._to_vid(partition)
 
-        p_orm = self.wlibrary.database.session.query(Partition).filter(Partition.vid == p_vid).first()
-
-        if p_orm and p_orm.installed == 'y':
-            self.logger.warn("Skipping {}; already installed".format(p_orm.vname))
+        if self._is_installed(p_vid):
             return
 
         bundle, p, tables = self._setup_install(p_vid)
 
-        if p.identity.format not in ('db', 'geo'):
-            self.logger.warn("Skipping {}; uninstallable format: {}".format(p.identity.vname, p.identity.format))
-            return;
+        if not self._is_installable(p):
+            return
 
         self.install_partition(bundle, p)
 
         for table_name, urls in tables.items():
 
-            if p.identity.format == 'db':
-                if urls:
-                    itn = self.load_remote(p, table_name, urls)
-                else:
-                    itn = self.load_local(p, table_name)
-            else:
-                itn = self.load_ogr(p, table_name)
+            itn = self._load_table(p, table_name, urls)
 
             orm_table = p.get_table(table_name)
             self.library.database.mark_table_installed(orm_table.vid, itn)
 
         self.library.database.mark_partition_installed(p_vid)
 
+    def install_many(self, partitions, n=4, loaders=None):
+        '''Install a collection of partitions, such as the partitions of a Manifest. The bundles
+        and partitions are downloaded, and the remote CSV urls are fetched, on n threads, then
+        the tables are loaded with up to `loaders` loads at once, defaulting to the `loaders`
+        of the warehouse. Returns the references that failed to install. '''
+        from multiprocessing.pool import ThreadPool
+        from ..dbexceptions import NotFoundError
+
+        loaders = int(loaders) if loaders else self.loaders
+
+        partitions = list(partitions)
+
+        # Resolving all of the references at once fills the library's resolver cache
+        # for the resolutions of each partition below.
+        self.elibrary.resolve_many([ ref for ref in partitions if isinstance(ref, basestring) ])
+
+        failed = []
+
+        # Resolution uses the library database session, so it stays in this thread.
+
+        datasets = []
+        seen = set()
+
+        for ref in partitions:
+            try:
+                p_vid = self._to_vid(ref)
+            except (NotFoundError, ResolutionError) as e:
+                self.logger.warn("Failed to resolve {}: {}".format(ref, e))
+                failed.append(ref)
+                continue
+
+            if p_vid in seen or self._is_installed(p_vid):
+                continue
+
+            seen.add(p_vid)
+            datasets.append(self.elibrary.resolve(p_vid))
+
+        if not datasets:
+            return failed
+
+        def fetch(dataset):
+            try:
+                return dataset, self._fetch_install(dataset), None
+            except Exception as e:
+                return dataset, None, e
+
+        self.logger.info('install_many: fetching {} partitions on {} threads'.format(len(datasets), n))
+
+        pool = ThreadPool(max(1, min(n, len(datasets))))
+
+        jobs = []
+        partition_tables = {}
+
+        try:
+            for dataset, csv_urls, e in pool.imap_unordered(fetch, datasets):
+
+                if e:
+                    self.logger.warn("Failed to fetch {}: {}".format(dataset.partition.vname, e))
+                    failed.append(dataset.partition.vname)
+                    continue
+
+                try:
+                    bundle, p, tables = self._setup_install(dataset.partition.vid, csv_urls=csv_urls)
+
+                    if not self._is_installable(p):
+                        continue
+
+                    self.install_partition(bundle, p)
+                except Exception as e:
+                    self.logger.warn("Failed to set up {}: {}".format(dataset.partition.vname, e))
+                    failed.append(dataset.partition.vname)
+                    continue
+
+                partition_tables[p.identity.vid] = set(tables.keys())
+                jobs += [(p, table_name, urls) for table_name, urls in tables.items()]
+        finally:
+            pool.close()
+            pool.join()
+
+        self.logger.info('install_many: loading {} tables with {} loaders'.format(len(jobs), loaders))
+
+        for p, table_name, itn, e in self._load_tables(jobs, loaders):
+
+            p_vid = p.identity.vid
+
+            if p_vid not in partition_tables:
+                continue # Another table of the partition already failed
+
+            if e:
+                self.logger.warn("Failed to load {} {}: {}".format(p.identity.vname, table_name, e))
+                failed.append(p.identity.vname)
+                del partition_tables[p_vid]
+                continue
+
+            self.library.database.mark_table_installed(p.get_table(table_name).vid, itn)
+
+            partition_tables[p_vid].discard(table_name)
+
+            if not partition_tables[p_vid]:
+                self.library.database.mark_partition_installed(p_vid)
+
+        return failed
+
+    def _is_installed(self, p_vid):
+        from ..orm import Partition
+
+        p_orm = self.wlibrary.database.session.query(Partition).filter(Partition.vid == p_vid).first()
+
+        if p_orm and p_orm.installed == 'y':
+            self.logger.warn("Skipping {}; already installed".format(p_orm.vname))
+            return True
+
+        return False
+
+    def _is_installable(self, partition):
+
+        if partition.identity.format not in ('db', 'geo'):
+            self.logger.warn("Skipping {}; uninstallable format: {}".format(partition.identity.vname,
+                                                                           partition.identity.format))
+            return False
+
+        return True
+
+    def _load_table(self, partition, table_name, urls):
+        '''Load one table with the loader for the partition format, and return the name
+        of the table in the warehouse'''
+
+        if partition.identity.format == 'db':
+            if urls:
+                return self.load_remote(partition, table_name, urls)
+            else:
+                return self.load_local(partition, table_name)
+        else:
+            return self.load_ogr(partition, table_name)
+
+    def _load_tables(self, jobs, loaders):
+        '''Load the tables for a list of (partition, table_name, urls) jobs, yielding
+        (partition, table_name, installed_table_name, exception) as each one finishes. This
+        version runs up to `loaders` loads at once on a thread pool, so the loaders of a backend
+        that runs it with more than one must each use their own connection. '''
+        from multiprocessing.pool import ThreadPool
+
+        def load(job):
+            p, table_name, urls = job
+            try:
+                return p, table_name, self._load_table(p, table_name, urls), None
+            except Exception as e:
+                return p, table_name, None, e
+
+        if loaders <= 1 or len(jobs) <= 1:
+            for job in jobs:
+                yield load(job)
+            return
+
+        pool = ThreadPool(min(loaders, len(jobs)))
+
+        try:
+            for r in pool.imap_unordered(load, jobs):
+                yield r
+        finally:
+            pool.close()
+            pool.join()
+
     def install_partition(self, bundle, partition):
         '''Install the records for the partition, the tables referenced by the partition,
         and the bundle, if they aren't already installed'''
@@ -168,6 +344,396 @@ class WarehouseInterface(object):
         for table_name in p.tables:
             self.create_table(p, table_name)
 
+    ##
+    ## Sync
+    ##
+
+    def sync(self, partitions, n=4, loaders=None):
+        '''Bring the warehouse up to date with a list of partition references. A partition that
+        has the same name as an installed one, such as the partition from a new revision of the
+        dataset, is only loaded if its content is different, and then its rows replace those of
+        the installed partition, in the installed table. Otherwise, the installed tables are
+        re-assigned to the new partition.
+
+        The partitions of a table share one warehouse table, so the loaded table is swapped in
+        for the installed one only when the installed table has no rows of other partitions.
+
+        Returns lists of the references that were installed, replaced, unchanged and failed'''
+
+        partitions = list(partitions)
+
+        self.elibrary.resolve_many([ ref for ref in partitions if isinstance(ref, basestring) ])
+
+        plan = self._sync_plan(partitions)
+
+        for old, dataset, signatures in plan.reassigned:
+            self._reassign_partition(old, dataset, signatures)
+
+        # The partitions with rows in each target table, before the loads re-assign the tables
+        users = { key: self._table_users(key[1], next(iter(names)))
+                  for key, names in plan.targets.items() if len(names) == 1 }
+
+        failed = plan.failed + self.install_many(plan.new + plan.changed.keys(), n=n, loaders=loaders)
+
+        p_orms = [ self._installed_partition_by_vid(p_vid) for p_vid in plan.new + plan.changed.keys() ]
+        p_orms = [ p_orm for p_orm in p_orms if p_orm ]
+
+        for p_orm in self._sync_tables(plan, users, p_orms):
+            failed.append(p_orm.vname)
+            p_orms.remove(p_orm)
+            self.library.database.remove_partition(p_orm.identity)
+
+        installed, replaced = [], []
+
+        for p_orm in p_orms:
+            if p_orm.vid in plan.changed:
+                old, signatures = plan.changed[p_orm.vid]
+                self._replace_partition(old, p_orm, signatures)
+                replaced.append(p_orm.vname)
+            else:
+                installed.append(p_orm.vname)
+
+        return installed, replaced, plan.unchanged, failed
+
+    def _sync_plan(self, partitions):
+        '''Match each partition reference to the installed partition with the same name, and
+        return a SyncPlan of what sync() has to do for them, without changing the warehouse'''
+        from ..dbexceptions import NotFoundError
+
+        plan = SyncPlan()
+
+        for ref in partitions:
+            try:
+                p_vid = self._to_vid(ref)
+                dataset = self.elibrary.resolve(p_vid)
+            except (NotFoundError, ResolutionError) as e:
+                self.logger.warn("Failed to resolve {}: {}".format(ref, e))
+                plan.failed.append(ref)
+                continue
+
+            old = self._installed_partition(dataset.partition.sname)
+
+            if not old:
+                plan.new.append(p_vid)
+                continue
+            elif old.vid == p_vid:
+                plan.unchanged.append(dataset.partition.vname)
+                continue
+
+            try:
+                is_changed, signatures = self._partition_changed(old, dataset)
+            except Exception as e:
+                self.logger.warn("Failed to compare {} to {}: {}".format(dataset.partition.vname, old.vname, e))
+                plan.failed.append(dataset.partition.vname)
+                continue
+
+            for table_name, installed_name in self._installed_tables(old).items():
+                plan.targets[(dataset.vid, table_name)].add(installed_name)
+
+            if is_changed:
+                self.logger.info('sync: {} replaces {}'.format(dataset.partition.vname, old.vname))
+                plan.changed[p_vid] = (old, signatures)
+            else:
+                self.logger.info('sync: {} is unchanged from {}'.format(dataset.partition.vname, old.vname))
+                plan.reassigned.append((old, dataset, signatures))
+                plan.unchanged.append(dataset.partition.vname)
+
+        return plan
+
+    def _sync_tables(self, plan, users, p_orms):
+        '''Move the rows of the newly installed partitions p_orms into the installed tables of the
+        partitions they replace. Returns the partitions whose tables failed to sync'''
+
+        failed = []
+
+        for (d_vid, table_name), names in plan.targets.items():
+
+            members = [ p_orm for p_orm in p_orms
+                        if p_orm.d_vid == d_vid and table_name in (p_orm.data or {}).get('tables', []) ]
+
+            if not members:
+                continue
+
+            try:
+                if len(names) > 1:
+                    raise ResolutionError("Partitions of {} are installed in more than one table: {}"
+                                          .format(table_name, ', '.join(sorted(names))))
+
+                self._sync_table(d_vid, table_name, next(iter(names)), members,
+                                 [ plan.changed[p_orm.vid][0] for p_orm in members if p_orm.vid in plan.changed ],
+                                 users[(d_vid, table_name)])
+            except Exception as e:
+                self.logger.warn("Failed to sync table {} of {}: {}".format(table_name, d_vid, e))
+                failed += [ p_orm for p_orm in members if p_orm not in failed ]
+
+        return failed
+
+    def _installed_partition(self, name):
+        from ..orm import Partition
+
+        return (self.wlibrary.database.session.query(Partition)
+                .filter(Partition.name == name, Partition.installed == 'y').first())
+
+    def _installed_partition_by_vid(self, p_vid):
+        from ..orm import Partition
+
+        return (self.wlibrary.database.session.query(Partition)
+                .filter(Partition.vid == p_vid, Partition.installed == 'y').first())
+
+    def _installed_tables(self, p_orm):
+        '''Return a dict of the table names of an installed partition, and the names
+        of the tables in the warehouse'''
+        from ..orm import Table
+
+        s = self.wlibrary.database.session
+
+        tables = {}
+
+        for table_name in (p_orm.data or {}).get('tables', []):
+            t = s.query(Table).filter(Table.d_vid == p_orm.d_vid, Table.name == table_name).first()
+
+            tables[table_name] = (t.installed if t and t.installed
+                                  else self.augmented_table_name(p_orm.d_vid, table_name))
+
+        return tables
+
+    def _table_users(self, table_name, installed_name):
+        '''Return the vids of the installed partitions that have the rows of their table table_name
+        in the warehouse table installed_name'''
+        from ..orm import Partition, Table
+
+        s = self.wlibrary.database.session
+
+        # The datasets with their table_name installed in installed_name, either recorded on the
+        # table or by the augmented name the table is loaded into
+        d_vids = [ d_vid for d_vid, installed in s.query(Table.d_vid, Table.installed).filter(Table.name == table_name)
+                   if (installed or self.augmented_table_name(d_vid, table_name)) == installed_name ]
+
+        if not d_vids:
+            return set()
+
+        return set( vid for vid, data in s.query(Partition.vid, Partition.data)
+                                          .filter(Partition.installed == 'y', Partition.d_vid.in_(d_vids))
+                    if table_name in (data or {}).get('tables', []) )
+
+    def _bundle_partition(self, p_orm):
+        '''The partition in the external library for a partition record'''
+
+        bundle = self.elibrary.get(p_orm.vid)
+
+        return bundle.partitions.get(p_orm.id_)
+
+    def _partition_changed(self, old, dataset):
+        '''Return whether the partition for a dataset has different content than the installed
+        partition record old, and the signatures of its tables, if they were computed. The row
+        counts and key ranges that write_stats() records on the partitions are compared first,
+        then the signatures of each of the tables. '''
+        from ..orm import Partition
+
+        p_orm = (self.elibrary.database.session.query(Partition)
+                 .filter(Partition.vid == dataset.partition.vid).first())
+
+        if p_orm and self._stats_changed(old, p_orm):
+            return True, None
+
+        bundle = self.elibrary.get(dataset)
+        p = bundle.partitions.get(dataset.partition.id_)
+
+        if p.identity.format != 'db' or set(p.tables) != set((old.data or {}).get('tables', [])):
+            return True, None
+
+        signatures = self._table_signatures(p)
+
+        return signatures != self._installed_signatures(old, p), signatures
+
+    @staticmethod
+    def _stats_changed(old, new):
+        '''Return True if the row counts or key ranges of two partition records differ. Records
+        that write_stats() hasn't set any of them on can't be compared, and return False'''
+
+        old_stats = (old.count, old.min_key, old.max_key)
+
+        return any(v is not None for v in old_stats) and old_stats != (new.count, new.min_key, new.max_key)
+
+    def _table_signatures(self, partition):
+        '''Signatures of the tables of a partition file'''
+
+        return { table_name: self.table_signature(partition.database.engine, table_name,
+                                                  partition.get_table(table_name))
+                 for table_name in partition.tables }
+
+    def _installed_signatures(self, p_orm, partition):
+        '''The signatures of the installed tables of a partition record. They are stored in the
+        record when sync() installs the partition, and computed from the warehouse otherwise, or
+        from the partition's own file, for a table that has the rows of other partitions too. '''
+
+        signatures = (p_orm.data or {}).get('table_signatures')
+
+        if signatures:
+            return { k: tuple(v) for k, v in signatures.items() }
+
+        signatures = {}
+
+        for table_name, installed_name in self._installed_tables(p_orm).items():
+            if self._table_users(table_name, installed_name) - set([p_orm.vid]):
+                engine, name = self._bundle_partition(p_orm).database.engine, table_name
+            else:
+                engine, name = self.database.engine, installed_name
+
+            signatures[table_name] = self.table_signature(engine, name, partition.get_table(table_name))
+
+        return signatures
+
+    def table_signature(self, engine, table_name, orm_table):
+        '''Return the row count, the minimum and maximum of the primary key, and an md5 hash
+        of the rows in key order, for a table in a database. '''
+        from itertools import chain
+
+        pk = orm_table.primary_key
+        names = [c.name for c in orm_table.columns]
+        columns = ','.join('"{}"'.format(name) for name in names)
+
+        order = 'ORDER BY "{}"'.format(pk.name) if pk else ''
+
+        with engine.connect() as conn:
+            r = conn.execute('SELECT {} FROM "{}" {}'.format(columns, table_name, order))
+
+            return self.rows_signature(chain.from_iterable(iter(lambda: r.fetchmany(10000), [])),
+                                       names.index(pk.name) if pk else None)
+
+    @classmethod
+    def rows_signature(cls, rows, pk_index=None):
+        '''Return the row count, the first and last values of the key column pk_index, and an md5
+        hash of the rows, for rows in key order'''
+        import hashlib
+
+        h = hashlib.md5()
+        count = 0
+        min_key = max_key = None
+
+        for row in rows:
+            h.update(''.join(cls._signature_value(v) for v in row))
+            h.update('\n')
+
+            if pk_index is not None:
+                if count == 0:
+                    min_key = row[pk_index]
+                max_key = row[pk_index]
+
+            count += 1
+
+        return (count, min_key, max_key, h.hexdigest())
+
+    @staticmethod
+    def _signature_value(v):
+        '''Encode a value for a table signature. Floats use repr(), since str() keeps only 12
+        digits, and each value is prefixed with its length, so the values of different rows
+        can't run together the same way. '''
+
+        if v is None:
+            return '-'
+        elif isinstance(v, float):
+            v = repr(v)
+        elif isinstance(v, unicode):
+            v = v.encode('utf-8')
+        else:
+            v = str(v)
+
+        return '{}:{}'.format(len(v), v)
+
+    def _store_signatures(self, p_vid, signatures):
+        from ..orm import Partition
+
+        s = self.wlibrary.database.session
+
+        p_orm = s.query(Partition).filter(Partition.vid == p_vid).one()
+        p_orm.data['table_signatures'] = { k: list(v) for k, v in signatures.items() }
+
+        s.merge(p_orm)
+        s.commit()
+
+    def _reassign_partition(self, old, dataset, signatures):
+        '''Record the partition for dataset as installed, with the tables of the installed
+        partition old, which has the same content, then remove old. '''
+
+        bundle, p, tables = self._setup_install(dataset.partition.vid, csv_urls={})
+
+        old_tables = self._installed_tables(old)
+
+        ld = self.library.database
+        ld.install_partition(bundle, p.identity.vid)
+
+        for table_name in p.tables:
+            ld.mark_table_installed(p.get_table(table_name).vid, old_tables[table_name])
+
+        ld.mark_partition_installed(p.identity.vid)
+        self._store_signatures(p.identity.vid, signatures)
+
+        ld.remove_partition(old.identity)
+
+    def _sync_table(self, d_vid, table_name, target, members, olds, users):
+        '''Move the rows of the newly installed partitions members, which were loaded into the
+        table of their dataset, into the installed table target, replacing the rows of the
+        partitions olds. users is the set of partition vids that had rows in target before the
+        load. If those are all in olds, the loaded table is swapped in for target. Otherwise, only
+        the rows of olds are deleted from target, so the rows of the other partitions stay. '''
+        from ..orm import Table
+
+        shadow = self.augmented_table_name(d_vid, table_name)
+
+        orm_table = (self.wlibrary.database.session.query(Table)
+                     .filter(Table.d_vid == d_vid, Table.name == table_name).one())
+
+        if shadow == target:
+            return
+
+        try:
+            if users <= set(old.vid for old in olds):
+                self.swap_table(shadow, target)
+            else:
+                keys = [ key for old in olds for key in self._partition_keys(old, table_name) ]
+                self.merge_table(shadow, target, orm_table, keys)
+        except:
+            self.drop_table(shadow)
+            raise
+        finally:
+            # All of the partitions of a dataset's table are installed in the same table
+            self.library.database.mark_table_installed(orm_table.vid, target)
+
+    def _partition_keys(self, p_orm, table_name):
+        '''Return the primary keys of the rows of a table, from the file of an installed partition'''
+        from ..dbexceptions import ConfigurationError
+
+        p = self._bundle_partition(p_orm)
+        pk = p.get_table(table_name).primary_key
+
+        if not pk:
+            raise ConfigurationError("Can't replace the rows of {} in {} without a primary key"
+                                     .format(p_orm.vname, table_name))
+
+        with p.database.engine.connect() as conn:
+            return [ row[0] for row in conn.execute('SELECT "{}" FROM "{}"'.format(pk.name, table_name)) ]
+
+    def _replace_partition(self, old, p_orm, signatures=None):
+        '''Record the signatures of a newly installed partition, which has replaced the rows of
+        the installed partition old, and remove the old partition's record'''
+
+        self._store_signatures(p_orm.vid, signatures or self._table_signatures(self._bundle_partition(p_orm)))
+
+        self.library.database.remove_partition(old.identity)
+
+    def swap_table(self, shadow_name, table_name):
+        '''Replace the table table_name with the table shadow_name, in one transaction'''
+        raise NotImplementedError()
+
+    def merge_table(self, shadow_name, table_name, orm_table, keys):
+        '''Delete the rows with the primary keys keys from the table table_name, then move the rows
+        of the table shadow_name into it, in one transaction'''
+        raise NotImplementedError()
+
+    def drop_table(self, table_name):
+        raise NotImplementedError()
+
     def install_view(self, view_text):
         raise NotImplementedError()
 
@@ -190,13 +756,12 @@ class WarehouseInterface(object):
         raise NotImplementedError()
 
 
-    def _setup_install(self, ref):
+    def _setup_install(self, ref, csv_urls=None):
         '''Perform local and remote resolutions to get the bundle, partition and links
-        to CSV parts in the remote REST itnerface '''
+        to CSV parts in the remote REST itnerface. If csv_urls is given, it is the
+        result of _remote_csv_urls() from an earlier fetch, and the remote is not asked again. '''
         from ..identity import Identity
 
-        ri = RestInterface()
-
         if isinstance(ref, Identity):
             ref = ref.vid
 
@@ -216,30 +781,49 @@ class WarehouseInterface(object):
         b = self.elibrary.get(dataset)
         p = b.partitions.get(ident.id_)
 
-        rident = self.elibrary.remote_resolver.resolve(ident)
+        if csv_urls is None:
+            csv_urls = self._remote_csv_urls(self.elibrary.remote_resolver.resolve(ident))
 
         table_urls = {}
 
         for table_name in p.tables:
             t = b.schema.table(table_name)
 
-            if rident:
-                import requests
-                from ..client.exceptions import BadRequest
-                # If we got an rident, the remotes were defined, and we can get the CSV urls
-                # to load the table.
+            table_urls[table_name] = csv_urls.get(t.id_)
 
-                try:
-                    import pprint
-                    pprint.pprint(rident.data)
-                    table_urls[table_name] = ri.get(rident.data['csv']['tables'][t.id_]['parts'])
-                except BadRequest:
-                    table_urls[table_name] = None
+        return b, p, table_urls
 
-            else:
-                table_urls[table_name] = None
+    def _fetch_install(self, dataset):
+        '''The network part of _setup_install(), for running on a thread: download the bundle
+        and partition files into the library cache and return the remote CSV urls. It doesn't
+        touch the library database, so remote-only datasets are still downloaded by
+        _setup_install(), since attaching the remote cache does. '''
 
-        return b, p, table_urls
+        for cache_key in (dataset.cache_key, dataset.partition.cache_key):
+            self.elibrary.cache.get(cache_key)
+
+        return self._remote_csv_urls(self.elibrary.remote_resolver.resolve(dataset.partition))
+
+    def _remote_csv_urls(self, rident):
+        '''Return a dict of the urls of the CSV parts for each table id of a remote partition
+        identity. If we got an rident, the remotes were defined, and we can get the CSV urls
+        to load the tables. '''
+        from ..client.exceptions import BadRequest
+
+        if not rident:
+            return {}
+
+        ri = RestInterface()
+
+        csv_urls = {}
+
+        for t_id, table in rident.data.get('csv', {}).get('tables', {}).items():
+            try:
+                csv_urls[t_id] = ri.get(table['parts'])
+            except BadRequest:
+                csv_urls[t_id] = None
+
+        return csv_urls
 
 
     ##
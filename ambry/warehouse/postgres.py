@@ -10,7 +10,9 @@ from ..library.database import LibraryDb
 
 class PostgresWarehouse(RelationalWarehouse):
 
-    
+    # Each load gets its own connection, so install_many() runs this many COPY sessions at once.
+    loaders = 4
+
     def create(self):
         self.database.create()
         self.database.connection.execute('CREATE SCHEMA IF NOT EXISTS library;')
@@ -101,36 +103,174 @@ class PostgresWarehouse(RelationalWarehouse):
                 partition.database.path,
                 "--config PG_USE_COPY YES"]
 
-    def _copy_command(self, table, url):
-
-        template = """COPY "public"."{table}"  FROM  PROGRAM 'curl -s -L --compressed "{url}"'  WITH ( FORMAT csv )"""
+    ##
+    ## Loading with COPY
+    ##
 
-        return template.format(table=table, url=url)
+    # The data for a COPY is read on a thread and passed to copy_expert() through a pipe
+    # that buffers at most copy_buffer_chunks chunks of copy_chunk_size bytes.
+    copy_chunk_size = 64 * 1024
+    copy_buffer_chunks = 16
 
+    # Number of connections that COPY the segments of a remote table into it at once.
+    # With 1, the segments are copied in order, in one transaction.
+    copy_segments = 1
 
     def load_local(self, partition, table_name):
-        return self.load_insert(partition, table_name)
+        return self.load_copy_local(partition, table_name)
 
     def load_remote(self, partition, table_name, urls):
+        return self.load_copy_remote(partition, table_name, urls, n=self.copy_segments)
+
+    def load_copy_local(self, partition, table_name):
+        '''Load a table from a local partition by streaming the rows of a SELECT on the partition
+        into COPY, in the Postgres text format'''
+        from sqlalchemy import Table, MetaData
+
+        self.logger.info('load_copy_local {}'.format(partition.identity.name))
+
+        a_table_name = self.augmented_table_name(partition.identity.as_dataset().vid, table_name)
+
+        source_table = Table(table_name, MetaData(), autoload=True, autoload_with=partition.database.engine)
+        columns = [c.name for c in source_table.columns]
+
+        conn = self.database.engine.raw_connection()
+
+        try:
+            n = self._copy(conn, self._copy_sql(a_table_name, columns, 'text'),
+                           self._produce_rows, partition, source_table.select(), table_name)
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.logger.info('done {}: {} rows'.format(partition.identity.vname, n))
+
+        return a_table_name
+
+    def load_copy_remote(self, partition, table_name, urls, n=1):
+        '''Load a table by streaming the CSV segments at urls into COPY. With n greater than
+        one, the segments are split among n connections, which COPY them into the table at once,
+        each in its own transaction. The transactions are committed after all of the segments
+        are copied, and all are rolled back if any segment fails. '''
+        from multiprocessing.pool import ThreadPool
+
+        self.logger.info('load_copy_remote {}'.format(partition.identity.name))
+
+        a_table_name = self.augmented_table_name(partition.identity.as_dataset().vid, table_name)
+        sql = self._copy_sql(a_table_name)
+
+        n = max(1, min(n, len(urls)))
+
+        conns = []
+
+        def copy_segments(args):
+            conn, segment_urls = args
+
+            for url in segment_urls:
+                self.logger.log('install_csv_url {}'.format(url))
+                self._copy(conn, sql, self._produce_url, url)
+
+        try:
+            conns = [ self.database.engine.raw_connection() for i in range(n) ]
+            jobs = [ (conn, urls[i::n]) for i, conn in enumerate(conns) ]
+
+            if n == 1:
+                copy_segments(jobs[0])
+            else:
+                pool = ThreadPool(n)
+
+                try:
+                    pool.map(copy_segments, jobs)
+                finally:
+                    pool.close()
+                    pool.join()
+
+            # The commits are separate, so other sessions may see some segments before the rest,
+            # but no segment is committed unless all of them were copied.
+            for conn in conns:
+                conn.commit()
+
+        except:
+            for conn in conns:
+                conn.rollback()
+            raise
+
+        finally:
+            for conn in conns:
+                conn.close()
+
+        return a_table_name
+
+    def _copy_sql(self, table, columns=None, format='csv'):
+
+        columns = '({})'.format(','.join('"{}"'.format(c) for c in columns)) if columns else ''
+
+        return 'COPY "public"."{}" {} FROM STDIN WITH ( FORMAT {} )'.format(table, columns, format)
+
+    def _copy(self, conn, sql, produce, *args):
+        '''Run a COPY FROM STDIN on a raw psycopg2 connection, with the data written into a
+        CopyPipe by produce(pipe, *args) on a thread. Returns the number of rows copied '''
+        import threading
+
+        pipe = CopyPipe(self.copy_buffer_chunks)
 
-        self.logger.log('install_partition_csv {}'.format(partition.identity.name))
+        def run():
+            try:
+                produce(pipe, *args)
+            except Exception as e:
+                pipe.close(e)
+            else:
+                pipe.close()
 
-        pdb = partition.database
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
 
-        sqla_table, meta = self.create_table(partition.identity, table_name)
+        try:
+            cursor = conn.cursor()
+            cursor.copy_expert(sql, pipe, size=self.copy_chunk_size)
+        finally:
+            pipe.cancel()
+            t.join()
 
+        if pipe.error:
+            raise pipe.error
 
-        for url in urls:
-            self.logger.log('install_csv_url {}'.format(url))
+        return cursor.rowcount
 
-            cmd = self._copy_command(sqla_table, url)
-            self.logger.log('installing with command: {} '.format(cmd))
-            r = self.database.connection.execute(cmd)
+    def _produce_url(self, pipe, url):
+        '''Write the body of a request for a CSV segment to a pipe. The server
+        gzips the CSV, and requests decodes it.'''
+        import requests
 
-            #self.logger.log('installed_csv_url {}'.format(url))
+        r = requests.get(url, stream=True)
+        r.raise_for_status()
 
-            r = self.database.connection.execute('commit')
+        for chunk in r.iter_content(self.copy_chunk_size):
+            pipe.write(chunk)
 
+    def _produce_rows(self, pipe, partition, select, table_name):
+        '''Write the rows of a select on a partition to a pipe, as lines in the
+        Postgres COPY text format'''
+
+        lines = []
+        size = 0
+
+        # A connection of our own, since this runs on the COPY thread
+        with partition.database.engine.connect() as conn:
+            for i, row in enumerate(conn.execute(select)):
+                line = '\t'.join(copy_text_value(v) for v in row) + '\n'
+
+                lines.append(line)
+                size += len(line)
+
+                if size >= self.copy_chunk_size:
+                    pipe.write(''.join(lines))
+                    lines = []
+                    size = 0
+                    self.logger.progress('copy_row', table_name, i)
+
+        pipe.write(''.join(lines))
 
     def install_view(self, view_text):
 
@@ -144,3 +284,82 @@ class PostgresWarehouse(RelationalWarehouse):
         e(view_text)
 
 
+
+
+def copy_text_value(v):
+    '''Format a value for the Postgres COPY text format '''
+
+    if v is None:
+        return '\\N'
+    elif isinstance(v, unicode):
+        v = v.encode('utf-8')
+    elif isinstance(v, float):
+        return repr(v)
+    elif not isinstance(v, str):
+        return str(v)
+
+    if '\\' in v or '\t' in v or '\n' in v or '\r' in v:
+        v = v.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    return v
+
+
+class CopyPipe(object):
+    '''A bounded, file-like pipe between a thread that writes data and a COPY that reads it
+    with copy_expert(). The writer closes the pipe when it is done, or with the exception
+    that stopped it, which is raised to the reader. '''
+
+    def __init__(self, max_chunks=16):
+        import Queue
+
+        self._queue = Queue.Queue(max_chunks)
+        self._buffer = ''
+        self._eof = False
+        self._cancelled = False
+        self.error = None
+
+    def _put(self, item):
+        import Queue
+
+        while not self._cancelled:
+            try:
+                self._queue.put(item, timeout=.5)
+                return
+            except Queue.Full:
+                pass
+
+    def write(self, data):
+
+        if self._cancelled:
+            raise IOError("The reader of the pipe has stopped")
+
+        if data:
+            self._put(data)
+
+    def close(self, error=None):
+        self.error = error
+        self._put(None)
+
+    def cancel(self):
+        '''Called by the reader when it stops reading, so the writer exits'''
+        self._cancelled = True
+
+    def read(self, size=-1):
+
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+
+        if self._eof and self.error:
+            raise self.error
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
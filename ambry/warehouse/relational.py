@@ -3,6 +3,7 @@ Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
 Revised BSD License, included in this distribution as LICENSE.txt
 """
 
+from contextlib import contextmanager
 from ..dbexceptions import DependencyError
 from . import WarehouseInterface
 
@@ -56,6 +57,56 @@ class RelationalWarehouse(WarehouseInterface):
 
         return table, meta
 
+    @contextmanager
+    def _transaction(self):
+        '''Yield a connection in a transaction that may include DDL statements'''
+
+        with self.database.engine.begin() as conn:
+            yield conn
+
+    def swap_table(self, shadow_name, table_name):
+        '''Replace the table table_name with the table shadow_name, in one transaction'''
+
+        with self._transaction() as conn:
+            conn.execute('DROP TABLE IF EXISTS "{}"'.format(table_name))
+            conn.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(shadow_name, table_name))
+
+        self.logger.info('swap_table {} -> {}'.format(shadow_name, table_name))
+
+    def merge_table(self, shadow_name, table_name, orm_table, keys):
+        '''Delete the rows with the primary keys keys from the table table_name, then move the rows
+        of the table shadow_name into it and drop shadow_name, in one transaction. The keys are
+        loaded into a temporary table, so the rows are deleted with one statement. '''
+        from sqlalchemy.sql import table, column
+
+        pk = orm_table.primary_key
+        columns = ','.join('"{}"'.format(c.name) for c in orm_table.columns)
+
+        keys_name = '{}_merge_keys'.format(table_name)
+
+        with self._transaction() as conn:
+            if keys:
+                # Copying the column from the target gives the keys table the same type in every database
+                conn.execute('CREATE TEMPORARY TABLE "{}" AS SELECT "{}" FROM "{}" WHERE 1 = 0'
+                             .format(keys_name, pk.name, table_name))
+
+                t = table(keys_name, column(pk.name))
+                conn.execute(t.insert(), [ {pk.name: k} for k in keys ])
+
+                conn.execute('DELETE FROM "{0}" WHERE "{1}" IN (SELECT "{1}" FROM "{2}")'
+                             .format(table_name, pk.name, keys_name))
+                conn.execute('DROP TABLE "{}"'.format(keys_name))
+
+            conn.execute('INSERT INTO "{}" ({}) SELECT {} FROM "{}"'.format(table_name, columns, columns, shadow_name))
+            conn.execute('DROP TABLE "{}"'.format(shadow_name))
+
+        self.logger.info('merge_table {} -> {}, replacing {} rows'.format(shadow_name, table_name, len(keys)))
+
+    def drop_table(self, table_name):
+
+        with self._transaction() as conn:
+            conn.execute('DROP TABLE IF EXISTS "{}"'.format(table_name))
+
     def tables(self):
 
         return self.metadata.sorted_tables
@@ -114,8 +165,10 @@ class RelationalWarehouse(WarehouseInterface):
 
         cache = []
 
-        with self.database.engine.begin() as conn:
-            for i, row in enumerate(partition.database.session.execute(select_statement)):
+        # Read with a connection of our own, rather than the partition session, so loads of
+        # several tables can run on threads at once.
+        with self.database.engine.begin() as conn, partition.database.engine.connect() as source_conn:
+            for i, row in enumerate(source_conn.execute(select_statement)):
                 self.logger.progress('add_row', table_name, i)
 
                 cache.append(row)
@@ -3,6 +3,7 @@ Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
 Revised BSD License, included in this distribution as LICENSE.txt
 """
 
+from contextlib import contextmanager
 from ..dbexceptions import DependencyError
 from relational import RelationalWarehouse
 from ..library.database import LibraryDb
@@ -29,6 +30,81 @@ class SqliteWarehouse(RelationalWarehouse):
     def load_local(self, partition, table_name):
         return self.load_attach(partition, table_name)
 
+    @contextmanager
+    def _transaction(self):
+        '''The sqlite3 module commits before DDL statements, so it is put in autocommit mode and
+        the transaction is begun here'''
+
+        with self.database.engine.connect() as conn:
+            dbapi_conn = conn.connection.connection
+            isolation_level = dbapi_conn.isolation_level
+
+            dbapi_conn.isolation_level = None
+
+            try:
+                with conn.begin():
+                    conn.execute('BEGIN')
+                    yield conn
+            finally:
+                dbapi_conn.isolation_level = isolation_level
+
+    def _load_tables(self, jobs, loaders):
+        '''Sqlite has only one writer, so the tables are loaded one at a time, in this
+        thread, while up to `loaders` reader threads read the partition files of the next jobs,
+        so the attached copy finds them in the OS page cache. '''
+        from multiprocessing.pool import ThreadPool
+        from collections import deque
+        from itertools import islice
+
+        prefetched = set()
+
+        def prefetch(job):
+            p, table_name, urls = job
+
+            path = p.database.path if not urls and p.identity.format == 'db' else None
+
+            if path in prefetched:
+                path = None
+            else:
+                prefetched.add(path)
+
+            return pool.apply_async(self._prefetch_file, (path,)), job
+
+        pool = ThreadPool(max(1, loaders))
+
+        jobs = iter(jobs)
+        ahead = deque(prefetch(job) for job in islice(jobs, max(1, loaders)))
+
+        try:
+            while ahead:
+                r, (p, table_name, urls) = ahead.popleft()
+
+                for job in islice(jobs, 1):
+                    ahead.append(prefetch(job))
+
+                r.wait()
+
+                try:
+                    result = p, table_name, self._load_table(p, table_name, urls), None
+                except Exception as e:
+                    result = p, table_name, None, e
+
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _prefetch_file(path, chunk_size=1024*1024):
+        '''Read through a file, to get it into the OS page cache'''
+
+        if not path:
+            return
+
+        with open(path, 'rb') as f:
+            while f.read(chunk_size):
+                pass
+
     def load_attach(self, partition, table_name):
 
         self.logger.info('load_attach {}'.format(partition.identity.name))
@@ -51,30 +127,189 @@ class SqliteWarehouse(RelationalWarehouse):
         return dest_table_name
 
 
+    # Threads that download, parse and cast the CSV segments for load_remote(), the number of
+    # rows in the batches they pass to the writer, and the batches that can wait per segment.
+    download_threads = 4
+    load_batch_size = 10000
+    load_queue_size = 8
+
+    # Seconds between progress reports
+    progress_interval = 10
+
     def load_remote(self, partition, table_name, urls):
+        '''Load a table from the remote CSV segments at urls. The segments are downloaded,
+        decompressed, parsed and cast on a pool of download_threads threads, and this thread writes
+        the batches of rows with executemany(), in one transaction. If the table has a primary
+        key, the segments are written in order, so the rows go in in key order. '''
+        import Queue
+        import threading
+        import time
+        from multiprocessing.pool import ThreadPool
+        from sqlalchemy import Table, MetaData
+        from ..database.sqlite import _bind_processors
 
-        import shlex
-        from sh import ambry_load_sqlite, ErrorReturnCode_1
+        self.logger.info('load_remote {} {}'.format(partition.identity.vname, table_name))
 
-        self.logger.info('load_remote {} '.format(partition.identity.vname, table_name))
+        a_table_name = self.augmented_table_name(partition.identity.as_dataset().vid, table_name)
 
-        d_vid = partition.identity.as_dataset().vid
+        orm_table = partition.get_table(table_name)
+        columns = [c.name for c in orm_table.columns]
 
-        a_table_name = self.augmented_table_name(d_vid, table_name)
+        caster = orm_table.caster
+        caster.compile() # Once, before the threads share it
 
-        for url in urls:
+        dest_table = Table(a_table_name, MetaData(), autoload=True, autoload_with=self.database.engine)
+        types = dict((c.name, c.type) for c in dest_table.columns)
+        processors = _bind_processors([types[c] for c in columns], self.database.engine.dialect)
 
+        ordered = bool(dest_table.primary_key.columns)
+
+        n = len(urls)
+        threads = max(1, min(self.download_threads, n))
+
+        if ordered:
+            queues = [Queue.Queue(self.load_queue_size) for _ in urls]
+        else:
+            queues = [Queue.Queue(self.load_queue_size * threads)] * n
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        stats = dict(bytes=0, errors=0)
+
+        def count(key, v):
+            with lock:
+                stats[key] += v
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=.5)
+                    return True
+                except Queue.Full:
+                    pass
+
+            return False
+
+        def produce(i):
             try:
-                ## Call the external program ambry-load-sqlite to load data into
-                ## sqlite
-                p = ambry_load_sqlite(url, self.database.path, a_table_name,
-                                      _err=self.logger.error, _out=self.logger.info )
-                p.wait()
+                for rows in self._remote_batches(urls[i], caster, processors, count):
+                    if not put(queues[i], rows):
+                        return
+
+                put(queues[i], None)
             except Exception as e:
-                self.logger.error("Failed to load: {} {}: {}".format(partition.identity.vname, table_name, e.message))
+                put(queues[i], e)
+
+        sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            a_table_name, ','.join('"{}"'.format(c) for c in columns), ','.join('?' * len(columns)))
+
+        start = last_report = time.time()
+        rows_written = 0
+
+        pool = ThreadPool(threads)
+        conn = self.database.dbapi_connection
+
+        try:
+            # One url per task, so the segments start in order, and the segment the writer
+            # is waiting for is always running.
+            pool.map_async(produce, range(n), chunksize=1)
+
+            cursor = conn.cursor()
+            done = 0
+
+            for q in (queues if ordered else queues[:1]):
+                while True:
+                    item = q.get()
+
+                    if item is None:
+                        done += 1
+                        if ordered or done == n:
+                            break
+                        continue
+
+                    if isinstance(item, Exception):
+                        raise item
+
+                    cursor.executemany(sql, item)
+                    rows_written += len(item)
+
+                    if time.time() - last_report > self.progress_interval:
+                        last_report = time.time()
+                        self._log_load_rate(table_name, rows_written, stats['bytes'], last_report - start)
+
+            conn.commit()
+
+        except:
+            conn.rollback()
+            raise
+        finally:
+            stop.set()
+            pool.close()
+            pool.join()
+            conn.close()
+
+        self._log_load_rate(table_name, rows_written, stats['bytes'], time.time() - start)
+
+        if stats['errors']:
+            self.logger.warn("Load of {} had cast errors in {} rows".format(a_table_name, stats['errors']))
 
         return a_table_name
 
+    def _remote_batches(self, url, caster, processors, count):
+        '''Download a CSV segment and yield batches of cast rows. count(key, n) is called
+        with the bytes read and the number of rows with cast errors '''
+        import csv
+        import requests
+        from itertools import islice
+        from ..util.compression import decompress_chunks
+
+        r = requests.get(url, stream=True)
+        r.raise_for_status()
+
+        def lines():
+            rest = ''
+
+            # requests decodes a gzip Content-Encoding, and decompress_chunks() a compressed body
+            for chunk in decompress_chunks(r.iter_content(64 * 1024)):
+                count('bytes', len(chunk))
+
+                lines = (rest + chunk).split('\n')
+                rest = lines.pop()
+
+                for line in lines:
+                    yield line + '\n'
+
+            if rest:
+                yield rest
+
+        reader = csv.reader(lines())
+
+        while True:
+            rows = list(islice(reader, self.load_batch_size))
+
+            if not rows:
+                break
+
+            rows = [[v.decode('utf-8') for v in row] for row in rows]
+
+            if caster:
+                rows, cast_errors = caster.cast_batch(rows)
+                count('errors', len(cast_errors))
+
+            for i, p in processors:
+                for row in rows:
+                    row[i] = p(row[i])
+
+            yield rows
+
+    def _log_load_rate(self, table_name, rows, bytes_, elapsed):
+
+        elapsed = max(elapsed, .001)
+
+        self.logger.info("load_remote {}: {} rows, {:.1f} MB in {:.1f}s; {:.0f} rows/s, {:.2f} MB/s"
+                         .format(table_name, rows, bytes_ / 1048576.0, elapsed,
+                                 rows / elapsed, bytes_ / 1048576.0 / elapsed))
+
 class SpatialiteWarehouse(SqliteWarehouse):
 
     def _ogr_args(self, partition):
@@ -0,0 +1,46 @@
+"""
+Compare the rows/sec for casting rows as dicts, by position and in batches.
+
+Run directly:  python test/bench_caster.py
+"""
+
+import time
+from ambry.transform import CasterTransformBuilder
+
+
+def rate(f, rows):
+    t = time.time()
+    f(rows)
+    return len(rows) / (time.time() - t)
+
+
+def main(n=20000):
+    ctb = CasterTransformBuilder()
+
+    header = []
+    for i in range(10):
+        for name, type_ in (('int', int), ('float', float), ('str', str)):
+            header.append('{}_{}'.format(name, i))
+            ctb.append(header[-1], type_)
+
+    rows = [ [ str(i), str(i/2.0), 'value {}'.format(i) ] * 10 for i in range(n) ]
+
+    def cast_dicts(rows):
+        for row in rows:
+            ctb(dict(zip(header, row)))
+
+    def cast_lists(rows):
+        for row in rows:
+            ctb(row)
+
+    def cast_batches(rows):
+        for i in range(0, len(rows), 5000):
+            ctb.cast_batch(rows[i:i+5000])
+
+    print "Dict caster:  {:8.0f} rows/s".format(rate(cast_dicts, rows))
+    print "List caster:  {:8.0f} rows/s".format(rate(cast_lists, rows))
+    print "Batch caster: {:8.0f} rows/s".format(rate(cast_batches, rows))
+
+
+if __name__ == '__main__':
+    main()
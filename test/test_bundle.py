@@ -266,7 +266,15 @@ class Test(TestBase):
             else:
                 self.assertFalse(vd(row), "Test {} not 'false' for table '{}': {}".format(i+1, table_name,row))
 
-        
+        # The batch validator should give the same results as the row validator
+        for table_name in set(test[0] for test in tests):
+            table = self.bundle.schema.table(table_name)
+            rows = [ test[2] for test in tests if test[0] == table_name ]
+            truths = [ test[1] for test in tests if test[0] == table_name ]
+
+            self.assertEquals(truths, list(table.validate_mask(rows)))
+
+
         # Test the hash functions. This test depends on the d_test values in geoschema.csv
         tests =[
         ( 'tone','A|1|', (None,'A',1,2) ), 
@@ -539,6 +547,569 @@ class Test(TestBase):
         print b.partitions._repr_html_()
 
 
+    def test_dbapi_inserter(self):
+        """Inserting through the DB-API should store the same values as Sqlalchemy"""
+
+        rows = [ (None, 'str{}'.format(i), i, i / 2.0, '2010-01-{:02d}'.format(i % 28 + 1),
+                  '2010-01-01T10:{:02d}'.format(i % 60), '10:{:02d}'.format(i % 60)) for i in range(1000) ]
+        rows += [ {'text': 'missing'} ]
+
+        values = {}
+
+        for grain, dbapi in (('sqlalchemy', False), ('dbapi', True)):
+            p = self.bundle.partitions.find_or_new_db(table='tthree', grain=grain)
+
+            with p.inserter(dbapi=dbapi, cache_size=300) as ins:
+                for row in rows:
+                    ins.insert(row)
+
+                max_lengths = ins.max_lengths
+
+            values[dbapi] = (list(p.database.query('SELECT * FROM tthree ORDER BY id')), max_lengths)
+
+        self.assertEquals(1001, len(values[True][0]))
+        self.assertEquals(values[False], values[True])
+        self.assertEquals(-1, values[True][0][-1]['integer'])
+
+    def _value_inserter(self, types, **kwargs):
+        """Return a ValueInserter for a new table in a temporary database, with a schema of
+        (name, python type) and without a bundle"""
+        from ambry.database.sqlite import SqliteDatabase
+        from ambry.database.inserter import ValueInserter
+        from ambry.transform import CasterTransformBuilder
+        from ambry.util import temp_file_name, AttrDict
+        from sqlalchemy import Table, Column, MetaData, Integer, String, Time
+
+        sa_types = {int: Integer, str: String, unicode: String}
+
+        class OrmColumn(object):
+            DATATYPE_INTEGER = 'integer'
+
+            def __init__(self, name, type_):
+                self.name = name
+                self.datatype = 'integer' if type_ is int else 'varchar'
+                self._text = type_ in (str, unicode)
+
+            def type_is_text(self):
+                return self._text
+
+        caster = CasterTransformBuilder()
+
+        for name, type_ in types:
+            caster.append(name, type_)
+
+        db = SqliteDatabase(temp_file_name() + '.db')
+        db.create()
+        db.partition = AttrDict(set_state=lambda state: None)
+
+        table = Table('ins_test', MetaData(),
+                      *[ Column(name, sa_types.get(type_, Time), primary_key=(i == 0))
+                         for i, (name, type_) in enumerate(types) ])
+        table.create(db.engine)
+
+        table._db_orm_table = AttrDict(columns=[OrmColumn(name, type_) for name, type_ in types],
+                                       null_dict=dict((name, None) for name, _ in types),
+                                       caster=caster)
+
+        return ValueInserter(db, None, table, **kwargs)
+
+    def test_inserter_cast_errors(self):
+        """Cast errors go to the cast_error_handler with the rows as they were inserted"""
+
+        errors = []
+
+        class Handler(object):
+            def __init__(self, inserter):
+                pass
+
+            def cast_error(self, row, cast_errors):
+                errors.append((row, cast_errors))
+
+            def finish(self):
+                pass
+
+        ins = self._value_inserter([('id', int), ('name', str), ('integer', int), ('integer_code', str)],
+                                   cast_error_handler=Handler, cache_size=2)
+
+        row = {'id': 1, 'name': 'one', 'integer': 'x'}
+        self.assertIsNone(ins.insert(row))
+        row['integer'] = 'changed' # Callers may reuse the row
+        ins.insert([2, 'two', 2])
+        ins.insert([3, 'three', 'y'])
+        ins.close()
+
+        self.assertEquals([({'id': 1, 'name': 'one', 'integer': 'x'}, {'integer': 'x'}),
+                           ([3, 'three', 'y'], {'integer': 'y'})], errors)
+
+        self.assertEquals([(1, 'one', None, 'x'), (2, 'two', 2, None), (3, 'three', None, 'y')],
+                          [tuple(r) for r in ins.db.connection.execute('SELECT * FROM ins_test ORDER BY id')])
+
+        ins.db.delete()
+
+        # One list, reused and changed for every insert
+        del errors[:]
+
+        ins = self._value_inserter([('id', int), ('name', str), ('integer', int), ('integer_code', str)],
+                                   cast_error_handler=Handler, cache_size=10)
+
+        row = [None, None, None]
+        for i, name, integer in ((1, 'one', 'x'), (2, 'two', 2), (3, 'three', 'y')):
+            row[0], row[1], row[2] = i, name, integer
+            ins.insert(row)
+        ins.close()
+
+        self.assertEquals([([1, 'one', 'x'], {'integer': 'x'}), ([3, 'three', 'y'], {'integer': 'y'})], errors)
+
+        self.assertEquals([(1, 'one', None, 'x'), (2, 'two', 2, None), (3, 'three', None, 'y')],
+                          [tuple(r) for r in ins.db.connection.execute('SELECT * FROM ins_test ORDER BY id')])
+
+        ins.db.delete()
+
+    def test_inserter_max_lengths(self):
+        """The inserter tracks the longest value of text and integer columns, including
+        non-ASCII unicode values"""
+
+        ins = self._value_inserter([('id', int), ('name', unicode), ('code', str)], update_size=True)
+
+        ins.insert([1, u'abc', 'x'])
+        ins.insert([22, u'\xe9t\xe9 \u2603', None])
+        ins.insert([333, None, 'xyz'])
+        ins.close()
+
+        self.assertEquals({'id': 3, 'name': 5, 'code': 3}, ins.max_lengths)
+
+        ins.db.delete()
+
+        # Unicode and UTF-8 str values in the same column. Sqlite won't store the str value,
+        # so measure the batch directly.
+        ins = self._value_inserter([('id', int), ('name', unicode)], update_size=True)
+
+        ins._update_max_lengths([[1, u'caf\xe9'], [2, 'caf\xc3\xa9s'], [3, None]])
+
+        self.assertEquals({'id': 1, 'name': 6}, ins.max_lengths)
+
+        ins.db.delete()
+
+    def test_dbapi_inserter_rows(self):
+        """The DB-API inserter converts copies of the rows, not the caller's rows"""
+        import datetime
+
+        ins = self._value_inserter([('id', int), ('time', datetime.time)], dbapi=True, skip_none=False)
+        ins.caster = None
+
+        rows = [ [i, datetime.time(10, i)] for i in range(3) ]
+
+        for row in rows:
+            ins.insert(row)
+
+        ins.close()
+
+        self.assertEquals([ [i, datetime.time(10, i)] for i in range(3) ], rows)
+        self.assertEquals(['10:00:00.000000', '10:01:00.000000', '10:02:00.000000'],
+                          [r[0] for r in ins.db.connection.execute('SELECT time FROM ins_test ORDER BY id')])
+
+        ins.db.delete()
+
+    def test_load_bulk(self):
+        """The CSV loaders fill the table and restore the connection's journal and sync settings"""
+        from ambry.database.sqlite import SqliteDatabase
+        from ambry.database.csv import CsvDb
+        from ambry.util import temp_file_name
+        import sqlite3
+
+        class Partition(object):
+            def __init__(self, rows):
+                self.path = temp_file_name()
+
+                with open(self.path + CsvDb.EXTENSION, 'w') as f:
+                    for row in rows:
+                        f.write('|'.join(str(v) for v in row) + '\n')
+
+        rows = [(i, 'row{}'.format(i)) for i in range(10)]
+        partitions = [Partition(rows[:4]), Partition(rows[4:7]), Partition(rows[7:])]
+        sources = [CsvDb(None, p, None) for p in partitions]
+
+        db = SqliteDatabase(temp_file_name() + '.db')
+        db.create()
+        db.connection.execute('CREATE TABLE load_test (id INTEGER, name TEXT)')
+        db.connection.execute('PRAGMA journal_mode = WAL').close()
+
+        self.assertEquals(4, db.load_bulk(sources[0], 'load_test')[0])
+        self.assertEquals(6, db.load_many(sources[1:], 'load_test', n=2)[0])
+
+        conn = sqlite3.connect(db.path)
+        self.assertEquals(rows, [tuple(r) for r in conn.execute('SELECT id, name FROM load_test ORDER BY id')])
+        self.assertEquals('wal', conn.execute('PRAGMA journal_mode').fetchone()[0])
+        conn.close()
+
+        # Outside of WAL mode, the journal is off for the load
+        path = temp_file_name()
+        conn = sqlite3.connect(path)
+        saved = db._set_load_pragmas(conn)
+        self.assertEquals('off', conn.execute('PRAGMA journal_mode').fetchone()[0])
+        db._restore_load_pragmas(conn, saved)
+        self.assertEquals('delete', conn.execute('PRAGMA journal_mode').fetchone()[0])
+        self.assertEquals(2, conn.execute('PRAGMA synchronous').fetchone()[0])
+        conn.close()
+        os.remove(path)
+
+        for p in partitions:
+            os.remove(p.path + CsvDb.EXTENSION)
+
+        db.delete()
+
+    def test_csvize(self):
+        """csvize writes the segments in process by default, with dates as the partition engine reads them"""
+        from ambry.partition.sqlite import SqlitePartition
+        from ambry.database.sqlite import SqliteDatabase
+        from ambry.util import temp_file_name, AttrDict
+        import multiprocessing
+        import datetime
+
+        db = SqliteDatabase(temp_file_name() + '.db')
+        db.create()
+        db.connection.execute('CREATE TABLE csv_test (id INTEGER PRIMARY KEY, day DATE, time TIMESTAMP)')
+        db.connection.execute('INSERT INTO csv_test VALUES (?, ?, ?)',
+            [(i, '2014-01-{:02d}'.format(i + 1), '2014-01-01 {:02d}:30:00.000000'.format(i)) for i in range(10)])
+
+        class PartialName(object):
+            pass
+
+        class CsvPartition(object):
+            def __init__(self, segment):
+                self.identity = AttrDict(name='csv_test-{}'.format(segment))
+                self.database = AttrDict(path=temp_file_name(), compression=None, compression_level=None)
+
+            def write_stats(self, min_key, max_key, count):
+                self.stats = (min_key, max_key, count)
+
+        class Partition(SqlitePartition):
+            def __init__(self, path):
+                self._record = None
+                self._database = AttrDict(path=path)
+                self.record_count = 0
+                self.parts = []
+                self.bundle = AttrDict(partitions=AttrDict(find_or_new_csv=self.new_csv))
+
+            @property
+            def identity(self):
+                return AttrDict(name=AttrDict(as_partialname=PartialName))
+
+            def new_csv(self, **kwargs):
+                self.parts.append(CsvPartition(len(self.parts) + 1))
+                return self.parts[-1]
+
+            def get_table(self):
+                return AttrDict(name='csv_test', primary_key=AttrDict(name='id'),
+                                columns=[AttrDict(name=n) for n in ('id', 'day', 'time')])
+
+        def no_pool(*args, **kwargs):
+            raise AssertionError("csvize should not start a process pool by default")
+
+        p = Partition(db.path)
+        pool = multiprocessing.Pool
+        multiprocessing.Pool = no_pool
+
+        try:
+            parts = p.csvize(rows_per_seg=4)
+        finally:
+            multiprocessing.Pool = pool
+
+        self.assertEquals([(0, 3, 4), (4, 7, 4), (8, 9, 2)], [part.stats for part in parts])
+
+        with open(parts[2].database.path) as f:
+            self.assertEquals(['8|2014-01-09|2014-01-01 08:30:00', '9|2014-01-10|2014-01-01 09:30:00'],
+                              f.read().splitlines())
+
+        # A pool of processes writes the same segments
+        pool_parts = Partition(db.path).csvize(rows_per_seg=4, n=2)
+
+        self.assertEquals([(0, 3, 4), (4, 7, 4), (8, 9, 2)], [part.stats for part in pool_parts])
+
+        with open(pool_parts[2].database.path) as f:
+            self.assertEquals(['8|2014-01-09|2014-01-01 08:30:00', '9|2014-01-10|2014-01-01 09:30:00'],
+                              f.read().splitlines())
+
+        for part in parts + pool_parts:
+            os.remove(part.database.path)
+
+        db.delete()
+
+    def test_select_numpy(self):
+        """The chunked numpy and pandas selectors should return all of the rows"""
+
+        p = self.bundle.partitions.find(table='tthree')
+
+        rows = list(p.query('SELECT * FROM tthree ORDER BY id'))
+
+        a = p.select().numpy
+        self.assertEquals(len(rows), len(a))
+        self.assertEquals('i', a.dtype['id'].kind)
+        self.assertEquals([ r['id'] for r in rows ], list(a['id']))
+
+        chunks = list(p.select().iter_numpy(chunksize=3000))
+        self.assertEquals(len(rows), sum(len(c) for c in chunks))
+        self.assertTrue(all(len(c) <= 3000 for c in chunks))
+
+        df = p.select(index_col='id').pandas
+        self.assertEquals(len(rows), len(df))
+        self.assertEquals(rows[10]['id'], df.index[10])
+
+    def test_tempfile_writers(self):
+        """Tempfile writers should keep no more than max_open files open"""
+        from ambry.sourcesupport.uscensus import TempfileWriters
+        import tempfile
+        import shutil
+        import csv
+
+        d = tempfile.mkdtemp()
+        paths = [os.path.join(d, 't{}.csv'.format(i)) for i in range(5)]
+
+        writers = TempfileWriters(max_open=2)
+
+        for i in range(20):
+            writers.writerow(paths[i % 5], [i, 'v{}'.format(i)], header=['id', 'value'])
+            self.assertTrue(len(writers._open) <= 2)
+
+        writers.close()
+
+        self.assertEquals(15, writers.reopens)
+
+        for j, path in enumerate(paths):
+            with open(path) as f:
+                rows = list(csv.reader(f))
+
+            self.assertEquals(['id', 'value'], rows[0])
+            self.assertEquals([str(i) for i in range(j, 20, 5)], [r[0] for r in rows[1:]])
+
+        shutil.rmtree(d)
+
+    def test_row_hash(self):
+        """The md5 hash mode should be unchanged, and batches should match single rows"""
+        import hashlib
+        from ambry.dbexceptions import DependencyError
+
+        t = self.bundle.schema.table('tthree')
+
+        values = lambda i: [i, u'caf\xe9 {}'.format(i), 'abc\xff', 1.5*i, None]
+        rows = [ [ values(i)[j % 5] for j in range(len(t.columns)) ] for i in range(100) ]
+
+        def md5_hash(row):
+            m = hashlib.md5()
+            for x in [ row[j] for j in t._hash_indexes() ]:
+                m.update((x.encode('utf-8') if isinstance(x, unicode) else str(x))+'|')
+            return int(m.hexdigest()[:14], 16)
+
+        row_hash = t._get_hasher()
+        self.assertEquals([ md5_hash(r) for r in rows ], [ row_hash(r) for r in rows ])
+        self.assertEquals([ md5_hash(r) for r in rows ], t.row_hashes(rows))
+
+        t.data['hash_mode'] = 'xxhash'
+        t._row_hasher = None
+
+        try:
+            try:
+                import xxhash
+            except ImportError:
+                with self.assertRaises(DependencyError):
+                    t.row_hashes(rows)
+            else:
+                row_hash = t._get_hasher()
+                hashes = t.row_hashes(rows)
+
+                self.assertEquals([ row_hash(r) for r in rows ], hashes)
+                self.assertEquals(len(rows), len(set(hashes)))
+                self.assertTrue(all(0 <= h < 2**63 for h in hashes))
+        finally:
+            del t.data['hash_mode']
+            t._row_hasher = None
+
+    def test_census_fact_writers(self):
+        """The fact bundle splits states through the same bounded writers as the dim bundle"""
+        from ambry.sourcesupport.uscensus import UsCensusDimBundle, UsCensusFactBundle, TempfileWriters
+        import tempfile
+        import shutil
+        import csv
+
+        self.assertTrue(hasattr(UsCensusDimBundle, 'writers'))
+        self.assertTrue(hasattr(UsCensusFactBundle, 'writers'))
+
+        # Without __init__, which needs a bundle directory
+        b = UsCensusFactBundle.__new__(UsCensusFactBundle)
+        b._writers = None
+        b.max_open_files = 2
+
+        self.assertIsInstance(b.writers, TempfileWriters)
+        self.assertIs(b.writers, b.writers)
+
+        d = tempfile.mkdtemp()
+
+        # One tempfile per fact table for a state, more tables than open files
+        paths = [os.path.join(d, 'fact{}-ca.csv'.format(i)) for i in range(3)]
+
+        for logrecno in range(4):
+            for path in paths:
+                b.writers.writerow(path, ['ca', logrecno], header=['state', 'logrecno'])
+
+        b.writers.close()
+
+        for path in paths:
+            with open(path) as f:
+                self.assertEquals([['state', 'logrecno']] + [['ca', str(i)] for i in range(4)], list(csv.reader(f)))
+
+        shutil.rmtree(d)
+
+    def test_prefetch(self):
+        """Prefetch downloads uncached files through download_many and counts the failures"""
+        from ambry.bundle import BuildBundle
+        from ambry.sourcesupport.uscensus import UsCensusBundle
+        from ambry.filesystem import BundleFilesystem
+        from ambry.util import temp_file_name
+        import yaml
+
+        # A census bundle with no urls file config entry has nothing to prefetch
+        b = UsCensusBundle.__new__(UsCensusBundle)
+        self.assertEquals([], b.prefetch_urls())
+
+        # In test mode, both the geos and the tables are limited to one state
+        class RunArgs(object):
+            test = True
+
+        b.run_args = RunArgs()
+        b.urls_file = temp_file_name()
+
+        with open(b.urls_file, 'w') as f:
+            f.write(yaml.dump({'geos': {'ca': 'http://x/ca-geo', 'nv': 'http://x/nv-geo'},
+                               'tables': {'ca': {1: 'http://x/ca-1', 2: 'http://x/ca-2'},
+                                          'nv': {1: 'http://x/nv-1'}}}))
+
+        b._urls_cache = None
+
+        self.assertEquals(b.urls['geos'].keys(), b.urls['tables'].keys())
+        self.assertEquals(3, len(b.prefetch_urls()))
+
+        os.remove(b.urls_file)
+
+        path = temp_file_name()
+
+        with open(path, 'w') as f:
+            f.write('x' * 100)
+
+        class Filesystem(BundleFilesystem):
+            def __init__(self):
+                self.downloaded = []
+
+            def download_cached(self, url):
+                return path if url == 'cached' else None
+
+            def download(self, url, test_f=None, n=4):
+                if url == 'bad':
+                    raise IOError('Failed')
+                self.downloaded.append(url)
+                return path
+
+        class Bundle(BuildBundle):
+            def __init__(self):
+                self.filesystem = Filesystem()
+                self.errors = []
+
+            def prefetch_urls(self):
+                return ['cached', 'a', 'bad', 'b', 'a']
+
+            def log(self, message, **kwargs):
+                pass
+
+            def error(self, message, **kwargs):
+                self.errors.append(message)
+
+        b = Bundle()
+
+        self.assertEquals(1, b.prefetch(n=2))
+        self.assertEquals(['a', 'b'], sorted(b.filesystem.downloaded))
+        self.assertEquals(1, len(b.errors))
+
+        # Without an errors dict, download_many raises the failure
+        with self.assertRaises(IOError):
+            b.filesystem.download_many(['a', 'bad'])
+
+        os.remove(path)
+
+    def test_build_scheduler(self):
+        """The scheduler runs the largest tasks first, and collects failures without retrying by default"""
+        from ambry.bundle import BuildBundle
+        from ambry.bundle.scheduler import BuildScheduler
+        from ambry.dbexceptions import ProcessError
+        from ambry.util import AttrDict
+        import tempfile
+        import shutil
+
+        class Bundle(BuildBundle):
+            def __init__(self, multi=1):
+                self.run_args = AttrDict(multi=multi)
+                self.calls = []
+                self.errors = []
+
+            def build_part(self, name):
+                self.calls.append(name)
+                if name == 'bad':
+                    raise Exception('Failed')
+
+            def log(self, message, **kwargs):
+                pass
+
+            def error(self, message, **kwargs):
+                self.errors.append(message)
+
+        b = Bundle()
+        scheduler = BuildScheduler(b, n=1)
+
+        for name, cost in [('small', 1), ('bad', 5), ('large', 10), ('medium', 3)]:
+            scheduler.add(b.build_part, name, cost=cost)
+
+        failures = scheduler.run()
+
+        self.assertEquals(['large', 'bad', 'medium', 'small'], b.calls)
+        self.assertEquals(['bad'], [t.args[0] for t in failures])
+        self.assertEquals(1, failures[0].attempts)
+        self.assertIn('Failed', failures[0].error)
+
+        b = Bundle()
+        scheduler = BuildScheduler(b, n=1, retries=2)
+        scheduler.add('build_part', 'bad')
+        scheduler.add('build_part', 'good')
+        self.assertEquals(3, scheduler.run()[0].attempts)
+        self.assertEquals(['bad', 'good', 'bad', 'bad'], b.calls)
+
+        with self.assertRaises(ProcessError):
+            Bundle().run_mp(b.build_part, ['good', 'bad'])
+
+        # In the pool, each worker loads the bundle from the bundle directory
+        d = tempfile.mkdtemp()
+
+        with open(os.path.join(d, 'bundle.py'), 'w') as f:
+            f.write('import os\n'
+                    'class Bundle(object):\n'
+                    '    def __init__(self, bundle_dir):\n'
+                    '        self.bundle_dir = bundle_dir\n'
+                    '    def build_part(self, name):\n'
+                    '        if name == "bad":\n'
+                    '            raise Exception("Failed")\n'
+                    '        open(os.path.join(self.bundle_dir, name), "w").close()\n')
+
+        b = Bundle(multi=2)
+        b.bundle_dir = d
+
+        scheduler = BuildScheduler(b, n=2)
+
+        for name in ['a', 'bad', 'b']:
+            scheduler.add('build_part', name)
+
+        self.assertEquals(['bad'], [t.args[0] for t in scheduler.run()])
+        self.assertTrue(os.path.exists(os.path.join(d, 'a')))
+        self.assertTrue(os.path.exists(os.path.join(d, 'b')))
+
+        shutil.rmtree(d)
+
     def test_session(self):
 
         from ambry.database.sqlite import logger
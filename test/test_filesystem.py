@@ -131,6 +131,191 @@ class Test(TestBase):
 
         os.remove(fn)
 
+    def test_compressed_csv(self):
+        '''CSV files written with a codec should be read back transparently'''
+        from ambry.database.csv import ValueInserter
+        from ambry.util.compression import open_compressed, detect_codec, available_codecs
+        from ambry.util import temp_file_name
+        import unicodecsv
+
+        rows = [ [i, u'caf\xe9 {}'.format(i), i * 1.5] for i in range(100000) ]
+
+        for codec in [None] + available_codecs():
+            fn = temp_file_name()
+
+            ins = ValueInserter(fn, None, None, header=['id', 'name', 'value'], write_header=True,
+                                compression=codec, compression_level=1)
+
+            for row in rows:
+                ins.insert(row)
+
+            ins.close()
+
+            self.assertEquals(codec, detect_codec(fn))
+
+            with open_compressed(fn) as f:
+                read = list(unicodecsv.reader(f, delimiter='|', encoding='utf-8'))
+
+            self.assertEquals(['id', 'name', 'value'], read[0])
+            self.assertEquals(len(rows), len(read) - 1)
+            self.assertEquals([u'99999', u'caf\xe9 99999', u'149998.5'], read[-1])
+
+            os.remove(fn)
+
+    def test_compression_cache_put(self):
+        '''The compression cache should compress streams that can't seek, and only send HTTP
+        content codings as the Content-Encoding'''
+        from ambry.cache.filesystem import FsCompressionCache
+        from ambry.util.compression import MAGIC
+        from StringIO import StringIO
+        import tempfile
+        import shutil
+        import gzip
+
+        class Stream(object):
+            '''A stream that can only be read, like a socket or pipe'''
+            def __init__(self, data):
+                self._f = StringIO(data)
+
+            def read(self, n=-1):
+                return self._f.read(n)
+
+        cache_dir = tempfile.mkdtemp()
+        cache = FsCompressionCache(upstream=dict(dir=cache_dir), level=1)
+
+        data = 'x' * 100000
+        cache.put(Stream(data), 'foo')
+
+        self.assertEquals(data, gzip.open(cache.path('foo')).read())
+        self.assertEquals('gzip', cache.upstream.metadata(cache._rename('foo'))['Content-Encoding'])
+
+        # Already compressed with a codec that isn't an HTTP content coding
+        cache.put(StringIO(MAGIC['lz4'] + 'data'), 'bar')
+
+        self.assertEquals('lz4', cache.upstream.metadata(cache._rename('bar'))['compression'])
+        self.assertNotIn('Content-Encoding', cache.upstream.metadata(cache._rename('bar')))
+
+        shutil.rmtree(cache_dir)
+
+    def test_parallel_compression(self):
+        '''Block compressed files should be readable by gzip and sgzip, and through the cache'''
+        from ambry.cache.filesystem import FsCompressionCache
+        from ambry.util.compression import ParallelGzipWriter
+        from ambry.util.sgzip import GzipFile
+        from ambry.util import temp_file_name
+        import gzip
+        import tempfile
+        import shutil
+        import random
+
+        data = ''.join('{}:{}\n'.format(i, random.randint(0, 1000)) for i in range(300000))
+
+        fn = temp_file_name()
+
+        with ParallelGzipWriter(open(fn, 'wb'), level=1, threads=3, block_size=100000) as w:
+            for i in range(0, len(data), 65536):
+                w.write(data[i:i+65536])
+
+        self.assertEquals(data, gzip.open(fn).read())
+
+        with open(fn) as f:
+            self.assertEquals(data, GzipFile(f).read())
+
+        with open(fn, 'wb') as f:
+            f.write(data)
+
+        cache_dir = tempfile.mkdtemp()
+        cache = FsCompressionCache(upstream=dict(dir=cache_dir), level=1, threads=3)
+
+        cache.put(fn, 'foo')
+
+        self.assertEquals(data, gzip.open(cache.path('foo')).read())
+        self.assertEquals(data, cache.get_stream('foo').read(len(data) + 1))
+
+        shutil.rmtree(cache_dir)
+        os.remove(fn)
+
+    def test_seekable_compression(self):
+        '''Block indexed files should read byte and line ranges from the covering blocks'''
+        from ambry.cache.filesystem import FsCompressionCache
+        from ambry.util import temp_file_name
+        import tempfile
+        import shutil
+        import gzip
+
+        lines = [ '{}:{}\n'.format(i, 'x' * (i % 50)) for i in range(50000) ]
+        data = ''.join(lines)
+
+        fn = temp_file_name()
+
+        with open(fn, 'wb') as f:
+            f.write(data)
+
+        cache_dir = tempfile.mkdtemp()
+        cache = FsCompressionCache(upstream=dict(dir=cache_dir), level=1, block_size=10000)
+
+        cache.put(fn, 'foo')
+
+        self.assertTrue(os.path.exists(cache.path('foo')+'.idx'))
+        self.assertEquals(data, gzip.open(cache.path('foo')).read())
+
+        r = cache.get_seekable('foo')
+
+        self.assertEquals(len(data), r.index.size)
+        self.assertEquals(len(lines), r.index.lines)
+
+        fetched = []
+        fetch = r._fetch
+        r._fetch = lambda start, end: fetched.append((start, end)) or fetch(start, end)
+
+        r.seek(len(data) / 2)
+        self.assertEquals(data[len(data)/2:len(data)/2 + 25000], r.read(25000))
+        self.assertEquals(3, len(fetched)) # Only the three blocks that cover the range
+
+        self.assertEquals(lines[30000:30010], r.read_lines(30000, 10))
+        self.assertEquals(lines[:3], r.read_lines(0, 3))
+        self.assertEquals(lines[-2:], r.read_lines(len(lines) - 2, 5))
+
+        # Sequential reads stay in the loaded block instead of searching the index
+        lookups = []
+        block_for_offset = r.index.block_for_offset
+        r.index.block_for_offset = lambda offset: lookups.append(offset) or block_for_offset(offset)
+
+        r.seek(0)
+        self.assertEquals(lines, list(r))
+        self.assertLessEqual(len(lookups), len(r.index) + 1)
+
+        self.assertEquals(len(r.index) - 1, r.index.block_for_offset(len(data) - 1))
+        self.assertEquals(1, r.index.block_for_offset(r.index.blocks[1][0]))
+
+        # A server that ignores the range is only asked for the whole file once
+        import requests
+        from ambry.util.compression import http_fetcher, BlockGzipReader
+
+        class Response(object):
+            status_code = 200
+            content = open(cache.path('foo'), 'rb').read()
+
+            def raise_for_status(self):
+                pass
+
+        gets = []
+        get = requests.get
+        requests.get = lambda url, **kwargs: gets.append(url) or Response()
+
+        try:
+            r = BlockGzipReader(http_fetcher('http://example.com/foo'), r.index)
+            self.assertEquals(lines, list(r))
+            self.assertEquals(1, len(gets))
+        finally:
+            requests.get = get
+
+        cache.remove('foo')
+        self.assertFalse(os.path.exists(cache.path('foo')+'.idx'))
+
+        shutil.rmtree(cache_dir)
+        os.remove(fn)
+
     def test_md5(self):
         from ambry.run import  get_runconfig
         from ambry.cache import new_cache
@@ -162,6 +347,159 @@ class Test(TestBase):
 
         os.remove(fn)
 
+    def test_limited_cache(self):
+        '''Eviction from the limited cache should follow the policy'''
+        from ambry.cache.filesystem import FsLimitedCache
+        import tempfile
+        import shutil
+
+        fn = self.make_test_file() # 4000 bytes
+
+        for policy in ('lru', 'lfu'):
+            cache_dir = tempfile.mkdtemp()
+
+            cache = FsLimitedCache(cache_dir, size=1, policy=policy)
+            cache.maxsize = 13000
+
+            for i in range(3):
+                cache.put(fn, 'f{}'.format(i))
+
+            cache.get('f0')
+            cache.get('f0')
+            cache.get('f1')
+            self.assertIsNone(cache.get('missing'))
+
+            # Gets are recorded in memory, not written to the database on every hit
+            self.assertEquals([0, 0, 0], [r[0] for r in cache.database.execute('SELECT hits FROM files ORDER BY path')])
+
+            cache.put(fn, 'f3')
+
+            # Freeing space down to the low water mark evicts two files. Both policies evict
+            # f2 first, then LRU evicts f0, and LFU evicts f1
+            kept = ['f1', 'f3'] if policy == 'lru' else ['f0', 'f3']
+
+            self.assertEquals(kept, sorted(r[0] for r in cache.database.execute('SELECT path FROM files')))
+            self.assertEquals(8000, cache.size)
+            self.assertEquals(dict(hits=3, misses=1, evictions=2, evicted_bytes=8000), cache.stats)
+
+            cache.verify()
+
+            shutil.rmtree(cache_dir)
+
+        os.remove(fn)
+
+    def test_limited_cache_threads(self):
+        '''The limited cache should work from threads other than the one that opened it'''
+        from ambry.cache.filesystem import FsLimitedCache
+        from multiprocessing.pool import ThreadPool
+        import tempfile
+        import shutil
+
+        fn = self.make_test_file()
+        cache_dir = tempfile.mkdtemp()
+
+        cache = FsLimitedCache(cache_dir, size=1)
+        cache.put(fn, 'f0')
+
+        pool = ThreadPool(4)
+
+        try:
+            paths = pool.map(lambda i: cache.get('f0'), range(8))
+            pool.map(lambda i: cache.put(fn, 'f{}'.format(i)), range(1, 5))
+            connections = pool.map(lambda i: cache.database, range(8))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEquals([os.path.join(cache_dir, 'f0')] * 8, paths)
+        self.assertNotIn(cache.database, connections)
+        self.assertEquals(['f{}'.format(i) for i in range(5)],
+                          sorted(r[0] for r in cache.database.execute('SELECT path FROM files')))
+        self.assertEquals(8, cache.database.execute("SELECT hits FROM files WHERE path = 'f0'").fetchone()[0])
+
+        cache.verify()
+
+        shutil.rmtree(cache_dir)
+        os.remove(fn)
+
+    def test_ranged_download(self):
+        '''Download a file in parts from a local server that accepts ranges'''
+        from ambry.filesystem import RangedDownload, DownloadFailedError
+        from ambry.util import md5_for_file, temp_file_name
+        import BaseHTTPServer
+        import threading
+        import hashlib
+        import random
+
+        data = ''.join(chr(random.randint(0, 255)) for i in range(1000000))
+        ranges = []
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                rng = self.headers.getheader('Range')
+
+                if self.path == '/empty':
+                    # There is no range of an empty file
+                    self.send_response(416 if rng else 200)
+                    if rng:
+                        self.send_header('Content-Range', 'bytes */0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if rng:
+                    start, end = rng.split('=')[1].split('-')
+                    start, end = int(start), int(end) if end else len(data) - 1
+                    ranges.append((start, end))
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+                else:
+                    start, end = 0, len(data) - 1
+                    self.send_response(200)
+
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                self.wfile.write(data[start:end+1])
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(('localhost', 0), Handler)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+
+        url = 'http://localhost:{}/file'.format(server.server_port)
+        md5 = hashlib.md5(data).hexdigest()
+
+        path = temp_file_name()
+
+        # A partial first part should be resumed, not fetched again
+        with open(path+'.part0', 'wb') as f:
+            f.write(data[:1000])
+
+        RangedDownload(url, path, n=4, part_size=100000, md5=md5).run()
+
+        self.assertEquals(md5, md5_for_file(path))
+        self.assertIn((1000, 99999), ranges)
+        self.assertEquals(11, len(ranges)) # The probe and ten parts
+        self.assertFalse(os.path.exists(path+'.part0'))
+
+        with self.assertRaises(DownloadFailedError):
+            RangedDownload(url, path, part_size=100000, md5='0'*32).run()
+
+        self.assertFalse(os.path.exists(path))
+
+        # An empty file is fetched with a plain request
+        empty_url = 'http://localhost:{}/empty'.format(server.server_port)
+        RangedDownload(empty_url, path, md5=hashlib.md5('').hexdigest()).run()
+
+        self.assertEquals(0, os.path.getsize(path))
+        os.remove(path)
+
+        server.shutdown()
+
     def test_s3(self):
         from ambry.run import  get_runconfig
         from ambry.cache import new_cache
@@ -473,6 +473,181 @@ class Test(TestBase):
 
 
 
+    def test_bundle_records_schema_versions(self):
+        """Install the records of bundle files that have different columns"""
+        from ambry.library.database import LibraryDb, read_bundle_records
+        from ambry.identity import Identity, Name, DatasetNumber
+        from ambry.orm import Dataset, Config, Table, Column, Partition
+        from ambry.util import temp_file_name
+        from sqlalchemy import create_engine, MetaData
+        from sqlalchemy import Table as SATable
+
+        def write_bundle(rev, drop=()):
+            """Write a bundle file with the library's tables, less the columns in drop"""
+
+            path = temp_file_name() + '.db'
+            engine = create_engine('sqlite:///{}'.format(path))
+            metadata = MetaData()
+
+            tables = {}
+            for orm_class in (Dataset, Config, Table, Column, Partition):
+                t = orm_class.__table__
+                tables[t.name] = SATable(t.name, metadata, *[ c.copy() for c in t.columns if c.name not in drop ])
+
+            metadata.create_all(engine)
+
+            ident = Identity(Name(source='source.com', dataset='foobar{}'.format(rev), version='0.0.1'),
+                             DatasetNumber(rev, 1))
+            t_vid = ident.vid.replace('d', 't', 1) + '01'
+            p_vid = ident.as_partition(1).vid
+
+            rows = dict(
+                datasets=[ dict(d_vid=ident.vid, d_id=ident.id_, d_name=ident.sname, d_vname=ident.vname,
+                                d_fqname=ident.fqname, d_cache_key=ident.cache_key, d_source='source.com',
+                                d_dataset=ident.name.dataset, d_revision=1, d_version='0.0.1', d_creator='test') ],
+                config=[ dict(co_d_vid=ident.vid, co_group='info', co_key='type', co_value='bundle') ],
+                tables=[ dict(t_vid=t_vid, t_id=t_vid[:-2], t_d_vid=ident.vid, t_sequence_id=1, t_name='t1') ],
+                columns=[ dict(c_vid=t_vid.replace('t', 'c', 1) + '001', c_t_vid=t_vid, c_sequence_id=1,
+                               c_name='id', c_is_primary_key=True, c_description='The key') ],
+                partitions=[ dict(p_vid=p_vid, p_id=p_vid[:-3], p_d_vid=ident.vid, p_sequence_id=1,
+                                  p_name=ident.as_partition(1).sname, p_vname=ident.as_partition(1).vname,
+                                  p_fqname=ident.as_partition(1).fqname,
+                                  p_cache_key='cache/{}'.format(rev), p_time='2010', p_format='db') ])
+
+            with engine.begin() as conn:
+                for table_name, table_rows in rows.items():
+                    conn.execute(tables[table_name].insert(),
+                                 [ { k: v for k, v in row.items() if k not in drop } for row in table_rows ])
+
+            engine.dispose()
+
+            return path, ident
+
+        # An older file, with fewer columns, is first, so its rows would set the columns of the inserts
+        old_path, old_ident = write_bundle(1, drop=('c_is_primary_key', 'c_description', 'p_time', 'p_format'))
+        new_path, new_ident = write_bundle(2)
+
+        lpath = temp_file_name() + '.db'
+        ldb = LibraryDb(driver='sqlite', dbname=lpath)
+        ldb.create()
+
+        try:
+            records = [ read_bundle_records(path)[1] for path in (old_path, new_path) ]
+
+            self.assertEquals(None, records[0]['partitions'][0]['p_time'])
+            self.assertEquals(False, records[0]['columns'][0]['c_is_primary_key'])
+
+            ldb.install_bundle_records(records)
+            ldb.commit()
+
+            s = ldb.session
+
+            new_p = s.query(Partition).filter(Partition.d_vid == new_ident.vid).one()
+            self.assertEquals('2010', new_p.time)
+            self.assertEquals('db', new_p.format)
+
+            old_p = s.query(Partition).filter(Partition.d_vid == old_ident.vid).one()
+            self.assertEquals('cache/1', old_p.cache_key)
+            self.assertEquals(None, old_p.time)
+
+            new_c = s.query(Column).join(Table).filter(Table.d_vid == new_ident.vid).one()
+            self.assertTrue(new_c.is_primary_key)
+            self.assertEquals('The key', new_c.description)
+
+            old_c = s.query(Column).join(Table).filter(Table.d_vid == old_ident.vid).one()
+            self.assertFalse(old_c.is_primary_key)
+            self.assertEquals(None, old_c.description)
+        finally:
+            ldb.close()
+            for path in (old_path, new_path, lpath):
+                os.remove(path)
+
+    def test_resolver_cache(self):
+        from ambry.library.database import LibraryDb
+        from ambry.identity import Identity, Name, DatasetNumber
+        from ambry.orm import Dataset, Partition
+        from ambry.util import temp_file_name
+        from sqlalchemy import event
+
+        path = temp_file_name() + '.db'
+        db = LibraryDb(driver='sqlite', dbname=path)
+        db.create()
+
+        def install(rev):
+            ident = Identity(Name(source='source.com', dataset='foobar', version='0.0.{}'.format(rev)),
+                             DatasetNumber(1, rev))
+            db.install_dataset_identity(ident)
+
+            s = db.session
+            d = ident.as_partition(3, time='2010').dict
+            del d['dataset']
+            p = Partition(s.query(Dataset).filter(Dataset.vid == ident.vid).one(), **d)
+            s.add(p)
+            s.commit()
+            ident.partition_vid = p.vid
+
+            return ident
+
+        idents = [install(1), install(2)]
+
+        refs = [idents[0].vid, idents[1].vname, idents[0].sname, idents[0].cache_key,
+                idents[0].partition_vid, 'foo-bar']
+
+        queries = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.append(args[2]))
+
+        try:
+            expected = [ str(db.resolver.resolve(ref)) for ref in refs ]
+            self.assertEquals(idents[1].vid, db.resolver.resolve(idents[0].sname).vid)
+
+            # Cached, and the change time was checked recently, so there are no queries
+            del queries[:]
+            self.assertEquals(expected, [ str(db.resolver.resolve(ref)) for ref in refs ])
+            self.assertEquals(0, len(queries))
+
+            # After the check interval, the change time is queried once
+            db.resolver_cache._checked -= db.resolver_cache.check_interval
+            self.assertEquals(expected, [ str(db.resolver.resolve(ref)) for ref in refs ])
+            self.assertEquals(1, len(queries))
+
+            # The results are new identities, so callers can modify them
+            self.assertIsNot(db.resolver.resolve(refs[0]), db.resolver.resolve(refs[0]))
+
+            db.resolver_cache.clear()
+            r = db.resolver.resolve_many(refs + refs)
+            self.assertEquals(refs, r.keys())
+            self.assertEquals(expected, [ str(ident) for ident in r.values() ])
+            self.assertEquals(idents[0].partition_vid, r[refs[4]].partition.vid)
+
+            # One query for the dataset vids and one for the partition vids, plus the subquery
+            # load of the partition tables
+            db.resolver_cache.clear()
+            del queries[:]
+            vids = [ ident.vid for ident in idents ] + [ ident.partition_vid for ident in idents ]
+            r = db.resolver.resolve_many(vids)
+            self.assertEquals(vids[:2], [ ident.vid for ident in r.values()[:2] ])
+            self.assertEquals(vids[2:], [ ident.partition.vid for ident in r.values()[2:] ])
+            self.assertEquals(3, len(queries))
+
+            # Changes from another process are seen after the check interval
+            other = LibraryDb(driver='sqlite', dbname=path)
+            other._mark_update()
+            other.close()
+
+            self.assertTrue(len(db.resolver_cache))
+            db.resolver_cache.validate()
+            self.assertTrue(len(db.resolver_cache))
+            db.resolver_cache._checked -= db.resolver_cache.check_interval
+            db.resolver_cache.validate()
+            self.assertEquals(0, len(db.resolver_cache))
+
+            # Writes to the library invalidate the cache
+            install(3)
+            self.assertEquals('d000000001003', db.resolver.resolve(idents[0].sname).vid)
+        finally:
+            db.close()
+            os.remove(path)
+
     def test_cache(self):
         
         from ambry.cache.filesystem import  FsCache, FsLimitedCache
@@ -53,8 +53,99 @@ class Test(TestBase):
         sleep(4)
         self.assertNotEquals(o, g(1))
 
+    def test_lru_threads(self):
+        from ambry.util import lru_cache
+        from multiprocessing.pool import ThreadPool
+
+        @lru_cache(maxsize=10, maxtime=None)
+        def f(x):
+            return x * 2
+
+        pool = ThreadPool(8)
+        results = pool.map(lambda x: f(x % 25), range(5000))
+        pool.close()
+        pool.join()
+
+        self.assertEquals([(x % 25) * 2 for x in range(5000)], results)
+        self.assertEquals(5000, f.hits + f.misses)
+
+    def test_lru_clear_threads(self):
+        """Results computed across a clear() are returned, but not cached"""
+        from ambry.util import lru_cache
+        import threading
+
+        started = [threading.Event(), threading.Event()]
+        release = threading.Event()
+        version = [0]
+
+        @lru_cache(maxsize=1, maxtime=None)
+        def f(x):
+            v = version[0]
+            if x < 2:
+                started[x].set()
+                release.wait()
+            return x, v
+
+        results = {}
+
+        def call(x):
+            results[x] = f(x)
+
+        threads = [ threading.Thread(target=call, args=(x,)) for x in range(2) ]
+        for t in threads:
+            t.start()
+
+        for e in started:
+            e.wait()
+
+        f.clear()
+        version[0] = 1
+
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEquals({0: (0, 0), 1: (1, 0)}, results)
+
+        # The results from before the clear weren't stored, so they are computed again
+        self.assertEquals((0, 1), f(0))
+        self.assertEquals((1, 1), f(1))
+        self.assertEquals((1, 1), f(1))
+        self.assertEquals(1, f.hits)
+        self.assertEquals(2, f.misses)
+
+    def test_hash_index(self):
+        from ambry.database.hashindex import HashIndex
+        from ambry.util import temp_file_name
+        import random
+
+        hashes = random.sample(xrange(2**56), 10000)
+
+        index = HashIndex(None, temp_file_name()).writer
+
+        for pk, h in enumerate(hashes[:5000]):
+            index[h] = pk
+
+        index.write([str(h) for h in hashes[5000:]], range(5000, 10000))
+        index[hashes[0]] = 99999 # The later key replaces the earlier one
+
+        index.close()
+
+        index = index.reader
+
+        self.assertEquals(10000, len(index))
+        self.assertEquals(99999, index[hashes[0]])
+        self.assertEquals(7, index[str(hashes[7])])
+        self.assertEquals(range(1, 10000, 3), list(index.lookup(hashes[1::3])))
+
+        with self.assertRaises(KeyError):
+            index.lookup([hashes[1], 2**57])
+
+        index.delete()
+        self.assertFalse(index.exists)
+
+
 
-        
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(Test))
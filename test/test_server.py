@@ -75,6 +75,54 @@ class Test(TestBase):
     
         return True
 
+    def test_stream_csv(self):
+        """A streamed CSV segment should be the same as the rows written through SqlAlchemy"""
+        from ambry.server.main import _stream_csv, _table_segments
+        from ambry.database.sqlite import SqliteDatabase
+        from ambry.util import temp_file_name
+        from sqlalchemy import Table, Column, Integer, String, Date, DateTime, MetaData, text
+        from StringIO import StringIO
+        import datetime
+        import unicodecsv
+        import zlib
+
+        db = SqliteDatabase(temp_file_name() + '.db')
+        db.create()
+
+        # A TIMESTAMP column is converted by the partition's engine, and written without the
+        # microseconds that SqlAlchemy stores
+        db.connection.execute('CREATE TABLE stream_test (id INTEGER PRIMARY KEY, name TEXT, day DATE, time TIMESTAMP)')
+
+        table = Table('stream_test', MetaData(), Column('id', Integer, primary_key=True),
+                      Column('name', String), Column('day', Date), Column('time', DateTime))
+
+        db.connection.execute(table.insert(), [
+            dict(id=i, name=u'caf\xe9 {}'.format(i), day=datetime.date(2014, 1, 1 + i % 28),
+                 time=datetime.datetime(2014, 1, 1, i % 24, 30)) for i in range(100)])
+
+        segment = _table_segments(db.path, 0, 'stream_test', 'id', 3)[1]
+        self.assertEquals((33, 65), segment)
+
+        q = 'SELECT * FROM "stream_test" WHERE "id" >= :min_pk AND "id" <= :max_pk ORDER BY "id"'
+        params = dict(min_pk=segment[0], max_pk=segment[1])
+
+        out = StringIO()
+        writer = unicodecsv.writer(out, delimiter=',')
+        writer.writerow(('id', 'name', 'day', 'time'))
+        for row in db.connection.execute(text(q), params):
+            writer.writerow(tuple(row))
+
+        csv = ''.join(_stream_csv(db.path, q, params, ['id', 'name', 'day', 'time'], ',', False, chunk_rows=10))
+
+        self.assertEquals(out.getvalue(), csv)
+        self.assertEquals(33, len(csv.splitlines()) - 1)
+
+        gz = ''.join(_stream_csv(db.path, q, params, ['id', 'name', 'day', 'time'], ',', True, chunk_rows=10))
+
+        self.assertEquals(csv, zlib.decompress(gz, 16 + zlib.MAX_WBITS))
+
+        db.delete()
+
     def test_connection(self):
         '''
         Test some of the server's test functions
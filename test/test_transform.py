@@ -125,7 +125,119 @@ class Test(TestBase):
         row, errors = ctb({'int': '.', 'float': 'a', 'str': '3', 'ni1': 0, 'ni2': 3 },
                           codify_cast_errors=True)
 
-        
+    def test_caster_list(self):
+        from ambry.transform import CasterTransformBuilder, NaturalInt, CastingError
+        import datetime
+
+        ctb = CasterTransformBuilder()
+
+        ctb.append('int',int)
+        ctb.append('float',float)
+        ctb.append('str',str)
+        ctb.append('date',datetime.date)
+
+        row, errors = ctb([1, 2, 3, '1990-01-01'])
+
+        self.assertEquals(row, [1, 2.0, u'3', datetime.date(1990, 1, 1)])
+        self.assertTrue(isinstance(row[0],int))
+        self.assertTrue(isinstance(row[1],float))
+        self.assertTrue(isinstance(row[2],unicode))
+        self.assertEquals(errors, {})
+
+        # Tuples, short rows and idempotence
+        self.assertEquals(ctb(tuple(row))[0], row)
+        self.assertEquals(ctb(('1', ''))[0], [1, None, None, None])
+
+        #
+        # Handling Errors
+        #
+
+        ctb = CasterTransformBuilder()
+
+        ctb.append('int', int)
+        ctb.append('ni', NaturalInt)
+        ctb.append('ni_code', str)
+        ctb.append('float', float)
+
+        row, errors = ctb(['5', 0, None, 'a'])
+
+        self.assertEquals(row, [5, None, 0, None])
+        self.assertEquals(errors, {'ni': 0, 'float': 'a'})
+
+        with self.assertRaises(CastingError):
+            ctb(['5', 0, None, 'a'], codify_cast_errors=False)
+
+    def test_caster_batch(self):
+        from ambry.transform import CasterTransformBuilder, NaturalInt
+        import datetime
+
+        ctb = CasterTransformBuilder()
+
+        ctb.append('int', int)
+        ctb.append('float', float)
+        ctb.append('str', str)
+        ctb.append('date', datetime.date)
+        ctb.append('ni', NaturalInt)
+        ctb.append('ni_code', str)
+
+        rows = [
+            ['1', '1.5', 'a', '1990-01-01', '1'],
+            [' 2 ', None, 'b', None, 0],
+            ['2.5', '', None, '1/2/1990', '3'],
+            (None, '-3', 'd', datetime.date(1990, 1, 4), 'x'),
+        ]
+
+        cast, errors = ctb.cast_batch(rows)
+
+        self.assertEquals(cast[0], [1, 1.5, u'a', datetime.date(1990, 1, 1), 1, None])
+        self.assertEquals(cast[1], [2, None, u'b', None, None, 0])
+        self.assertEquals(cast[2], [3, None, None, datetime.date(1990, 1, 2), 3, None])
+        self.assertEquals(cast[3], [None, -3.0, u'd', datetime.date(1990, 1, 4), None, 'x'])
+        self.assertTrue(isinstance(cast[0][0], int))
+        self.assertEquals(errors, {1: {'ni': 0}, 3: {'ni': 'x'}})
+
+        # Must agree with casting one row at a time.
+        for row, cast_row in zip(rows, cast):
+            self.assertEquals(ctb(row)[0], cast_row)
+
+        # Dicts of columns
+        cast, errors = ctb.cast_batch({'Int': ['1', None], 'date': ['1990-01-01', None], 'ni': [1, -1]})
+
+        self.assertEquals(cast['int'], [1, None])
+        self.assertEquals(cast['date'], [datetime.date(1990, 1, 1), None])
+        self.assertEquals(cast['str'], [None, None])
+        self.assertEquals(cast['ni_code'], [None, -1])
+        self.assertEquals(errors, {1: {'ni': -1}})
+
+    def test_caster_positional(self):
+        """Casting rows by position gives the same values as casting them as dicts"""
+        from ambry.transform import CasterTransformBuilder
+
+        ctb = CasterTransformBuilder()
+
+        header = []
+        for i in range(10):
+            for name, type_ in (('int', int), ('float', float), ('str', str)):
+                header.append('{}_{}'.format(name, i))
+                ctb.append(header[-1], type_)
+
+        rows = [ [ str(i), str(i/2.0), 'value {}'.format(i) ] * 10 for i in range(200) ]
+        rows[7][1] = 'not a float'
+
+        dict_rows = []
+        for row in rows:
+            d, _ = ctb(dict(zip(header, row)))
+            dict_rows.append([ d[k] for k in header ])
+
+        list_rows = [ ctb(row)[0] for row in rows ]
+
+        batch_rows, batch_errors = ctb.cast_batch(rows)
+
+        self.assertEquals(dict_rows, list_rows)
+        self.assertEquals(dict_rows, batch_rows)
+        self.assertIsNone(list_rows[7][1])
+        self.assertEquals([7], batch_errors.keys())
+
     def test_intuit(self):
         import pprint
                 
@@ -152,6 +152,542 @@ class Test(TestBase):
     def test_remote_postgres_install(self):
         self._test_remote_install('postgres1')
 
+    def test_load_tables(self):
+        from ambry.warehouse import WarehouseInterface
+        from ambry.warehouse.sqlite import SqliteWarehouse
+        from ambry.warehouse import NullLogger
+        from ambry.util import temp_file_name
+        import threading
+
+        class Identity(object):
+            format = 'db'
+
+        class Partition(object):
+            identity = Identity()
+
+            def __init__(self, path):
+                self.database = self
+                self.path = path
+
+        paths = []
+        for i in range(5):
+            paths.append(temp_file_name())
+            with open(paths[-1], 'wb') as f:
+                f.write('x' * 100000)
+
+        jobs = [(Partition(path), 'table{}'.format(i), None) for i, path in enumerate(paths)]
+        jobs.append((jobs[0][0], 'failing', None))
+
+        def make(cls):
+            class W(cls):
+                def _load_table(self, partition, table_name, urls):
+                    if table_name == 'failing':
+                        raise ValueError(table_name)
+
+                    self.threads.add(threading.current_thread().name)
+                    return 'w_' + table_name
+
+            w = W(database=object(), wlibrary=object(), elibrary=object(), logger=NullLogger())
+            w.threads = set()
+            return w
+
+        # Sqlite loads in job order, all in this thread.
+        w = make(SqliteWarehouse)
+        results = list(w._load_tables(jobs, 3))
+        self.assertEquals(['w_table{}'.format(i) for i in range(5)] + [None], [r[2] for r in results])
+        self.assertIsInstance(results[-1][3], ValueError)
+        self.assertEquals(set([threading.current_thread().name]), w.threads)
+
+        # Other warehouses load on a pool of loaders.
+        w = make(WarehouseInterface)
+        results = list(w._load_tables(jobs, 3))
+        self.assertEquals(set(['w_table{}'.format(i) for i in range(5)] + [None]), set(r[2] for r in results))
+        self.assertNotIn(threading.current_thread().name, w.threads)
+
+        for path in paths:
+            os.remove(path)
+
+    def test_copy_pipe(self):
+        from ambry.warehouse.postgres import PostgresWarehouse, copy_text_value
+        from ambry.warehouse import NullLogger
+
+        self.assertEquals('\\N', copy_text_value(None))
+        self.assertEquals('a\\tb\\nc\\\\', copy_text_value(u'a\tb\nc\\'))
+        self.assertEquals('0.1', copy_text_value(.1))
+        self.assertEquals('\xc3\xa9', copy_text_value(u'\xe9'))
+
+        class Cursor(object):
+            def copy_expert(self, sql, f, size=8192):
+                self.sql = sql
+                self.data = ''
+                while True:
+                    chunk = f.read(size)
+                    if not chunk:
+                        break
+                    self.data += chunk
+
+                self.rowcount = self.data.count('\n')
+
+        class Connection(object):
+            def cursor(self):
+                self.last_cursor = Cursor()
+                return self.last_cursor
+
+        w = PostgresWarehouse(database=object(), wlibrary=object(), elibrary=object(), logger=NullLogger())
+        w.copy_chunk_size = 100
+        w.copy_buffer_chunks = 2
+
+        def produce(pipe, n):
+            for i in range(n):
+                pipe.write('{}\n'.format(i))
+
+        conn = Connection()
+        sql = w._copy_sql('table', ['a', 'b'], 'text')
+        self.assertEquals(1000, w._copy(conn, sql, produce, 1000))
+        self.assertEquals(''.join('{}\n'.format(i) for i in range(1000)), conn.last_cursor.data)
+        self.assertEquals('COPY "public"."table" ("a","b") FROM STDIN WITH ( FORMAT text )', conn.last_cursor.sql)
+
+        # Errors in the producer are raised by the COPY
+        def fail(pipe):
+            pipe.write('0\n')
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            w._copy(conn, sql, fail)
+
+    def test_postgres_load_copy_remote(self):
+        """Segments are copied on several connections at once, and committed only if all succeed"""
+        from ambry.warehouse.postgres import PostgresWarehouse
+        from ambry.warehouse import NullLogger
+        from ambry.util import AttrDict
+        import threading
+
+        class Connection(object):
+            def __init__(self):
+                self.copied = []
+                self.state = 'open'
+
+            def commit(self):
+                self.state = 'committed'
+
+            def rollback(self):
+                self.state = 'rolled back'
+
+            def close(self):
+                self.closed = True
+
+        conns = []
+
+        def raw_connection():
+            conns.append(Connection())
+            return conns[-1]
+
+        threads = set()
+
+        class Warehouse(PostgresWarehouse):
+            def _copy(self, conn, sql, produce, url):
+                threads.add(threading.current_thread().name)
+                if url == 'bad':
+                    raise IOError('Failed to fetch segment')
+                conn.copied.append((sql, url))
+                return 1
+
+        database = AttrDict(engine=AttrDict(raw_connection=raw_connection))
+        w = Warehouse(database=database, wlibrary=object(), elibrary=object(), logger=NullLogger())
+
+        identity = AttrDict(name='source.com-foobar', vid='d000000001001',
+                            as_dataset=lambda: AttrDict(vid='d000000001001'))
+        partition = AttrDict(identity=identity)
+
+        urls = ['seg{}'.format(i) for i in range(7)]
+
+        self.assertEquals('d000000001001_t1', w.load_copy_remote(partition, 't1', urls, n=3))
+
+        self.assertEquals(3, len(conns))
+        self.assertEquals(['committed'] * 3, [ c.state for c in conns ])
+        self.assertEquals(sorted(urls), sorted(url for c in conns for _, url in c.copied))
+        self.assertEquals(set(['COPY "public"."d000000001001_t1"  FROM STDIN WITH ( FORMAT csv )']),
+                          set(sql for c in conns for sql, _ in c.copied))
+        self.assertNotIn(threading.current_thread().name, threads)
+        self.assertTrue(all(c.closed for c in conns))
+
+        # A failed segment rolls back all of the connections
+        del conns[:]
+        with self.assertRaises(IOError):
+            w.load_copy_remote(partition, 't1', urls[:5] + ['bad'], n=3)
+
+        self.assertEquals(['rolled back'] * 3, [ c.state for c in conns ])
+
+        # One connection copies the segments in order, in this thread
+        del conns[:]
+        threads.clear()
+        w.load_copy_remote(partition, 't1', urls, n=1)
+
+        self.assertEquals(urls, [ url for _, url in conns[0].copied ])
+        self.assertEquals(set([threading.current_thread().name]), threads)
+
+    def test_sqlite_load_remote(self):
+        from ambry.warehouse.sqlite import SqliteWarehouse
+        from ambry.warehouse import NullLogger
+        from ambry.database import new_database
+        from ambry.transform import CasterTransformBuilder
+        from ambry.util import temp_file_name
+        from SimpleHTTPServer import SimpleHTTPRequestHandler
+        from BaseHTTPServer import HTTPServer
+        import threading
+        import tempfile
+        import gzip
+
+        # Serve CSV segments, some of them gzipped
+        root = tempfile.mkdtemp()
+        for i in range(4):
+            lines = ''.join('{},"name, {}",{}\r\n'.format(j, j, j * .5) for j in range(i * 2500, (i + 1) * 2500))
+            f = gzip.open(os.path.join(root, 'seg{}'.format(i)), 'wb') if i % 2 else open(os.path.join(root, 'seg{}'.format(i)), 'wb')
+            f.write(lines)
+            f.close()
+
+        class Handler(SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(root, path.strip('/'))
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('localhost', 0), Handler)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+
+        urls = ['http://localhost:{}/seg{}'.format(server.server_port, i) for i in range(4)]
+
+        class Column(object):
+            def __init__(self, name):
+                self.name = name
+
+        class OrmTable(object):
+            columns = [Column('id'), Column('name'), Column('value')]
+
+            @property
+            def caster(self):
+                bdr = CasterTransformBuilder()
+                for name, type_ in (('id', int), ('name', str), ('value', float)):
+                    bdr.append(name, type_)
+                return bdr
+
+        class Identity(object):
+            vname = 'source-dataset-subset-variation-0.0.1'
+
+            def as_dataset(self):
+                return self
+
+            vid = 'd000000001'
+
+        class Partition(object):
+            identity = Identity()
+
+            def get_table(self, table_name):
+                return OrmTable()
+
+        path = temp_file_name() + '.db'
+        db = new_database(dict(driver='sqlite', dbname=path), class_='warehouse')
+        db.create()
+        db.connection.execute('CREATE TABLE d000000001_t1 (id INTEGER PRIMARY KEY, name TEXT, value REAL)')
+
+        w = SqliteWarehouse(database=db, wlibrary=object(), elibrary=object(), logger=NullLogger())
+        w.load_batch_size = 1000
+        w.download_threads = 3
+
+        try:
+            self.assertEquals('d000000001_t1', w.load_remote(Partition(), 't1', urls))
+
+            rows = db.connection.execute('SELECT * FROM d000000001_t1 ORDER BY rowid').fetchall()
+            self.assertEquals(10000, len(rows))
+            self.assertEquals((1234, 'name, 1234', 617.0), tuple(rows[1234]))
+
+            # A failed segment rolls back the whole load
+            db.connection.execute('DELETE FROM d000000001_t1')
+            with self.assertRaises(Exception):
+                w.load_remote(Partition(), 't1', urls[:2] + [urls[0] + 'missing'])
+            self.assertEquals(0, db.connection.execute('SELECT count(*) FROM d000000001_t1').fetchone()[0])
+        finally:
+            server.shutdown()
+            db.close()
+            os.remove(path)
+
+    def test_sync_swap(self):
+        from ambry.warehouse.sqlite import SqliteWarehouse
+        from ambry.warehouse import NullLogger
+        from ambry.database import new_database
+        from ambry.util import temp_file_name
+
+        class Column(object):
+            def __init__(self, name, is_primary_key=False):
+                self.name = name
+                self.is_primary_key = is_primary_key
+
+        class OrmTable(object):
+            columns = [Column('id', True), Column('name')]
+            primary_key = columns[0]
+
+        path = temp_file_name() + '.db'
+        db = new_database(dict(driver='sqlite', dbname=path), class_='warehouse')
+        db.create()
+
+        w = SqliteWarehouse(database=db, wlibrary=object(), elibrary=object(), logger=NullLogger())
+
+        try:
+            for table_name in ('t1', 't1_shadow', 't1_same'):
+                db.connection.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, name TEXT)'.format(table_name))
+
+            db.connection.execute("INSERT INTO t1 VALUES (1, 'a'), (2, 'b')")
+            db.connection.execute("INSERT INTO t1_same VALUES (2, 'b'), (1, 'a')")
+            db.connection.execute("INSERT INTO t1_shadow VALUES (1, 'a'), (2, 'c')")
+
+            sig = w.table_signature(db.engine, 't1', OrmTable())
+            self.assertEquals((2, 1, 2), sig[:3])
+            self.assertEquals(sig, w.table_signature(db.engine, 't1_same', OrmTable()))
+
+            shadow_sig = w.table_signature(db.engine, 't1_shadow', OrmTable())
+            self.assertEquals(sig[:3], shadow_sig[:3])
+            self.assertNotEquals(sig, shadow_sig)
+
+            w.swap_table('t1_shadow', 't1')
+
+            self.assertFalse(w.has_table('t1_shadow'))
+            self.assertEquals(shadow_sig, w.table_signature(db.engine, 't1', OrmTable()))
+
+            # A failed swap leaves the table in place
+            with self.assertRaises(Exception):
+                w.swap_table('t1_missing', 't1')
+
+            self.assertEquals(shadow_sig, w.table_signature(db.engine, 't1', OrmTable()))
+
+            # Values that differ past the 12 digits of str(), or only in where a separator is
+            db.connection.execute("DELETE FROM t1")
+            db.connection.execute("DELETE FROM t1_same")
+            db.connection.execute("INSERT INTO t1 VALUES (1, 1.0000000000001), (2, 'a|b'), (3, NULL)")
+            db.connection.execute("INSERT INTO t1_same VALUES (1, 1.0000000000002), (2, 'a|b'), (3, NULL)")
+            self.assertNotEquals(w.table_signature(db.engine, 't1', OrmTable()),
+                                 w.table_signature(db.engine, 't1_same', OrmTable()))
+
+            db.connection.execute("UPDATE t1_same SET name = 1.0000000000001 WHERE id = 1")
+            self.assertEquals(w.table_signature(db.engine, 't1', OrmTable()),
+                              w.table_signature(db.engine, 't1_same', OrmTable()))
+
+            self.assertNotEquals(''.join(map(w._signature_value, ('a|b', 'c'))),
+                                 ''.join(map(w._signature_value, ('a', 'b|c'))))
+
+            db.connection.execute("UPDATE t1_same SET name = 'None' WHERE id = 3")
+            self.assertNotEquals(w.table_signature(db.engine, 't1', OrmTable()),
+                                 w.table_signature(db.engine, 't1_same', OrmTable()))
+        finally:
+            db.close()
+            os.remove(path)
+
+    def test_sync_signature(self):
+        """The pieces of the comparison of a partition to the installed one"""
+        from ambry.warehouse import WarehouseInterface as WI
+        from ambry.util import AttrDict
+
+        rows = [(1, 'a', 1.5), (2, None, 2.5), (3, 'c', None)]
+
+        sig = WI.rows_signature(iter(rows), 0)
+        self.assertEquals((3, 1, 3), sig[:3])
+        self.assertEquals(sig, WI.rows_signature(list(rows), 0))
+        self.assertEquals((3, None, None, sig[3]), WI.rows_signature(rows))
+
+        self.assertNotEquals(sig, WI.rows_signature(rows[::-1], 0))
+        self.assertNotEquals(sig, WI.rows_signature(rows[:2] + [(3, 'c', 0.0)], 0))
+        self.assertEquals((0, None, None), WI.rows_signature([], 0)[:3])
+
+        stats = lambda count, min_key, max_key: AttrDict(count=count, min_key=min_key, max_key=max_key)
+
+        self.assertFalse(WI._stats_changed(stats(3, 1, 3), stats(3, 1, 3)))
+        self.assertTrue(WI._stats_changed(stats(3, 1, 3), stats(4, 1, 4)))
+        self.assertTrue(WI._stats_changed(stats(3, 1, 3), stats(3, 0, 3)))
+        # Stats that were never written can't show a change
+        self.assertFalse(WI._stats_changed(stats(None, None, None), stats(4, 1, 4)))
+
+    def test_sync_plan(self):
+        """sync() sorts partitions into new, changed, unchanged and failed ones"""
+        from ambry.warehouse.sqlite import SqliteWarehouse
+        from ambry.warehouse import NullLogger, ResolutionError
+        from ambry.util import AttrDict
+
+        # name -> (installed vid, whether the partition in the external library differs)
+        installed = {'a': ('a1', True), 'b': ('b1', False), 'c': ('c2', False)}
+
+        class ELibrary(object):
+            def resolve(self, vid):
+                if vid.startswith('x'):
+                    raise ResolutionError("Not found")
+
+                name = vid[0]
+                return AttrDict(vid='d' + vid[1], partition=AttrDict(sname=name, vname=vid, vid=vid))
+
+        class Warehouse(SqliteWarehouse):
+            def _installed_partition(self, name):
+                if name in installed:
+                    return AttrDict(vid=installed[name][0], vname=installed[name][0])
+
+            def _partition_changed(self, old, dataset):
+                return installed[dataset.partition.sname][1], {'t1': (1, 1, 1, 'h')}
+
+            def _installed_tables(self, p_orm):
+                return {'t1': 'w_t1'}
+
+        w = Warehouse(database=object(), wlibrary=object(), elibrary=ELibrary(), logger=NullLogger())
+
+        plan = w._sync_plan(['a2', 'b2', 'c2', 'e2', 'x2'])
+
+        self.assertEquals(['e2'], plan.new)
+        self.assertEquals(['a2'], plan.changed.keys())
+        self.assertEquals('a1', plan.changed['a2'][0].vid)
+        self.assertEquals([('b1', 'b2')], [ (old.vid, dataset.partition.vid) for old, dataset, _ in plan.reassigned ])
+        self.assertEquals(['b2', 'c2'], plan.unchanged)
+        self.assertEquals(['x2'], plan.failed)
+        self.assertEquals({('d2', 't1'): set(['w_t1'])}, dict(plan.targets))
+
+    def test_sync_shared_table(self):
+        """Two partitions of a table share one warehouse table. Replacing one of them keeps
+        the rows of the other"""
+        from ambry.warehouse.sqlite import SqliteWarehouse
+        from ambry.warehouse import NullLogger
+        from ambry.database import new_database
+        from ambry.library.database import LibraryDb
+        from ambry.identity import Identity, Name, DatasetNumber
+        from ambry.orm import Dataset, Partition, Table, Column
+        from ambry.util import temp_file_name, AttrDict
+
+        class Library(object):
+            def __init__(self, database):
+                self.database = database
+
+        # The keys of the partitions' own files
+        keys = {}
+
+        class Warehouse(SqliteWarehouse):
+            def _partition_keys(self, p_orm, table_name):
+                return keys[p_orm.vid]
+
+        lpath = temp_file_name() + '.db'
+        ldb = LibraryDb(driver='sqlite', dbname=lpath)
+        ldb.create()
+
+        path = temp_file_name() + '.db'
+        db = new_database(dict(driver='sqlite', dbname=path), class_='warehouse')
+        db.create()
+
+        w = Warehouse(database=db, wlibrary=Library(ldb), elibrary=object(), logger=NullLogger())
+
+        s = ldb.session
+
+        def install(rev):
+            ident = Identity(Name(source='source.com', dataset='foobar', version='0.0.{}'.format(rev)),
+                             DatasetNumber(1, rev))
+            ldb.install_dataset_identity(ident)
+            ds = s.query(Dataset).filter(Dataset.vid == ident.vid).one()
+
+            t = Table(ds, name='t1', sequence_id=1)
+            s.add(t)
+            s.add(Column(t, name='id', is_primary_key=True, datatype='integer', sequence_id=1))
+            s.add(Column(t, name='name', datatype='varchar', sequence_id=2))
+            s.commit()
+
+            partitions = []
+            for time in ('2010', '2011'):
+                d = ident.as_partition(1, time=time).dict
+                del d['dataset']
+                d['data'] = dict(tables=['t1'])
+                p = Partition(ds, **d)
+                s.add(p)
+                s.commit()
+                partitions.append(p)
+
+            return ds, t, partitions
+
+        def rows(table_name):
+            return sorted(tuple(row) for row in db.connection.execute('SELECT * FROM {}'.format(table_name)))
+
+        try:
+            ds1, t1, (a1, b1) = install(1)
+            ds2, t2, (a2, b2) = install(2)
+
+            db.connection.execute('CREATE TABLE w_t1 (id INTEGER PRIMARY KEY, name TEXT)')
+            db.connection.execute("INSERT INTO w_t1 VALUES (1, 'a'), (2, 'a'), (3, 'b'), (4, 'b')")
+            keys[a1.vid] = [1, 2]
+
+            for p in (a1, b1):
+                ldb.mark_partition_installed(p.vid)
+            ldb.mark_table_installed(t1.vid, 'w_t1')
+
+            self.assertEquals(set([a1.vid, b1.vid]), w._table_users('t1', 'w_t1'))
+
+            # b is unchanged in the new revision, so b2 is re-assigned to the installed table
+            ldb.mark_partition_installed(b2.vid)
+            ldb.mark_table_installed(t2.vid, 'w_t1')
+            ldb.remove_partition(b1.identity)
+
+            users = w._table_users('t1', 'w_t1')
+            self.assertEquals(set([a1.vid, b2.vid]), users)
+
+            # a changed, so a2 is loaded into the table of the new revision
+            shadow = w.augmented_table_name(ds2.vid, 't1')
+            db.connection.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, name TEXT)'.format(shadow))
+            db.connection.execute("INSERT INTO {} VALUES (1, 'A'), (5, 'A')".format(shadow))
+            ldb.mark_partition_installed(a2.vid)
+            ldb.mark_table_installed(t2.vid, shadow)
+
+            w._sync_table(ds2.vid, 't1', 'w_t1', [a2], [a1], users)
+
+            self.assertEquals([(1, 'A'), (3, 'b'), (4, 'b'), (5, 'A')], rows('w_t1'))
+            self.assertFalse(w.has_table(shadow))
+            self.assertEquals(set([a1.vid, a2.vid, b2.vid]), w._table_users('t1', 'w_t1'))
+            self.assertEquals(set(), w._table_users('t1', 'w_t2'))
+            self.assertEquals(set(), w._table_users('t2', 'w_t1'))
+
+            # Many keys are deleted at once, and the keys table doesn't outlast the merge
+            id_ = AttrDict(name='id')
+            db.connection.execute('CREATE TABLE w_t2 (id INTEGER PRIMARY KEY, name TEXT)')
+            db.connection.execute('CREATE TABLE w_t2_shadow (id INTEGER PRIMARY KEY, name TEXT)')
+            db.connection.execute("INSERT INTO w_t2 VALUES " + ','.join("({}, 'old')".format(i) for i in range(500)))
+            db.connection.execute("INSERT INTO w_t2_shadow VALUES (0, 'new'), (1000, 'new')")
+
+            w.merge_table('w_t2_shadow', 'w_t2', AttrDict(columns=[id_, AttrDict(name='name')], primary_key=id_),
+                          range(0, 500, 2))
+
+            self.assertEquals([(0, 'new')] + [ (i, 'old') for i in range(1, 500, 2) ] + [(1000, 'new')], rows('w_t2'))
+            self.assertFalse(w.has_table('w_t2_shadow'))
+            self.assertFalse(w.has_table('w_t2_merge_keys'))
+
+            # A failed merge leaves the installed table as it was, and the table assigned to it
+            keys[a2.vid] = [1, 5]
+            db.connection.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, name TEXT)'.format(shadow))
+            db.connection.execute("INSERT INTO {} VALUES (3, 'A')".format(shadow)) # b's key
+            ldb.mark_table_installed(t2.vid, shadow)
+
+            with self.assertRaises(Exception):
+                w._sync_table(ds2.vid, 't1', 'w_t1', [a2], [a2], users)
+
+            self.assertEquals([(1, 'A'), (3, 'b'), (4, 'b'), (5, 'A')], rows('w_t1'))
+            self.assertFalse(w.has_table(shadow))
+            self.assertEquals('w_t1', s.query(Table).filter(Table.vid == t2.vid).one().installed)
+
+            # When the replaced partitions have all of the rows, the loaded table is swapped in
+            db.connection.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, name TEXT)'.format(shadow))
+            db.connection.execute("INSERT INTO {} VALUES (7, 'c')".format(shadow))
+            ldb.mark_table_installed(t2.vid, shadow)
+
+            w._sync_table(ds2.vid, 't1', 'w_t1', [a2], [a2], set([a2.vid]))
+
+            self.assertEquals([(7, 'c')], rows('w_t1'))
+            self.assertFalse(w.has_table(shadow))
+        finally:
+            db.close()
+            ldb.close()
+            os.remove(path)
+            os.remove(lpath)
+
     def test_manifest(self):
 
         from ambry.warehouse.manifest import Manifest